@@ -0,0 +1,148 @@
+# peak memory and step time of one training step of the Unet3D / GenTron denoisers and of the LFAE
+# for several activation checkpointing settings, to trade compute for a larger batch or more frames
+import argparse
+import timeit
+
+import torch
+import torch.nn.functional as F
+import yaml
+from LFAE.modules.generator import Generator
+from LFAE.modules.bg_motion_predictor import BGMotionPredictor
+from LFAE.modules.region_predictor import RegionPredictor
+from LFAE.modules.util import set_checkpoint_stages
+from DM.modules.vfd import Unet3D, BERT_MODEL_DIM
+from DM.modules.vfdm_with_gentron import DiffusionTransformer
+
+config_pth = "config/mhad128.yaml"
+# each setting is a list of stages, see LFAE.modules.util.checkpoint_levels
+SETTINGS = {
+    "unet": [[], ["mid"], ["downs.0", "ups.3"], ["downs", "ups"], ["downs", "mid", "ups"]],
+    "gentron": [[], ["blocks.0", "blocks.1"], ["blocks"]],
+    "lfae": [[], ["encoder"], ["decoder"], ["encoder", "decoder"]],
+}
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Activation checkpointing benchmark")
+    parser.add_argument("--model", default="unet", choices=list(SETTINGS))
+    parser.add_argument("--config", type=str, default=config_pth)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--n-frames", type=int, default=40)
+    parser.add_argument("--input-size", type=int, default=128,
+                        help="Frame size, the denoisers run at a quarter of it.")
+    parser.add_argument("--num-steps", type=int, default=5)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    return parser.parse_args()
+
+
+def build_step(args):
+    """
+    model and a function running forward + backward of one training step on fixed random inputs
+    """
+    device = args.device
+    bs, nf, size = args.batch_size, args.n_frames, args.input_size // 4
+    if args.model == "unet":
+        # learned null condition, the zero one is created directly on cuda
+        model = Unet3D(dim=64, channels=3 + 256, out_grid_dim=2, out_conf_dim=1, dim_mults=(1, 2, 4, 8),
+                       use_bert_text_cond=True, learn_null_cond=True).to(device)
+        flow = torch.randn(bs, 3, nf, size, size, device=device)
+        fea = torch.randn(bs, 256, size, size, device=device)
+        t = torch.randint(0, 1000, (bs,), device=device)
+        cond = torch.randn(bs, BERT_MODEL_DIM, device=device)
+        target = torch.randn(bs, 3, nf, size, size, device=device)
+
+        def step():
+            out = model(flow, t, cond=cond, fea_emb=model.encode_fea(fea))
+            F.mse_loss(out, target).backward()
+    elif args.model == "gentron":
+        model = DiffusionTransformer(64, 4, 2, 16, 64 * 2, time_emb_dim=64, out_channels=2).to(device)
+        flow = torch.randn(bs, 2, nf, size, size, device=device)
+        fea = torch.randn(bs, 256, size, size, device=device)
+        t = torch.randint(0, 1000, (bs,), device=device)
+        target = torch.randn(bs, 2, nf, size, size, device=device)
+        model.encode_fea(fea)
+
+        def step():
+            out = model(flow, t, fea_emb=model.encode_fea(fea))
+            F.mse_loss(out, target).backward()
+    else:
+        with open(args.config) as f:
+            config = yaml.safe_load(f)
+        model_params = config['model_params']
+        generator = Generator(num_regions=model_params['num_regions'], num_channels=model_params['num_channels'],
+                              revert_axis_swap=model_params['revert_axis_swap'],
+                              **model_params['generator_params'])
+        region_predictor = RegionPredictor(num_regions=model_params['num_regions'],
+                                           num_channels=model_params['num_channels'],
+                                           estimate_affine=model_params['estimate_affine'],
+                                           **model_params['region_predictor_params'])
+        bg_predictor = BGMotionPredictor(num_channels=model_params['num_channels'],
+                                         **model_params['bg_predictor_params'])
+        model = torch.nn.ModuleDict({"generator": generator, "region_predictor": region_predictor,
+                                     "bg_predictor": bg_predictor}).to(device)
+        source = torch.rand(bs, 3, args.input_size, args.input_size, device=device)
+        driving = torch.rand(bs, 3, args.input_size, args.input_size, device=device)
+
+        def step():
+            # reconstruction loss only, the perceptual and equivariance terms need pretrained networks
+            source_region_params = region_predictor(source)
+            driving_region_params = region_predictor(driving)
+            bg_params = bg_predictor(source, driving)
+            generated = generator(source, source_region_params=source_region_params,
+                                  driving_region_params=driving_region_params, bg_params=bg_params)
+            F.l1_loss(generated["prediction"], driving).backward()
+    return model, step
+
+
+def saved_activation_bytes(step):
+    """
+    bytes of the tensors kept for backward at the end of the forward pass, also available on cpu
+    """
+    storages = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        step()
+    return sum(storages.values())
+
+
+def main():
+    args = get_arguments()
+    torch.manual_seed(0)
+    model, step = build_step(args)
+    model.train()
+    is_cuda = torch.device(args.device).type == "cuda"
+    ref_grads = None
+    for stages in SETTINGS[args.model]:
+        set_checkpoint_stages(model, stages)
+        # same random state for every setting, the lfae regions and the batch norms see the same batch
+        torch.manual_seed(0)
+        model.zero_grad(set_to_none=True)
+        saved = saved_activation_bytes(step)
+        grads = [p.grad.clone() for p in model.parameters() if p.grad is not None]
+        if ref_grads is None:
+            ref_grads = grads
+        grad_diff = max((g - r).abs().max().item() for g, r in zip(grads, ref_grads))
+
+        if is_cuda:
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        start = timeit.default_timer()
+        for _ in range(args.num_steps):
+            model.zero_grad(set_to_none=True)
+            step()
+        if is_cuda:
+            torch.cuda.synchronize()
+        step_time = (timeit.default_timer() - start) / args.num_steps
+        peak = "%.0f MB" % (torch.cuda.max_memory_allocated() / 2 ** 20) if is_cuda else "n/a"
+        print("%-24s %8.1f ms/step, saved activations %7.1f MB, peak memory %s, max grad diff %.2e"
+              % (",".join(stages) or "none", step_time * 1000, saved / 2 ** 20, peak, grad_diff))
+    set_checkpoint_stages(model, ())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# loader throughput of the MHAD frame directories (PNG / JPG decoding) against the frames packed by
+# preprocessing/pack_MHAD.py, and the largest difference between the clips both return without jitter
+import argparse
+import timeit
+
+import numpy as np
+from torch.utils import data
+from DM.datasets_mhad import MHAD, MHAD_packed, MHAD_test, MHAD_test_packed
+
+data_dir = "/kaggle/input/mhad-mini/crop_image_mini"
+PACK_DIR = "log/packed_mhad128"
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="MHAD loader benchmark")
+    parser.add_argument("--data-dir", type=str, default=data_dir)
+    parser.add_argument("--pack-dir", type=str, default=PACK_DIR)
+    parser.add_argument("--split", default="train", choices=["train", "test"])
+    parser.add_argument("--input-size", type=int, default=128)
+    parser.add_argument("--n-frames", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--num-epochs", type=int, default=2)
+    parser.add_argument("--color-jitter", action="store_true")
+    return parser.parse_args()
+
+
+def build(args, packed, color_jitter):
+    if args.split == "train":
+        if packed:
+            return MHAD_packed(args.pack_dir, num_frames=args.n_frames, image_size=args.input_size,
+                               color_jitter=color_jitter, sampling="uniform")
+        return MHAD(args.data_dir, num_frames=args.n_frames, image_size=args.input_size,
+                    color_jitter=color_jitter, sampling="uniform")
+    if packed:
+        return MHAD_test_packed(args.pack_dir, num_frames=args.n_frames, image_size=args.input_size,
+                                color_jitter=color_jitter)
+    return MHAD_test(args.data_dir, num_frames=args.n_frames, image_size=args.input_size,
+                     color_jitter=color_jitter)
+
+
+def throughput(dataset, args):
+    """
+    clips per second over num_epochs epochs, the first batch (worker start-up) is not timed
+    """
+    loader = data.DataLoader(dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers,
+                             persistent_workers=args.num_workers > 0)
+    num_clips = 0
+    start = None
+    for epoch in range(args.num_epochs):
+        for batch in loader:
+            if start is None:
+                start = timeit.default_timer()
+                continue
+            num_clips += batch[0].size(0)
+    return num_clips / (timeit.default_timer() - start)
+
+
+def main():
+    args = get_arguments()
+    frames, packed = build(args, False, False), build(args, True, False)
+    assert len(frames) == len(packed), "the pack does not hold the same videos as data_dir"
+    diff = 0.
+    for idx in range(len(frames)):
+        clip, _, name = frames[idx]
+        packed_clip, _, packed_name = packed[idx]
+        assert name == packed_name
+        diff = max(diff, float(np.abs(clip - packed_clip).max()))
+    print("%d videos, max abs diff %.2e (uint8 rounding of the resize done when packing)" % (len(frames), diff))
+
+    for name, packed in [("frames", False), ("packed", True)]:
+        clips_per_s = throughput(build(args, packed, args.color_jitter), args)
+        print("%-8s %8.1f clips/s, %7.1f frames/s" % (name, clips_per_s, clips_per_s * args.n_frames))
+
+
+if __name__ == "__main__":
+    main()
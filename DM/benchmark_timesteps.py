@@ -0,0 +1,88 @@
+# training throughput of FlowDiffusion / FlowDiffusionGenTron for several numbers of diffusion time steps per
+# clip (--timesteps-per-clip of the trainers): the frozen LFAE extracts the flow of a clip once and the denoiser
+# is trained on timesteps_per_clip noised copies of it in one batch. Clips/s falls with k while denoiser
+# samples/s rises as long as the LFAE pass is a large part of the step, pick k where the latter flattens out
+import argparse
+import timeit
+
+import torch
+from DM.modules.vfd import BERT_MODEL_DIM
+from DM.modules.vfdm import FlowDiffusion, extract_pseudo_gt_flow
+from DM.modules.vfdm_with_gentron import FlowDiffusionGenTron
+
+config_pth = "config/mhad128.yaml"
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Time steps per clip benchmark")
+    parser.add_argument("--model", default="unet", choices=["unet", "gentron"])
+    parser.add_argument("--config", type=str, default=config_pth)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--n-frames", type=int, default=40)
+    parser.add_argument("--input-size", type=int, default=128)
+    parser.add_argument("--timesteps-per-clip", type=lambda x: [int(k) for k in x.split(",")], default=[1, 2, 4, 8],
+                        help="Comma separated values to compare.")
+    parser.add_argument("--num-steps", type=int, default=5)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    return parser.parse_args()
+
+
+def build_model(args, timesteps_per_clip):
+    # random LFAE weights, the step time does not depend on them
+    if args.model == "unet":
+        return FlowDiffusion(img_size=args.input_size // 4, num_frames=args.n_frames, config_pth=args.config,
+                             timesteps_per_clip=timesteps_per_clip)
+    return FlowDiffusionGenTron(img_size=args.input_size // 4, num_frames=args.n_frames, sampling_timesteps=250,
+                                null_cond_prob=0.1, ddim_sampling_eta=1.0, timesteps=1000, dim=64, depth=4,
+                                heads=2, dim_head=16, mlp_dim=64 * 2, lr=1e-4, adam_betas=(0.9, 0.99),
+                                is_train=True, only_use_flow=True, use_residual_flow=False, pretrained_pth="",
+                                config_pth=args.config, timesteps_per_clip=timesteps_per_clip)
+
+
+def timed(fn, num_steps, is_cuda):
+    fn()
+    if is_cuda:
+        torch.cuda.synchronize()
+    start = timeit.default_timer()
+    for _ in range(num_steps):
+        fn()
+    if is_cuda:
+        torch.cuda.synchronize()
+    return (timeit.default_timer() - start) / num_steps
+
+
+def main():
+    args = get_arguments()
+    is_cuda = torch.device(args.device).type == "cuda"
+    bs = args.batch_size
+    real_vid = torch.rand(bs, 3, args.n_frames, args.input_size, args.input_size, device=args.device)
+    ref_img = real_vid[:, :, 0].clone()
+    # precomputed BERT embeddings, BERT itself is not timed
+    ref_text = torch.randn(bs, BERT_MODEL_DIM, device=args.device)
+    print("%s, %d clips of %d frames, %dx%d, %s"
+          % (args.model, bs, args.n_frames, args.input_size, args.input_size, args.device))
+
+    for k in args.timesteps_per_clip:
+        torch.manual_seed(0)
+        model = build_model(args, k).to(args.device)
+        if k == args.timesteps_per_clip[0]:
+            lfae_time = timed(lambda: extract_pseudo_gt_flow(model.region_predictor, model.bg_predictor,
+                                                             model.generator, ref_img, real_vid),
+                              args.num_steps, is_cuda)
+            print("lfae flow extraction %8.1f ms/step" % (lfae_time * 1e3))
+
+        def step():
+            model.set_train_input(ref_img=ref_img, real_vid=real_vid, ref_text=ref_text)
+            model.optimize_parameters()
+
+        if is_cuda:
+            torch.cuda.reset_peak_memory_stats()
+        step_time = timed(step, args.num_steps, is_cuda)
+        peak = "%.0f MB" % (torch.cuda.max_memory_allocated() / 2 ** 20) if is_cuda else "n/a"
+        print("k=%-3d %8.1f ms/step, %7.2f clips/s, %8.2f denoiser samples/s, peak memory %s"
+              % (k, step_time * 1e3, bs / step_time, bs * k / step_time, peak))
+        del model
+
+
+if __name__ == "__main__":
+    main()
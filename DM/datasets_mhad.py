@@ -1,541 +1,470 @@
-# loading MHAD dataset for training and testing
-import os
-import random
-
-import numpy as np
-import torch.utils.data as data
-import imageio
-from misc import resize
-import cv2
-import torchvision.transforms.functional as F
-import matplotlib
-import matplotlib.pyplot as plt
-from PIL import Image
-
-
-class MHAD(data.Dataset):
-    def __init__(self, data_dir, num_frames=40, image_size=128, transform=None,
-                 mean=(0, 0, 0), color_jitter=True, split_train_test=True,
-                 sampling="random"):
-        super(MHAD, self).__init__()
-        self.mean = mean
-        self.is_jitter = color_jitter
-        self.sampling = sampling
-
-        self.action_list = ["right arm swipe to the left",
-                            "right arm swipe to the right",
-                            "right hand wave",
-                            "two hand front clap",
-                            "right arm throw",
-                            "cross arms in the chest",
-                            "basketball shooting",
-                            "draw x",
-                            "draw circle clockwise",
-                            "draw circle counter clockwise",
-                            "draw triangle",
-                            "right hand bowling",
-                            "front boxing",
-                            "baseball swing from right",
-                            "tennis forehand swing",
-                            "two arms curl",
-                            "tennis serve",
-                            "two hand push",
-                            "knock on door",
-                            "hand catch",
-                            "pick up and throw",
-                            "jogging",
-                            "walking",
-                            "sit to stand",
-                            "stand to sit",
-                            "forward lunge (left foot forward)",
-                            "squat"]
-        self.num_frames = num_frames
-        self.image_size = image_size
-        video_name_list = os.listdir(data_dir)
-        video_name_list.sort()
-
-        if split_train_test:
-            train_ID = [1, 5, 2, 3]
-            train_video_name_list = []
-            for video_name in video_name_list:
-                sub_name = int(video_name.split("_")[1][1:])
-                if sub_name in train_ID:
-                    train_video_name_list.append(video_name)
-
-        if split_train_test:
-            self.video_path_list = [os.path.join(data_dir, video_name) for video_name in train_video_name_list]
-        else:
-            self.video_path_list = [os.path.join(data_dir, video_name) for video_name in video_name_list]
-
-    def __len__(self):
-        return len(self.video_path_list)
-
-    def __getitem__(self, index):
-        video_path = self.video_path_list[index]
-        video_name = os.path.basename(video_path)
-        action_idx = int(video_name.split("_")[0][1:])
-        action_name = self.action_list[action_idx - 1]
-        frame_name_list = os.listdir(video_path)
-        frame_name_list.sort()
-        frame_path_list = [os.path.join(video_path, frame_name) for frame_name in frame_name_list]
-        total_num_frames = len(frame_path_list)
-        if total_num_frames >= self.num_frames:
-            # uniform sampling
-            if self.sampling == "uniform":
-                sample_idx_list = np.linspace(start=0, stop=total_num_frames-1, num=self.num_frames, dtype=int)
-            if self.sampling == "random":
-                uniform_idx_list = np.linspace(start=0, stop=total_num_frames-1, num=self.num_frames, dtype=int)
-                step_list = uniform_idx_list[1:] - uniform_idx_list[0:-1]
-                sample_idx_list = uniform_idx_list.copy()
-                for ii in range(1, self.num_frames - 1):
-                    low = 1-step_list[ii-1]
-                    high = +step_list[ii]
-                    sample_idx_list[ii] = sample_idx_list[ii] + np.random.randint(low=low, high=high)
-                sample_idx_list = np.sort(sample_idx_list)
-                # compare = np.stack((uniform_idx_list, np.sort(sample_idx_list)))
-        else:
-            # simply repeat the final frame
-            sample_idx_list = np.pad(list(range(total_num_frames)), (0, self.num_frames-total_num_frames), "edge")
-
-        # very random sampling
-        if self.sampling == "very_random":
-            sample_idx_list = np.sort(np.random.choice(total_num_frames, self.num_frames, replace=True))
-            # make the first frame to be 0
-            sample_idx_list[0] = 0
-
-        sample_frame_path_list = [frame_path_list[x] for x in sample_idx_list]
-        # read image
-        sample_frame_list = [imageio.imread(x) for x in sample_frame_path_list]
-        # data augmentation
-        sample_frame_list = [Image.fromarray(x) for x in sample_frame_list]
-        if self.is_jitter:
-            bright = 64. / 255
-            contrast = 0.25
-            sat = 0.25
-            hue = 0.04
-            bright_f = random.uniform(max(0, 1 - bright), 1 + bright)
-            contrast_f = random.uniform(max(0, 1 - contrast), 1 + contrast)
-            sat_f = random.uniform(max(0, 1 - sat), 1 + sat)
-            hue_f = random.uniform(-hue, hue)
-            sample_frame_list = [F.adjust_brightness(x, bright_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_contrast(x, contrast_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_saturation(x, sat_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_hue(x, hue_f) for x in sample_frame_list]
-        sample_frame_list = [np.asarray(x, np.float32) for x in sample_frame_list]
-        # resize to (image_size, image_size)
-        sample_frame_list = [resize(x, self.image_size, interpolation=cv2.INTER_AREA) for x in sample_frame_list]
-        sample_frame_list = [x - self.mean for x in sample_frame_list]
-        sample_frame_list = [np.transpose(x, (2, 0, 1)) for x in sample_frame_list]
-        sample_frame_list_npy = np.stack(sample_frame_list, axis=1)
-        # change to float32
-        sample_frame_list_npy = np.array(sample_frame_list_npy/255.0, dtype=np.float32)
-        return sample_frame_list_npy, action_name, video_name
-
-
-class MHAD_test(data.Dataset):
-    def __init__(self, data_dir, num_frames=40, image_size=256,
-                 mean=(0, 0, 0), color_jitter=False, split_train_test=True):
-        super(MHAD_test, self).__init__()
-        self.mean = mean
-        self.is_jitter = color_jitter
-
-        self.action_list = ["right arm swipe to the left",
-                            "right arm swipe to the right",
-                            "right hand wave",
-                            "two hand front clap",
-                            "right arm throw",
-                            "cross arms in the chest",
-                            "basketball shooting",
-                            "draw x",
-                            "draw circle clockwise",
-                            "draw circle counter clockwise",
-                            "draw triangle",
-                            "right hand bowling",
-                            "front boxing",
-                            "baseball swing from right",
-                            "tennis forehand swing",
-                            "two arms curl",
-                            "tennis serve",
-                            "two hand push",
-                            "knock on door",
-                            "hand catch",
-                            "pick up and throw",
-                            "jogging",
-                            "walking",
-                            "sit to stand",
-                            "stand to sit",
-                            "forward lunge (left foot forward)",
-                            "squat"]
-        self.num_frames = num_frames
-        self.image_size = image_size
-        video_name_list = os.listdir(data_dir)
-        video_name_list.sort()
-
-        if split_train_test:
-            test_ID = [6, 8, 4, 7]
-            test_video_name_list = []
-            for video_name in video_name_list:
-                sub_name = int(video_name.split("_")[1][1:])
-                if sub_name in test_ID:
-                    test_video_name_list.append(video_name)
-
-        if split_train_test:
-            self.video_path_list = [os.path.join(data_dir, video_name) for video_name in test_video_name_list]
-        else:
-            self.video_path_list = [os.path.join(data_dir, video_name) for video_name in video_name_list]
-
-    def __len__(self):
-        return len(self.video_path_list)
-
-    def __getitem__(self, index):
-        video_path = self.video_path_list[index]
-        video_name = os.path.basename(video_path)
-        action_idx = int(video_name.split("_")[0][1:])
-        action_name = self.action_list[action_idx - 1]
-        frame_name_list = os.listdir(video_path)
-        frame_name_list.sort()
-        frame_path_list = [os.path.join(video_path, frame_name) for frame_name in frame_name_list]
-        total_num_frames = len(frame_path_list)
-        if total_num_frames >= self.num_frames:
-            # uniform sampling
-            sample_idx_list = np.linspace(start=0, stop=total_num_frames-1, num=self.num_frames, dtype=int)
-        else:
-            # simply repeat the final frame
-            sample_idx_list = np.pad(list(range(total_num_frames)), (0, self.num_frames-total_num_frames), "edge")
-        sample_frame_path_list = [frame_path_list[x] for x in sample_idx_list]
-        # read image
-        sample_frame_list = [imageio.imread(x) for x in sample_frame_path_list]
-        # data augmentation
-        sample_frame_list = [Image.fromarray(x) for x in sample_frame_list]
-        if self.is_jitter:
-            bright = 64. / 255
-            contrast = 0.25
-            sat = 0.25
-            hue = 0.04
-            bright_f = random.uniform(max(0, 1 - bright), 1 + bright)
-            contrast_f = random.uniform(max(0, 1 - contrast), 1 + contrast)
-            sat_f = random.uniform(max(0, 1 - sat), 1 + sat)
-            hue_f = random.uniform(-hue, hue)
-            sample_frame_list = [F.adjust_brightness(x, bright_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_contrast(x, contrast_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_saturation(x, sat_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_hue(x, hue_f) for x in sample_frame_list]
-        sample_frame_list = [np.asarray(x, np.float32) for x in sample_frame_list]
-        # resize to (image_size, image_size)
-        sample_frame_list = [resize(x, self.image_size, interpolation=cv2.INTER_AREA) for x in sample_frame_list]
-        sample_frame_list = [x - self.mean for x in sample_frame_list]
-        sample_frame_list = [np.transpose(x, (2, 0, 1)) for x in sample_frame_list]
-        sample_frame_list_npy = np.stack(sample_frame_list, axis=1)
-        # change to float32
-        sample_frame_list_npy = np.array(sample_frame_list_npy/255.0, dtype=np.float32)
-        return sample_frame_list_npy, action_name, video_name
-
-
-# for consistently generating videos
-class MHAD_gen(data.Dataset):
-    def __init__(self, data_dir, num_frames=40, image_size=128,
-                 mean=(0, 0, 0), color_jitter=False, sampling="very_random"):
-        super(MHAD_gen, self).__init__()
-        self.sampling = sampling
-        self.mean = mean
-        self.is_jitter = color_jitter
-
-        self.action_list = ["right arm swipe to the left",
-                            "right arm swipe to the right",
-                            "right hand wave",
-                            "two hand front clap",
-                            "right arm throw",
-                            "cross arms in the chest",
-                            "basketball shooting",
-                            "draw x",
-                            "draw circle clockwise",
-                            "draw circle counter clockwise",
-                            "draw triangle",
-                            "right hand bowling",
-                            "front boxing",
-                            "baseball swing from right",
-                            "tennis forehand swing",
-                            "two arms curl",
-                            "tennis serve",
-                            "two hand push",
-                            "knock on door",
-                            "hand catch",
-                            "pick up and throw",
-                            "jogging",
-                            "walking",
-                            "sit to stand",
-                            "stand to sit",
-                            "forward lunge (left foot forward)",
-                            "squat"]
-        self.num_frames = num_frames
-        self.image_size = image_size
-        video_name_list = os.listdir(data_dir)
-        video_name_list.sort()
-
-        self.test_ID = [6, 8, 4, 7]
-        test_video_name_list = []
-        for video_name in video_name_list:
-            sub_name = int(video_name.split("_")[1][1:])
-            if sub_name in self.test_ID:
-                test_video_name_list.append(video_name)
-
-        self.num_combs = len(self.test_ID) * len(self.action_list)
-
-        self.video_path_list = [os.path.join(data_dir, video_name) for video_name in test_video_name_list]
-
-        # group each video
-        self.video_dict = {}
-        for comb_idx in range(self.num_combs):
-            sub_idx = comb_idx % 4
-            action_idx = comb_idx // 4
-            sub_name = self.test_ID[sub_idx]
-            action_name = self.action_list[action_idx]
-            if sub_name not in self.video_dict.keys():
-                self.video_dict[sub_name] = {}
-            self.video_dict[sub_name][action_name] = []
-
-        for video_path in self.video_path_list:
-            video_name = os.path.basename(video_path)
-            action_idx = int(video_name.split("_")[0][1:])
-            action_name = self.action_list[action_idx - 1]
-            sub_name = int(video_name.split("_")[1][1:])
-            assert sub_name in self.test_ID
-            assert action_name in self.action_list
-            self.video_dict[sub_name][action_name].append(video_path)
-
-    def __len__(self):
-        return self.num_combs
-
-    def __getitem__(self, index):
-        sub_idx = index % 4
-        action_idx = index // 4
-        sub_name = self.test_ID[sub_idx]
-        action_name = self.action_list[action_idx]
-        video_path_list = self.video_dict[sub_name][action_name]
-        assert len(video_path_list) > 0
-        video_path = str(np.random.choice(video_path_list, size=1)[0])
-        video_name = os.path.basename(video_path)
-        frame_name_list = os.listdir(video_path)
-        frame_name_list.sort()
-        frame_path_list = [os.path.join(video_path, frame_name) for frame_name in frame_name_list]
-        total_num_frames = len(frame_path_list)
-        if total_num_frames >= self.num_frames:
-            # uniform sampling
-            sample_idx_list = np.linspace(start=0, stop=total_num_frames-1, num=self.num_frames, dtype=int)
-        else:
-            # simply repeat the final frame
-            sample_idx_list = np.pad(list(range(total_num_frames)), (0, self.num_frames-total_num_frames), "edge")
-
-        # very random sampling
-        if self.sampling == "very_random":
-            sample_idx_list = np.sort(np.random.choice(total_num_frames, self.num_frames, replace=True))
-            # make the first frame to be 0
-            sample_idx_list[0] = 0
-
-        sample_frame_path_list = [frame_path_list[x] for x in sample_idx_list]
-        # read image
-        sample_frame_list = [imageio.v2.imread(x) for x in sample_frame_path_list]
-        # data augmentation
-        sample_frame_list = [Image.fromarray(x) for x in sample_frame_list]
-        if self.is_jitter:
-            bright = 64. / 255
-            contrast = 0.25
-            sat = 0.25
-            hue = 0.04
-            bright_f = random.uniform(max(0, 1 - bright), 1 + bright)
-            contrast_f = random.uniform(max(0, 1 - contrast), 1 + contrast)
-            sat_f = random.uniform(max(0, 1 - sat), 1 + sat)
-            hue_f = random.uniform(-hue, hue)
-            sample_frame_list = [F.adjust_brightness(x, bright_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_contrast(x, contrast_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_saturation(x, sat_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_hue(x, hue_f) for x in sample_frame_list]
-        sample_frame_list = [np.asarray(x, np.float32) for x in sample_frame_list]
-        # resize to (image_size, image_size)
-        sample_frame_list = [resize(x, self.image_size, interpolation=cv2.INTER_AREA) for x in sample_frame_list]
-        sample_frame_list = [x - self.mean for x in sample_frame_list]
-        sample_frame_list = [np.transpose(x, (2, 0, 1)) for x in sample_frame_list]
-        sample_frame_list_npy = np.stack(sample_frame_list, axis=1)
-        # change to float32
-        sample_frame_list_npy = np.array(sample_frame_list_npy/255.0, dtype=np.float32)
-        return sample_frame_list_npy, action_name, video_name
-
-
-# select one subject and one action
-class MHAD_select(data.Dataset):
-    def __init__(self, data_dir, num_frames=40, image_size=128,
-                 mean=(0, 0, 0), color_jitter=False, sampling="very_random"):
-        super(MHAD_select, self).__init__()
-        self.sampling = sampling
-        self.mean = mean
-        self.is_jitter = color_jitter
-
-        self.action_list = ["right arm swipe to the left",
-                            "right arm swipe to the right",
-                            "right hand wave",
-                            "two hand front clap",
-                            "right arm throw",
-                            "cross arms in the chest",
-                            "basketball shooting",
-                            "draw x",
-                            "draw circle clockwise",
-                            "draw circle counter clockwise",
-                            "draw triangle",
-                            "right hand bowling",
-                            "front boxing",
-                            "baseball swing from right",
-                            "tennis forehand swing",
-                            "two arms curl",
-                            "tennis serve",
-                            "two hand push",
-                            "knock on door",
-                            "hand catch",
-                            "pick up and throw",
-                            "jogging",
-                            "walking",
-                            "sit to stand",
-                            "stand to sit",
-                            "forward lunge (left foot forward)",
-                            "squat"]
-        self.num_frames = num_frames
-        self.image_size = image_size
-        video_name_list = os.listdir(data_dir)
-        video_name_list.sort()
-
-        self.ID = list(range(1, 9))
-
-        self.num_combs = len(self.ID) * len(self.action_list)
-
-        self.video_path_list = [os.path.join(data_dir, video_name) for video_name in video_name_list]
-
-        # group each video according to subject and expression
-        self.video_dict = {}
-        for comb_idx in range(self.num_combs):
-            sub_idx = comb_idx % 8
-            action_idx = comb_idx // 8
-            sub_name = self.ID[sub_idx]
-            action_name = self.action_list[action_idx]
-            if sub_name not in self.video_dict.keys():
-                self.video_dict[sub_name] = {}
-            self.video_dict[sub_name][action_name] = []
-
-        for video_path in self.video_path_list:
-            video_name = os.path.basename(video_path)
-            action_idx = int(video_name.split("_")[0][1:])
-            action_name = self.action_list[action_idx - 1]
-            sub_name = int(video_name.split("_")[1][1:])
-            assert sub_name in self.ID
-            assert action_name in self.action_list
-            self.video_dict[sub_name][action_name].append(video_path)
-
-    def __len__(self):
-        return self.num_combs
-
-    def select(self, sub_name, action_name):
-        video_path_list = self.video_dict[sub_name][action_name]
-        assert len(video_path_list) > 0
-        video_path = str(np.random.choice(video_path_list, size=1)[0])
-        video_name = os.path.basename(video_path)
-        frame_name_list = os.listdir(video_path)
-        frame_name_list.sort()
-        frame_path_list = [os.path.join(video_path, frame_name) for frame_name in frame_name_list]
-        total_num_frames = len(frame_path_list)
-        if total_num_frames >= self.num_frames:
-            # uniform sampling
-            sample_idx_list = np.linspace(start=0, stop=total_num_frames-1, num=self.num_frames, dtype=int)
-        else:
-            # simply repeat the final frame
-            sample_idx_list = np.pad(list(range(total_num_frames)), (0, self.num_frames-total_num_frames), "edge")
-
-        # very random sampling
-        if self.sampling == "very_random":
-            sample_idx_list = np.sort(np.random.choice(total_num_frames, self.num_frames, replace=True))
-            # make the first frame to be 0
-            sample_idx_list[0] = 0
-
-        sample_frame_path_list = [frame_path_list[x] for x in sample_idx_list]
-        # read image
-        sample_frame_list = [imageio.v2.imread(x) for x in sample_frame_path_list]
-        # data augmentation
-        sample_frame_list = [Image.fromarray(x) for x in sample_frame_list]
-        if self.is_jitter:
-            bright = 64. / 255
-            contrast = 0.25
-            sat = 0.25
-            hue = 0.04
-            bright_f = random.uniform(max(0, 1 - bright), 1 + bright)
-            contrast_f = random.uniform(max(0, 1 - contrast), 1 + contrast)
-            sat_f = random.uniform(max(0, 1 - sat), 1 + sat)
-            hue_f = random.uniform(-hue, hue)
-            sample_frame_list = [F.adjust_brightness(x, bright_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_contrast(x, contrast_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_saturation(x, sat_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_hue(x, hue_f) for x in sample_frame_list]
-        sample_frame_list = [np.asarray(x, np.float32) for x in sample_frame_list]
-        # resize to (image_size, image_size)
-        sample_frame_list = [resize(x, self.image_size, interpolation=cv2.INTER_AREA) for x in sample_frame_list]
-        sample_frame_list = [x - self.mean for x in sample_frame_list]
-        sample_frame_list = [np.transpose(x, (2, 0, 1)) for x in sample_frame_list]
-        sample_frame_list_npy = np.stack(sample_frame_list, axis=1)
-        # change to float32
-        sample_frame_list_npy = np.array(sample_frame_list_npy/255.0, dtype=np.float32)
-        return sample_frame_list_npy, action_name, video_name
-
-    def __getitem__(self, index):
-        sub_idx = index % 8
-        action_idx = index // 8
-        sub_name = self.ID[sub_idx]
-        action_name = self.action_list[action_idx]
-        video_path_list = self.video_dict[sub_name][action_name]
-        assert len(video_path_list) > 0
-        video_path = str(np.random.choice(video_path_list, size=1)[0])
-        video_name = os.path.basename(video_path)
-        frame_name_list = os.listdir(video_path)
-        frame_name_list.sort()
-        frame_path_list = [os.path.join(video_path, frame_name) for frame_name in frame_name_list]
-        total_num_frames = len(frame_path_list)
-        if total_num_frames >= self.num_frames:
-            # uniform sampling
-            sample_idx_list = np.linspace(start=0, stop=total_num_frames-1, num=self.num_frames, dtype=int)
-        else:
-            # simply repeat the final frame
-            sample_idx_list = np.pad(list(range(total_num_frames)), (0, self.num_frames-total_num_frames), "edge")
-
-        # very random sampling
-        if self.sampling == "very_random":
-            sample_idx_list = np.sort(np.random.choice(total_num_frames, self.num_frames, replace=True))
-            # make the first frame to be 0
-            sample_idx_list[0] = 0
-
-        sample_frame_path_list = [frame_path_list[x] for x in sample_idx_list]
-        # read image
-        sample_frame_list = [imageio.v2.imread(x) for x in sample_frame_path_list]
-        # data augmentation
-        sample_frame_list = [Image.fromarray(x) for x in sample_frame_list]
-        if self.is_jitter:
-            bright = 64. / 255
-            contrast = 0.25
-            sat = 0.25
-            hue = 0.04
-            bright_f = random.uniform(max(0, 1 - bright), 1 + bright)
-            contrast_f = random.uniform(max(0, 1 - contrast), 1 + contrast)
-            sat_f = random.uniform(max(0, 1 - sat), 1 + sat)
-            hue_f = random.uniform(-hue, hue)
-            sample_frame_list = [F.adjust_brightness(x, bright_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_contrast(x, contrast_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_saturation(x, sat_f) for x in sample_frame_list]
-            sample_frame_list = [F.adjust_hue(x, hue_f) for x in sample_frame_list]
-        sample_frame_list = [np.asarray(x, np.float32) for x in sample_frame_list]
-        # resize to (image_size, image_size)
-        sample_frame_list = [resize(x, self.image_size, interpolation=cv2.INTER_AREA) for x in sample_frame_list]
-        sample_frame_list = [x - self.mean for x in sample_frame_list]
-        sample_frame_list = [np.transpose(x, (2, 0, 1)) for x in sample_frame_list]
-        sample_frame_list_npy = np.stack(sample_frame_list, axis=1)
-        # change to float32
-        sample_frame_list_npy = np.array(sample_frame_list_npy/255.0, dtype=np.float32)
-        return sample_frame_list_npy, action_name, video_name
-
-
-if __name__ == "__main__":
-    pass
-
+# loading MHAD dataset for training and testing
+import os
+import random
+import json
+
+import numpy as np
+import torch.utils.data as data
+import imageio
+from misc import resize
+from preprocessing.manifest_MHAD import load_manifest
+import cv2
+from LFAE.augmentation import adjust_brightness_clip, adjust_contrast_clip, adjust_saturation_clip, adjust_hue_clip
+import matplotlib
+import matplotlib.pyplot as plt
+
+
+def sample_frame_idx(total_num_frames, num_frames, sampling):
+    """
+    Pick num_frames frame indices out of total_num_frames, the first index is always 0
+    """
+    if total_num_frames >= num_frames:
+        # uniform sampling
+        if sampling == "uniform":
+            sample_idx_list = np.linspace(start=0, stop=total_num_frames-1, num=num_frames, dtype=int)
+        if sampling == "random":
+            uniform_idx_list = np.linspace(start=0, stop=total_num_frames-1, num=num_frames, dtype=int)
+            step_list = uniform_idx_list[1:] - uniform_idx_list[0:-1]
+            sample_idx_list = uniform_idx_list.copy()
+            for ii in range(1, num_frames - 1):
+                low = 1-step_list[ii-1]
+                high = +step_list[ii]
+                sample_idx_list[ii] = sample_idx_list[ii] + np.random.randint(low=low, high=high)
+            sample_idx_list = np.sort(sample_idx_list)
+            # compare = np.stack((uniform_idx_list, np.sort(sample_idx_list)))
+    else:
+        # simply repeat the final frame
+        sample_idx_list = np.pad(list(range(total_num_frames)), (0, num_frames-total_num_frames), "edge")
+
+    # very random sampling
+    if sampling == "very_random":
+        sample_idx_list = np.sort(np.random.choice(total_num_frames, num_frames, replace=True))
+        # make the first frame to be 0
+        sample_idx_list[0] = 0
+    return sample_idx_list
+
+
+def jitter_clip(frames):
+    """
+    Same random brightness, contrast, saturation and hue change for the whole (nf, H, W, 3) clip in [0, 255],
+    returned as float32 in [0, 255]
+    """
+    bright = 64. / 255
+    contrast = 0.25
+    sat = 0.25
+    hue = 0.04
+    bright_f = random.uniform(max(0, 1 - bright), 1 + bright)
+    contrast_f = random.uniform(max(0, 1 - contrast), 1 + contrast)
+    sat_f = random.uniform(max(0, 1 - sat), 1 + sat)
+    hue_f = random.uniform(-hue, hue)
+    clip = np.asarray(frames, np.float32) / 255.
+    clip = adjust_brightness_clip(clip, bright_f)
+    clip = adjust_contrast_clip(clip, contrast_f)
+    clip = adjust_saturation_clip(clip, sat_f)
+    clip = adjust_hue_clip(clip, hue_f)
+    return clip * 255.
+
+
+# action labels, index action - 1
+MHAD_ACTIONS = ["right arm swipe to the left",
+                "right arm swipe to the right",
+                "right hand wave",
+                "two hand front clap",
+                "right arm throw",
+                "cross arms in the chest",
+                "basketball shooting",
+                "draw x",
+                "draw circle clockwise",
+                "draw circle counter clockwise",
+                "draw triangle",
+                "right hand bowling",
+                "front boxing",
+                "baseball swing from right",
+                "tennis forehand swing",
+                "two arms curl",
+                "tennis serve",
+                "two hand push",
+                "knock on door",
+                "hand catch",
+                "pick up and throw",
+                "jogging",
+                "walking",
+                "sit to stand",
+                "stand to sit",
+                "forward lunge (left foot forward)",
+                "squat"]
+
+
+class FrameFolders(object):
+    """
+    MHAD frame directory (one folder of frames per video, see preprocessing/preprocess_MHAD.py) listed by the
+    cached manifest of preprocessing/manifest_MHAD.py: frame names, num_frames, subject, action and trial of
+    every video, no directory listing when building the dataset or loading a clip.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.videos = load_manifest(data_dir)["videos"]
+
+    def load_clip(self, video, sample_idx_list, image_size, mean, color_jitter):
+        """
+        Frames sample_idx_list of video as float32 (3, nf, image_size, image_size)
+        """
+        video_path = os.path.join(self.data_dir, video["name"])
+        sample_frame_path_list = [os.path.join(video_path, video["frames"][x]) for x in sample_idx_list]
+        # read image
+        sample_frame_list = [imageio.v2.imread(x) for x in sample_frame_path_list]
+        # data augmentation, one batched op on the whole (nf, H, W, 3) clip
+        sample_frames = np.asarray(sample_frame_list, np.float32)
+        if color_jitter:
+            sample_frames = jitter_clip(sample_frames)
+        sample_frame_list = list(sample_frames)
+        # resize to (image_size, image_size)
+        sample_frame_list = [resize(x, image_size, interpolation=cv2.INTER_AREA) for x in sample_frame_list]
+        sample_frame_list = [x - mean for x in sample_frame_list]
+        sample_frame_list = [np.transpose(x, (2, 0, 1)) for x in sample_frame_list]
+        sample_frame_list_npy = np.stack(sample_frame_list, axis=1)
+        # change to float32
+        sample_frame_list_npy = np.array(sample_frame_list_npy/255.0, dtype=np.float32)
+        return sample_frame_list_npy
+
+
+class MHAD(FrameFolders, data.Dataset):
+    def __init__(self, data_dir, num_frames=40, image_size=128, transform=None,
+                 mean=(0, 0, 0), color_jitter=True, split_train_test=True,
+                 sampling="random"):
+        super(MHAD, self).__init__(data_dir)
+        self.mean = mean
+        self.is_jitter = color_jitter
+        self.sampling = sampling
+        self.action_list = list(MHAD_ACTIONS)
+        self.num_frames = num_frames
+        self.image_size = image_size
+
+        if split_train_test:
+            self.video_list = [x for x in self.videos if x["split"] == "train"]
+        else:
+            self.video_list = self.videos
+
+    def __len__(self):
+        return len(self.video_list)
+
+    def __getitem__(self, index):
+        video = self.video_list[index]
+        action_name = self.action_list[video["action"] - 1]
+        sample_idx_list = sample_frame_idx(video["num_frames"], self.num_frames, self.sampling)
+        clip = self.load_clip(video, sample_idx_list, self.image_size, self.mean, self.is_jitter)
+        return clip, action_name, video["name"]
+
+
+class MHAD_test(FrameFolders, data.Dataset):
+    def __init__(self, data_dir, num_frames=40, image_size=256,
+                 mean=(0, 0, 0), color_jitter=False, split_train_test=True):
+        super(MHAD_test, self).__init__(data_dir)
+        self.mean = mean
+        self.is_jitter = color_jitter
+        self.action_list = list(MHAD_ACTIONS)
+        self.num_frames = num_frames
+        self.image_size = image_size
+
+        if split_train_test:
+            self.video_list = [x for x in self.videos if x["split"] == "test"]
+        else:
+            self.video_list = self.videos
+
+    def __len__(self):
+        return len(self.video_list)
+
+    def __getitem__(self, index):
+        video = self.video_list[index]
+        action_name = self.action_list[video["action"] - 1]
+        sample_idx_list = sample_frame_idx(video["num_frames"], self.num_frames, "uniform")
+        clip = self.load_clip(video, sample_idx_list, self.image_size, self.mean, self.is_jitter)
+        return clip, action_name, video["name"]
+
+
+# for consistently generating videos
+class MHAD_gen(FrameFolders, data.Dataset):
+    def __init__(self, data_dir, num_frames=40, image_size=128,
+                 mean=(0, 0, 0), color_jitter=False, sampling="very_random"):
+        super(MHAD_gen, self).__init__(data_dir)
+        self.sampling = sampling
+        self.mean = mean
+        self.is_jitter = color_jitter
+        self.action_list = list(MHAD_ACTIONS)
+        self.num_frames = num_frames
+        self.image_size = image_size
+
+        self.test_ID = [6, 8, 4, 7]
+        self.num_combs = len(self.test_ID) * len(self.action_list)
+
+        # group each video
+        self.video_dict = {sub_name: {action_name: [] for action_name in self.action_list}
+                           for sub_name in self.test_ID}
+        for video in self.videos:
+            if video["subject"] in self.test_ID:
+                self.video_dict[video["subject"]][self.action_list[video["action"] - 1]].append(video)
+
+    def __len__(self):
+        return self.num_combs
+
+    def __getitem__(self, index):
+        sub_name = self.test_ID[index % 4]
+        action_name = self.action_list[index // 4]
+        video_list = self.video_dict[sub_name][action_name]
+        assert len(video_list) > 0
+        video = video_list[np.random.choice(len(video_list), size=1)[0]]
+        sample_idx_list = sample_frame_idx(video["num_frames"], self.num_frames,
+                                           "very_random" if self.sampling == "very_random" else "uniform")
+        clip = self.load_clip(video, sample_idx_list, self.image_size, self.mean, self.is_jitter)
+        return clip, action_name, video["name"]
+
+
+# select one subject and one action
+class MHAD_select(FrameFolders, data.Dataset):
+    def __init__(self, data_dir, num_frames=40, image_size=128,
+                 mean=(0, 0, 0), color_jitter=False, sampling="very_random"):
+        super(MHAD_select, self).__init__(data_dir)
+        self.sampling = sampling
+        self.mean = mean
+        self.is_jitter = color_jitter
+        self.action_list = list(MHAD_ACTIONS)
+        self.num_frames = num_frames
+        self.image_size = image_size
+
+        self.ID = list(range(1, 9))
+        self.num_combs = len(self.ID) * len(self.action_list)
+
+        # group each video according to subject and expression
+        self.video_dict = {sub_name: {action_name: [] for action_name in self.action_list} for sub_name in self.ID}
+        for video in self.videos:
+            self.video_dict[video["subject"]][self.action_list[video["action"] - 1]].append(video)
+
+    def __len__(self):
+        return self.num_combs
+
+    def select(self, sub_name, action_name):
+        video_list = self.video_dict[sub_name][action_name]
+        assert len(video_list) > 0
+        video = video_list[np.random.choice(len(video_list), size=1)[0]]
+        sample_idx_list = sample_frame_idx(video["num_frames"], self.num_frames,
+                                           "very_random" if self.sampling == "very_random" else "uniform")
+        clip = self.load_clip(video, sample_idx_list, self.image_size, self.mean, self.is_jitter)
+        return clip, action_name, video["name"]
+
+    def __getitem__(self, index):
+        return self.select(self.ID[index % 8], self.action_list[index // 8])
+
+
+class PackedFrames(object):
+    """
+    Frames packed by preprocessing/pack_MHAD.py: frames.npy is a single uint8 (total frames, H, W, 3) array
+    in which the frames of every video are contiguous, index.json holds offset, num_frames, subject,
+    action and trial of every video. No directory listing and no image decoding when loading a clip.
+    """
+
+    def __init__(self, pack_dir):
+        with open(os.path.join(pack_dir, "index.json")) as f:
+            index = json.load(f)
+        self.pack_dir = pack_dir
+        self.videos = index["videos"]
+        # opened lazily so that every dataloader worker maps the file itself
+        self.frames = None
+
+    def video_frames(self, video):
+        # (num_frames, H, W, 3) uint8 view of one video, nothing is read yet
+        if self.frames is None:
+            self.frames = np.load(os.path.join(self.pack_dir, "frames.npy"), mmap_mode="r")
+        return self.frames[video["offset"]:video["offset"] + video["num_frames"]]
+
+    def load_clip(self, video, sample_idx_list, image_size, mean, color_jitter):
+        """
+        Frames sample_idx_list of video as float32 (3, nf, image_size, image_size), same output as the PNG datasets.
+        Frames packed at another size are resized here. With color_jitter the jitter is applied after the
+        resize done when packing, the PNG datasets apply it before their resize.
+        """
+        # nf frames gathered from the mapped file, the only copy of the uint8 data
+        frames = self.video_frames(video)[sample_idx_list]
+        if color_jitter:
+            frames = jitter_clip(frames)
+        if frames.shape[1:3] != (image_size, image_size):
+            frames = np.stack([resize(x.astype(np.float32), image_size, interpolation=cv2.INTER_AREA)
+                               for x in frames])
+        # (nf, H, W, 3) -> (3, nf, H, W) in a single conversion
+        clip = frames.transpose((3, 0, 1, 2)).astype(np.float32)
+        clip -= np.asarray(mean, dtype=np.float32).reshape((3, 1, 1, 1))
+        clip /= 255.0
+        return clip
+
+
+class MHAD_packed(PackedFrames, data.Dataset):
+    # MHAD on packed frames
+    def __init__(self, pack_dir, num_frames=40, image_size=128,
+                 mean=(0, 0, 0), color_jitter=True, split_train_test=True,
+                 sampling="random"):
+        super(MHAD_packed, self).__init__(pack_dir)
+        self.mean = mean
+        self.is_jitter = color_jitter
+        self.sampling = sampling
+        self.action_list = list(MHAD_ACTIONS)
+        self.num_frames = num_frames
+        self.image_size = image_size
+
+        if split_train_test:
+            train_ID = [1, 5, 2, 3]
+            self.video_list = [x for x in self.videos if x["subject"] in train_ID]
+        else:
+            self.video_list = self.videos
+
+    def __len__(self):
+        return len(self.video_list)
+
+    def __getitem__(self, index):
+        video = self.video_list[index]
+        action_name = self.action_list[video["action"] - 1]
+        sample_idx_list = sample_frame_idx(video["num_frames"], self.num_frames, self.sampling)
+        clip = self.load_clip(video, sample_idx_list, self.image_size, self.mean, self.is_jitter)
+        return clip, action_name, video["name"]
+
+
+class MHAD_test_packed(PackedFrames, data.Dataset):
+    # MHAD_test on packed frames
+    def __init__(self, pack_dir, num_frames=40, image_size=256,
+                 mean=(0, 0, 0), color_jitter=False, split_train_test=True):
+        super(MHAD_test_packed, self).__init__(pack_dir)
+        self.mean = mean
+        self.is_jitter = color_jitter
+        self.action_list = list(MHAD_ACTIONS)
+        self.num_frames = num_frames
+        self.image_size = image_size
+
+        if split_train_test:
+            test_ID = [6, 8, 4, 7]
+            self.video_list = [x for x in self.videos if x["subject"] in test_ID]
+        else:
+            self.video_list = self.videos
+
+    def __len__(self):
+        return len(self.video_list)
+
+    def __getitem__(self, index):
+        video = self.video_list[index]
+        action_name = self.action_list[video["action"] - 1]
+        sample_idx_list = sample_frame_idx(video["num_frames"], self.num_frames, "uniform")
+        clip = self.load_clip(video, sample_idx_list, self.image_size, self.mean, self.is_jitter)
+        return clip, action_name, video["name"]
+
+
+class MHAD_gen_packed(PackedFrames, data.Dataset):
+    # MHAD_gen on packed frames, one random video of every (test subject, action)
+    def __init__(self, pack_dir, num_frames=40, image_size=128,
+                 mean=(0, 0, 0), color_jitter=False, sampling="very_random"):
+        super(MHAD_gen_packed, self).__init__(pack_dir)
+        self.sampling = sampling
+        self.mean = mean
+        self.is_jitter = color_jitter
+        self.action_list = list(MHAD_ACTIONS)
+        self.num_frames = num_frames
+        self.image_size = image_size
+
+        self.test_ID = [6, 8, 4, 7]
+        self.num_combs = len(self.test_ID) * len(self.action_list)
+        self.video_dict = {sub_name: {action_name: [] for action_name in self.action_list}
+                           for sub_name in self.test_ID}
+        for video in self.videos:
+            if video["subject"] in self.test_ID:
+                self.video_dict[video["subject"]][self.action_list[video["action"] - 1]].append(video)
+
+    def __len__(self):
+        return self.num_combs
+
+    def __getitem__(self, index):
+        sub_name = self.test_ID[index % 4]
+        action_name = self.action_list[index // 4]
+        video_list = self.video_dict[sub_name][action_name]
+        assert len(video_list) > 0
+        video = video_list[np.random.randint(len(video_list))]
+        sample_idx_list = sample_frame_idx(video["num_frames"], self.num_frames,
+                                           "very_random" if self.sampling == "very_random" else "uniform")
+        clip = self.load_clip(video, sample_idx_list, self.image_size, self.mean, self.is_jitter)
+        return clip, action_name, video["name"]
+
+
+class MHAD_select_packed(PackedFrames, data.Dataset):
+    # MHAD_select on packed frames, one random video of every (subject, action)
+    def __init__(self, pack_dir, num_frames=40, image_size=128,
+                 mean=(0, 0, 0), color_jitter=False, sampling="very_random"):
+        super(MHAD_select_packed, self).__init__(pack_dir)
+        self.sampling = sampling
+        self.mean = mean
+        self.is_jitter = color_jitter
+        self.action_list = list(MHAD_ACTIONS)
+        self.num_frames = num_frames
+        self.image_size = image_size
+
+        self.ID = list(range(1, 9))
+        self.num_combs = len(self.ID) * len(self.action_list)
+        self.video_dict = {sub_name: {action_name: [] for action_name in self.action_list} for sub_name in self.ID}
+        for video in self.videos:
+            self.video_dict[video["subject"]][self.action_list[video["action"] - 1]].append(video)
+
+    def __len__(self):
+        return self.num_combs
+
+    def select(self, sub_name, action_name):
+        video_list = self.video_dict[sub_name][action_name]
+        assert len(video_list) > 0
+        video = video_list[np.random.randint(len(video_list))]
+        sample_idx_list = sample_frame_idx(video["num_frames"], self.num_frames,
+                                           "very_random" if self.sampling == "very_random" else "uniform")
+        clip = self.load_clip(video, sample_idx_list, self.image_size, self.mean, self.is_jitter)
+        return clip, action_name, video["name"]
+
+    def __getitem__(self, index):
+        return self.select(self.ID[index % 8], self.action_list[index // 8])
+
+
+# pseudo ground-truth flow precomputed by DM/precompute_flow_mhad.py, no frame decoding and no LFAE pass
+class MHAD_flow(data.Dataset):
+    def __init__(self, cache_dir, num_frames=40, split_train_test=True, sampling="random"):
+        super(MHAD_flow, self).__init__()
+        self.cache_dir = cache_dir
+        self.num_frames = num_frames
+        self.sampling = sampling
+
+        with open(os.path.join(cache_dir, "index.json")) as f:
+            index = json.load(f)
+        self.action_list = index["action_list"]
+
+        if split_train_test:
+            train_ID = [1, 5, 2, 3]
+            self.video_list = [x for x in index["videos"] if x["subject"] in train_ID]
+        else:
+            self.video_list = index["videos"]
+
+        # opened lazily so that every dataloader worker maps the files itself
+        self.flow = None
+        self.fea = None
+
+    def __len__(self):
+        return len(self.video_list)
+
+    def __getitem__(self, index):
+        if self.flow is None:
+            self.flow = np.load(os.path.join(self.cache_dir, "flow.npy"), mmap_mode="r")
+            self.fea = np.load(os.path.join(self.cache_dir, "fea.npy"), mmap_mode="r")
+        video = self.video_list[index]
+        action_name = self.action_list[video["action"] - 1]
+        # all frames are cached, the reference frame (index 0) does not depend on the sampled clip
+        sample_idx_list = sample_frame_idx(video["num_frames"], self.num_frames, self.sampling)
+        # (nf, 3, h, w) -> (3, nf, h, w), channels are flow (x, y) and occlusion map in [0, 1]
+        flow = np.asarray(self.flow[video["offset"] + sample_idx_list], dtype=np.float32).transpose((1, 0, 2, 3))
+        # same normalization as FlowDiffusion.forward
+        flow[2] = flow[2] * 2 - 1
+        fea = np.asarray(self.fea[video["index"]], dtype=np.float32)
+        return np.ascontiguousarray(flow), fea, action_name, video["name"]
+
+
+if __name__ == "__main__":
+    pass
+
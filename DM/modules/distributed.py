@@ -0,0 +1,71 @@
+# one process per device for FlowDiffusion / FlowDiffusionGenTron, see DM/train_vfd_mhad_multiGPU.py
+import os
+import torch
+import torch.distributed as dist
+import torch.backends.cudnn as cudnn
+from torch.distributed.optim import ZeroRedundancyOptimizer
+from torch.nn.parallel import DistributedDataParallel
+
+
+def init_distributed(backend):
+    """
+    Default process group from the torchrun environment (RANK, LOCAL_RANK, WORLD_SIZE and the rendezvous
+    address), returns the device of this process: cuda:LOCAL_RANK with nccl, the cpu with gloo
+    """
+    dist.init_process_group(backend=backend)
+    if backend == "nccl":
+        device = torch.device("cuda", int(os.environ["LOCAL_RANK"]))
+        torch.cuda.set_device(device)
+        cudnn.enabled = True
+        cudnn.benchmark = True
+    else:
+        device = torch.device("cpu")
+    return device
+
+
+def distribute_diffusion(model, device, bucket_cap_mb=25):
+    """
+    Move model to device and wrap model.diffusion, the only trained part, in DistributedDataParallel.
+    Gradients are all-reduced in buckets of bucket_cap_mb while backward is still running.
+    The frozen LFAE stays a plain module, every process runs it on its own share of the batch.
+    model.optimizer_diff is replaced by a ZeroRedundancyOptimizer of the same class and hyper-parameters,
+    each process keeps the optimizer state of 1 / world_size of the parameters (ZeRO stage 1).
+    The state_dict of model and model.diffusion are unchanged.
+    """
+    model.to(device)
+    diffusion_ddp = DistributedDataParallel(model.diffusion,
+                                            device_ids=[device.index] if device.type == "cuda" else None,
+                                            bucket_cap_mb=bucket_cap_mb,
+                                            # only constant schedules and masks in the buffers
+                                            broadcast_buffers=False,
+                                            gradient_as_bucket_view=True)
+    # not registered as a submodule, model.diffusion_ddp.module is model.diffusion
+    model.__dict__["diffusion_ddp"] = diffusion_ddp
+    if getattr(model, "optimizer_diff", None) is not None:
+        optimizer = model.optimizer_diff
+        defaults = {key: value for key, value in optimizer.param_groups[0].items() if key != "params"}
+        model.optimizer_diff = ZeroRedundancyOptimizer(model.diffusion.parameters(),
+                                                       optimizer_class=type(optimizer), **defaults)
+    return model
+
+
+def reduce_mean(*tensors, device=None):
+    """
+    Mean over the processes of scalar tensors, stacked into a single all_reduce on device
+    (the device of the first tensor if None). Returns a tensor with one value per input.
+    """
+    device = tensors[0].device if device is None else device
+    values = torch.stack([torch.as_tensor(tensor).detach().float().to(device) for tensor in tensors])
+    dist.all_reduce(values)
+    return values / dist.get_world_size()
+
+
+def optimizer_state_dict(optimizer):
+    """
+    Full state of a possibly sharded optimizer on rank 0, None on the other ranks.
+    Must be called by every process, the shards are gathered on rank 0.
+    """
+    if isinstance(optimizer, ZeroRedundancyOptimizer):
+        optimizer.consolidate_state_dict(to=0)
+    return optimizer.state_dict() if dist.get_rank() == 0 else None
+
@@ -1,85 +1,157 @@
-import torch
-from transformers import AutoTokenizer, AutoModel
-from einops import rearrange
-
-
-def exists(val):
-    return val is not None
-
-
-# singleton globals
-
-MODEL = None
-TOKENIZER = None
-BERT_MODEL_DIM = 768
-
-def get_tokenizer():
-    global TOKENIZER
-    if TOKENIZER is None:
-        TOKENIZER = AutoTokenizer.from_pretrained("bert-base-uncased")
-    return TOKENIZER
-
-def get_bert():
-    global MODEL
-    if MODEL is None:
-        MODEL = AutoModel.from_pretrained("bert-base-uncased")
-        if torch.cuda.is_available():
-            MODEL = MODEL.cuda()
-    return MODEL
-
-# tokenize
-
-def tokenize(texts, add_special_tokens=True):
-    if not isinstance(texts, (list, tuple)):
-        texts = [texts]
-
-    tokenizer = get_tokenizer()
-
-    encoding = tokenizer.batch_encode_plus(
-        texts,
-        add_special_tokens=add_special_tokens,
-        padding=True,
-        return_tensors='pt'
-    )
-
-    token_ids = encoding.input_ids
-    return token_ids
-
-
-# embedding function
-
-@torch.no_grad()
-def bert_embed(
-        token_ids,
-        return_cls_repr=False,
-        eps=1e-8,
-        pad_id=0.
-):
-    model = get_bert()
-    mask = token_ids != pad_id
-
-    if torch.cuda.is_available():
-        token_ids = token_ids.cuda()
-        mask = mask.cuda()
-
-    outputs = model(
-        input_ids=token_ids,
-        attention_mask=mask,
-        output_hidden_states=True
-    )
-
-    hidden_state = outputs.hidden_states[-1]
-
-    if return_cls_repr:
-        return hidden_state[:, 0]  # return [cls] as representation
-
-    if not exists(mask):
-        return hidden_state.mean(dim=1)
-
-    mask = mask[:, 1:]  # mean all tokens excluding [cls], accounting for length
-    mask = rearrange(mask, 'b n -> b n 1')
-
-    numer = (hidden_state[:, 1:] * mask).sum(dim=1)
-    denom = mask.sum(dim=1)
-    masked_mean = numer / (denom + eps)
-    return masked_mean
+import os
+from collections import OrderedDict
+
+import torch
+from transformers import AutoTokenizer, AutoModel
+from einops import rearrange
+
+
+def exists(val):
+    return val is not None
+
+
+# singleton globals
+
+MODEL = None
+TOKENIZER = None
+BERT_MODEL_DIM = 768
+
+# embedding cache, (text, return_cls_repr) -> cpu tensor, least recently used entry dropped first
+
+EMBED_CACHE = OrderedDict()
+EMBED_CACHE_SIZE = 1024
+
+def get_tokenizer():
+    global TOKENIZER
+    if TOKENIZER is None:
+        TOKENIZER = AutoTokenizer.from_pretrained("bert-base-uncased")
+    return TOKENIZER
+
+def get_bert():
+    global MODEL
+    if MODEL is None:
+        MODEL = AutoModel.from_pretrained("bert-base-uncased")
+        if torch.cuda.is_available():
+            MODEL = MODEL.cuda()
+    return MODEL
+
+# tokenize
+
+def tokenize(texts, add_special_tokens=True):
+    if not isinstance(texts, (list, tuple)):
+        texts = [texts]
+
+    tokenizer = get_tokenizer()
+
+    encoding = tokenizer.batch_encode_plus(
+        texts,
+        add_special_tokens=add_special_tokens,
+        padding=True,
+        return_tensors='pt'
+    )
+
+    token_ids = encoding.input_ids
+    return token_ids
+
+
+# embedding function
+
+@torch.no_grad()
+def bert_embed(
+        token_ids,
+        return_cls_repr=False,
+        eps=1e-8,
+        pad_id=0.
+):
+    model = get_bert()
+    mask = token_ids != pad_id
+
+    if torch.cuda.is_available():
+        token_ids = token_ids.cuda()
+        mask = mask.cuda()
+
+    outputs = model(
+        input_ids=token_ids,
+        attention_mask=mask,
+        output_hidden_states=True
+    )
+
+    hidden_state = outputs.hidden_states[-1]
+
+    if return_cls_repr:
+        return hidden_state[:, 0]  # return [cls] as representation
+
+    if not exists(mask):
+        return hidden_state.mean(dim=1)
+
+    mask = mask[:, 1:]  # mean all tokens excluding [cls], accounting for length
+    mask = rearrange(mask, 'b n -> b n 1')
+
+    numer = (hidden_state[:, 1:] * mask).sum(dim=1)
+    denom = mask.sum(dim=1)
+    masked_mean = numer / (denom + eps)
+    return masked_mean
+
+
+# cached embedding
+
+def load_embed_cache(path):
+    # entries saved by save_embed_cache, e.g. prebuilt for the action labels of a dataset
+    for key, value in torch.load(path, map_location="cpu").items():
+        EMBED_CACHE[key] = value
+        EMBED_CACHE.move_to_end(key)
+    while len(EMBED_CACHE) > EMBED_CACHE_SIZE:
+        EMBED_CACHE.popitem(last=False)
+
+
+def save_embed_cache(path, texts=None, return_cls_repr=False):
+    # embed texts (if given) and store the whole cache
+    if exists(texts):
+        embed_texts(texts, return_cls_repr=return_cls_repr)
+    torch.save(dict(EMBED_CACHE), path)
+
+
+def build_embed_cache(path, texts, return_cls_repr=False):
+    # load the store at path if it exists, texts missing from it (a new label, another return_cls_repr)
+    # are embedded and the store is written again
+    if os.path.isfile(path):
+        load_embed_cache(path)
+        if all((text, return_cls_repr) in EMBED_CACHE for text in texts):
+            return
+    save_embed_cache(path, texts, return_cls_repr=return_cls_repr)
+
+
+@torch.no_grad()
+def embed_texts(texts, return_cls_repr=False, device=None):
+    """
+    Same as bert_embed(tokenize(texts)), but only the texts missing in the cache go through BERT,
+    BERT is not loaded at all if every text hits. The embeddings are returned on device, on the cpu
+    with the cache if None
+    """
+    if not isinstance(texts, (list, tuple)):
+        texts = [texts]
+
+    misses = []
+    for text in texts:
+        key = (text, return_cls_repr)
+        if key in EMBED_CACHE:
+            EMBED_CACHE.move_to_end(key)
+        elif text not in misses:
+            misses.append(text)
+
+    embeds = {}
+    if len(misses) > 0:
+        miss_embeds = bert_embed(tokenize(misses), return_cls_repr=return_cls_repr).cpu()
+        for text, embed in zip(misses, miss_embeds):
+            embeds[text] = embed
+            EMBED_CACHE[(text, return_cls_repr)] = embed.clone()
+    for text in texts:
+        if text not in embeds:
+            embeds[text] = EMBED_CACHE[(text, return_cls_repr)]
+    while len(EMBED_CACHE) > EMBED_CACHE_SIZE:
+        EMBED_CACHE.popitem(last=False)
+
+    out = torch.stack([embeds[text] for text in texts], dim=0)
+    if exists(device):
+        out = out.to(device)
+    return out
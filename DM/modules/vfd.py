@@ -1,969 +1,1484 @@
-import math
-import torch
-from torch import nn, einsum
-import torch.nn.functional as F
-from functools import partial
-
-from torchvision import transforms as T
-from PIL import Image
-
-from tqdm import tqdm
-from einops import rearrange
-from einops_exts import rearrange_many
-
-from rotary_embedding_torch import RotaryEmbedding
-
-from DM.modules.text import tokenize, bert_embed, BERT_MODEL_DIM
-
-
-# helpers functions
-
-def exists(x):
-    return x is not None
-
-
-def noop(*args, **kwargs):
-    pass
-
-
-def is_odd(n):
-    return (n % 2) == 1
-
-
-def default(val, d):
-    if exists(val):
-        return val
-    return d() if callable(d) else d
-
-
-def cycle(dl):
-    while True:
-        for data in dl:
-            yield data
-
-
-def num_to_groups(num, divisor):
-    groups = num // divisor
-    remainder = num % divisor
-    arr = [divisor] * groups
-    if remainder > 0:
-        arr.append(remainder)
-    return arr
-
-
-def prob_mask_like(shape, prob, device):
-    if prob == 1:
-        return torch.ones(shape, device=device, dtype=torch.bool)
-    elif prob == 0:
-        return torch.zeros(shape, device=device, dtype=torch.bool)
-    else:
-        return torch.zeros(shape, device=device).float().uniform_(0, 1) < prob
-
-
-def is_list_str(x):
-    if not isinstance(x, (list, tuple)):
-        return False
-    return all([type(el) == str for el in x])
-
-
-# relative positional bias
-
-class RelativePositionBias(nn.Module):
-    def __init__(
-            self,
-            heads=8,
-            num_buckets=32,
-            max_distance=128
-    ):
-        super().__init__()
-        self.num_buckets = num_buckets
-        self.max_distance = max_distance
-        self.relative_attention_bias = nn.Embedding(num_buckets, heads)
-
-    @staticmethod
-    def _relative_position_bucket(relative_position, num_buckets=32, max_distance=128):
-        ret = 0
-        n = -relative_position
-
-        num_buckets //= 2
-        ret += (n < 0).long() * num_buckets
-        n = torch.abs(n)
-
-        max_exact = num_buckets // 2
-        is_small = n < max_exact
-
-        val_if_large = max_exact + (
-                torch.log(n.float() / max_exact) / math.log(max_distance / max_exact) * (num_buckets - max_exact)
-        ).long()
-        val_if_large = torch.min(val_if_large, torch.full_like(val_if_large, num_buckets - 1))
-
-        ret += torch.where(is_small, n, val_if_large)
-        return ret
-
-    def forward(self, n, device):
-        q_pos = torch.arange(n, dtype=torch.long, device=device)
-        k_pos = torch.arange(n, dtype=torch.long, device=device)
-        rel_pos = rearrange(k_pos, 'j -> 1 j') - rearrange(q_pos, 'i -> i 1')
-        rp_bucket = self._relative_position_bucket(rel_pos, num_buckets=self.num_buckets,
-                                                   max_distance=self.max_distance)
-        values = self.relative_attention_bias(rp_bucket)
-        return rearrange(values, 'i j h -> h i j')
-
-
-# small helper modules
-
-class EMA():
-    def __init__(self, beta):
-        super().__init__()
-        self.beta = beta
-
-    def update_model_average(self, ma_model, current_model):
-        for current_params, ma_params in zip(current_model.parameters(), ma_model.parameters()):
-            old_weight, up_weight = ma_params.data, current_params.data
-            ma_params.data = self.update_average(old_weight, up_weight)
-
-    def update_average(self, old, new):
-        if old is None:
-            return new
-        return old * self.beta + (1 - self.beta) * new
-
-
-class Residual(nn.Module):
-    def __init__(self, fn):
-        super().__init__()
-        self.fn = fn
-
-    def forward(self, x, *args, **kwargs):
-        return self.fn(x, *args, **kwargs) + x
-
-
-class SinusoidalPosEmb(nn.Module):
-    def __init__(self, dim):
-        super().__init__()
-        self.dim = dim
-
-    def forward(self, x):
-        device = x.device
-        half_dim = self.dim // 2
-        emb = math.log(10000) / (half_dim - 1)
-        emb = torch.exp(torch.arange(half_dim, device=device) * -emb)
-        emb = x[:, None] * emb[None, :]
-        emb = torch.cat((emb.sin(), emb.cos()), dim=-1)
-        return emb
-
-
-def Upsample(dim, use_deconv=True, padding_mode="reflect"):
-    if use_deconv:
-        return nn.ConvTranspose3d(dim, dim, (1, 4, 4), (1, 2, 2), (0, 1, 1))
-    else:
-        return nn.Sequential(
-            nn.Upsample(scale_factor=(1, 2, 2), mode='nearest'),
-            nn.Conv3d(dim, dim, (1, 3, 3), (1, 1, 1), (0, 1, 1), padding_mode=padding_mode)
-        )
-
-
-def Downsample(dim):
-    return nn.Conv3d(dim, dim, (1, 4, 4), (1, 2, 2), (0, 1, 1))
-
-
-class LayerNorm(nn.Module):
-    def __init__(self, dim, eps=1e-5):
-        super().__init__()
-        self.eps = eps
-        self.gamma = nn.Parameter(torch.ones(1, dim, 1, 1, 1))
-
-    def forward(self, x):
-        var = torch.var(x, dim=1, unbiased=False, keepdim=True)
-        mean = torch.mean(x, dim=1, keepdim=True)
-        return (x - mean) / (var + self.eps).sqrt() * self.gamma
-
-
-class PreNorm(nn.Module):
-    def __init__(self, dim, fn):
-        super().__init__()
-        self.fn = fn
-        self.norm = LayerNorm(dim)
-
-    def forward(self, x, **kwargs):
-        x = self.norm(x)
-        return self.fn(x, **kwargs)
-
-
-# building block modules
-
-
-class Block(nn.Module):
-    def __init__(self, dim, dim_out, groups=8):
-        super().__init__()
-        self.proj = nn.Conv3d(dim, dim_out, (1, 3, 3), padding=(0, 1, 1))
-        self.norm = nn.GroupNorm(groups, dim_out)
-        self.act = nn.SiLU()
-
-    def forward(self, x, scale_shift=None):
-        x = self.proj(x)
-        x = self.norm(x)
-
-        if exists(scale_shift):
-            scale, shift = scale_shift
-            x = x * (scale + 1) + shift
-
-        return self.act(x)
-
-
-class ResnetBlock(nn.Module):
-    def __init__(self, dim, dim_out, *, time_emb_dim=None, groups=8):
-        super().__init__()
-        self.mlp = nn.Sequential(
-            nn.SiLU(),
-            nn.Linear(time_emb_dim, dim_out * 2)
-        ) if exists(time_emb_dim) else None
-
-        self.block1 = Block(dim, dim_out, groups=groups)
-        self.block2 = Block(dim_out, dim_out, groups=groups)
-        self.res_conv = nn.Conv3d(dim, dim_out, 1) if dim != dim_out else nn.Identity()
-
-    def forward(self, x, time_emb=None):
-        scale_shift = None
-        if exists(self.mlp):
-            assert exists(time_emb), 'time emb must be passed in'
-            time_emb = self.mlp(time_emb)
-            time_emb = rearrange(time_emb, 'b c -> b c 1 1 1')
-            scale_shift = time_emb.chunk(2, dim=1)
-
-        h = self.block1(x, scale_shift=scale_shift)
-
-        h = self.block2(h)
-        return h + self.res_conv(x)
-
-
-class SpatialLinearAttention(nn.Module):
-    def __init__(self, dim, heads=4, dim_head=32):
-        super().__init__()
-        self.scale = dim_head ** -0.5
-        self.heads = heads
-        hidden_dim = dim_head * heads
-        self.to_qkv = nn.Conv2d(dim, hidden_dim * 3, 1, bias=False)
-        self.to_out = nn.Conv2d(hidden_dim, dim, 1)
-
-    def forward(self, x):
-        b, c, f, h, w = x.shape
-        x = rearrange(x, 'b c f h w -> (b f) c h w')
-
-        qkv = self.to_qkv(x).chunk(3, dim=1)
-        q, k, v = rearrange_many(qkv, 'b (h c) x y -> b h c (x y)', h=self.heads)
-
-        q = q.softmax(dim=-2)
-        k = k.softmax(dim=-1)
-
-        q = q * self.scale
-        context = torch.einsum('b h d n, b h e n -> b h d e', k, v)
-
-        out = torch.einsum('b h d e, b h d n -> b h e n', context, q)
-        out = rearrange(out, 'b h c (x y) -> b (h c) x y', h=self.heads, x=h, y=w)
-        out = self.to_out(out)
-        return rearrange(out, '(b f) c h w -> b c f h w', b=b)
-
-
-# attention along space and time
-
-class EinopsToAndFrom(nn.Module):
-    def __init__(self, from_einops, to_einops, fn):
-        super().__init__()
-        self.from_einops = from_einops
-        self.to_einops = to_einops
-        self.fn = fn
-
-    def forward(self, x, **kwargs):
-        shape = x.shape
-        reconstitute_kwargs = dict(tuple(zip(self.from_einops.split(' '), shape)))
-        x = rearrange(x, f'{self.from_einops} -> {self.to_einops}')
-        x = self.fn(x, **kwargs)
-        x = rearrange(x, f'{self.to_einops} -> {self.from_einops}', **reconstitute_kwargs)
-        return x
-
-
-class Attention(nn.Module):
-    def __init__(
-            self,
-            dim,
-            heads=4,
-            dim_head=32,
-            rotary_emb=None
-    ):
-        super().__init__()
-        self.scale = dim_head ** -0.5
-        self.heads = heads
-        hidden_dim = dim_head * heads
-
-        self.rotary_emb = rotary_emb
-        self.to_qkv = nn.Linear(dim, hidden_dim * 3, bias=False)
-        self.to_out = nn.Linear(hidden_dim, dim, bias=False)
-
-    def forward(
-            self,
-            x,
-            pos_bias=None,
-            focus_present_mask=None
-    ):
-        n, device = x.shape[-2], x.device
-
-        qkv = self.to_qkv(x).chunk(3, dim=-1)
-
-        if exists(focus_present_mask) and focus_present_mask.all():
-            # if all batch samples are focusing on present
-            # it would be equivalent to passing that token's values through to the output
-            values = qkv[-1]
-            return self.to_out(values)
-
-        # split out heads
-
-        q, k, v = rearrange_many(qkv, '... n (h d) -> ... h n d', h=self.heads)
-
-        # scale
-
-        q = q * self.scale
-
-        # rotate positions into queries and keys for time attention
-
-        if exists(self.rotary_emb):
-            q = self.rotary_emb.rotate_queries_or_keys(q)
-            k = self.rotary_emb.rotate_queries_or_keys(k)
-
-        # similarity
-
-        sim = einsum('... h i d, ... h j d -> ... h i j', q, k)
-
-        # relative positional bias
-
-        if exists(pos_bias):
-            sim = sim + pos_bias
-
-        if exists(focus_present_mask) and not (~focus_present_mask).all():
-            attend_all_mask = torch.ones((n, n), device=device, dtype=torch.bool)
-            attend_self_mask = torch.eye(n, device=device, dtype=torch.bool)
-
-            mask = torch.where(
-                rearrange(focus_present_mask, 'b -> b 1 1 1 1'),
-                rearrange(attend_self_mask, 'i j -> 1 1 1 i j'),
-                rearrange(attend_all_mask, 'i j -> 1 1 1 i j'),
-            )
-
-            sim = sim.masked_fill(~mask, -torch.finfo(sim.dtype).max)
-
-        # numerical stability
-
-        sim = sim - sim.amax(dim=-1, keepdim=True).detach()
-        attn = sim.softmax(dim=-1)
-
-        # aggregate values
-
-        out = einsum('... h i j, ... h j d -> ... h i d', attn, v)
-        out = rearrange(out, '... h n d -> ... n (h d)')
-        return self.to_out(out)
-
-
-# model
-
-class Unet3D(nn.Module):
-    def __init__(
-            self,
-            dim,
-            cond_dim=None,
-            out_grid_dim=2,
-            out_conf_dim=1,
-            dim_mults=(1, 2, 4, 8),
-            channels=3,
-            attn_heads=8,
-            attn_dim_head=32,
-            use_bert_text_cond=False,
-            init_dim=None,
-            init_kernel_size=7,
-            use_sparse_linear_attn=True,
-            resnet_groups=8,
-            use_final_activation=False,
-            learn_null_cond=False,
-            use_deconv=True,
-            padding_mode="zeros",
-    ):
-        super().__init__()
-        self.null_cond_mask = None
-        self.channels = channels
-
-        # temporal attention and its relative positional encoding
-
-        rotary_emb = RotaryEmbedding(min(32, attn_dim_head))
-
-        temporal_attn = lambda dim: EinopsToAndFrom('b c f h w', 'b (h w) f c',
-                                                    Attention(dim, heads=attn_heads, dim_head=attn_dim_head,
-                                                              rotary_emb=rotary_emb))
-
-        self.time_rel_pos_bias = RelativePositionBias(heads=attn_heads,
-                                                      max_distance=32)  # realistically will not be able to generate that many frames of video... yet
-
-        # initial conv
-
-        init_dim = default(init_dim, dim)
-        assert is_odd(init_kernel_size)
-
-        init_padding = init_kernel_size // 2
-        self.init_conv = nn.Conv3d(channels, init_dim, (1, init_kernel_size, init_kernel_size),
-                                   padding=(0, init_padding, init_padding))
-
-        self.init_temporal_attn = Residual(PreNorm(init_dim, temporal_attn(init_dim)))
-
-        # dimensions
-
-        dims = [init_dim, *map(lambda m: dim * m, dim_mults)]
-        in_out = list(zip(dims[:-1], dims[1:]))
-
-        # time conditioning
-
-        time_dim = dim * 4
-        self.time_mlp = nn.Sequential(
-            SinusoidalPosEmb(dim),
-            nn.Linear(dim, time_dim),
-            nn.GELU(),
-            nn.Linear(time_dim, time_dim)
-        )
-
-        # text conditioning
-
-        self.has_cond = exists(cond_dim) or use_bert_text_cond
-        cond_dim = BERT_MODEL_DIM if use_bert_text_cond else cond_dim
-
-        # modified by nhm
-        self.learn_null_cond = learn_null_cond
-        if self.learn_null_cond:
-            self.null_cond_emb = nn.Parameter(torch.randn(1, cond_dim)) if self.has_cond else None
-        else:
-            self.null_cond_emb = torch.zeros(1, cond_dim).cuda() if self.has_cond else None
-
-        cond_dim = time_dim + int(cond_dim or 0)
-
-        # layers
-
-        self.downs = nn.ModuleList([])
-        self.ups = nn.ModuleList([])
-
-        num_resolutions = len(in_out)
-
-        # block type
-
-        block_klass = partial(ResnetBlock, groups=resnet_groups)
-        block_klass_cond = partial(block_klass, time_emb_dim=cond_dim)
-
-        # modules for all layers
-
-        for ind, (dim_in, dim_out) in enumerate(in_out):
-            is_last = ind >= (num_resolutions - 1)
-
-            self.downs.append(nn.ModuleList([
-                block_klass_cond(dim_in, dim_out),
-                block_klass_cond(dim_out, dim_out),
-                Residual(PreNorm(dim_out, SpatialLinearAttention(dim_out,
-                                                                 heads=attn_heads))) if use_sparse_linear_attn else nn.Identity(),
-                Residual(PreNorm(dim_out, temporal_attn(dim_out))),
-                Downsample(dim_out) if not is_last else nn.Identity()
-            ]))
-
-        mid_dim = dims[-1]
-        self.mid_block1 = block_klass_cond(mid_dim, mid_dim)
-
-        spatial_attn = EinopsToAndFrom('b c f h w', 'b f (h w) c', Attention(mid_dim, heads=attn_heads))
-
-        self.mid_spatial_attn = Residual(PreNorm(mid_dim, spatial_attn))
-        self.mid_temporal_attn = Residual(PreNorm(mid_dim, temporal_attn(mid_dim)))
-
-        self.mid_block2 = block_klass_cond(mid_dim, mid_dim)
-
-        for ind, (dim_in, dim_out) in enumerate(reversed(in_out)):
-            is_last = ind >= (num_resolutions - 1)
-
-            self.ups.append(nn.ModuleList([
-                block_klass_cond(dim_out * 2, dim_in),
-                block_klass_cond(dim_in, dim_in),
-                Residual(PreNorm(dim_in, SpatialLinearAttention(dim_in,
-                                                                heads=attn_heads))) if use_sparse_linear_attn else nn.Identity(),
-                Residual(PreNorm(dim_in, temporal_attn(dim_in))),
-                Upsample(dim_in, use_deconv, padding_mode) if not is_last else nn.Identity()
-            ]))
-
-        # out_dim = default(out_grid_dim, channels)
-        self.final_conv = nn.Sequential(
-            block_klass(dim * 2, dim),
-            nn.Conv3d(dim, out_grid_dim, 1)
-        )
-
-        # added by nhm
-        self.use_final_activation = use_final_activation
-        if self.use_final_activation:
-            self.final_activation = nn.Tanh()
-        else:
-            self.final_activation = nn.Identity()
-
-        # added by nhm for predicting occlusion mask
-        self.occlusion_map = nn.Sequential(
-            block_klass(dim * 2, dim),
-            nn.Conv3d(dim, out_conf_dim, 1)
-        )
-
-    def forward_with_cond_scale(
-            self,
-            *args,
-            cond_scale=2.,
-            **kwargs
-    ):
-        if cond_scale == 0:
-            null_logits = self.forward(*args, null_cond_prob=1., **kwargs)
-            return null_logits
-
-        logits = self.forward(*args, null_cond_prob=0., **kwargs)
-        if cond_scale == 1 or not self.has_cond:
-            return logits
-
-        null_logits = self.forward(*args, null_cond_prob=1., **kwargs)
-        return null_logits + (logits - null_logits) * cond_scale
-
-    def forward(
-            self,
-            x,
-            time,
-            cond=None,
-            null_cond_prob=0.,
-            none_cond_mask=None,
-            focus_present_mask=None,
-            prob_focus_present=0.
-            # probability at which a given batch sample will focus on the present (0. is all off, 1. is completely arrested attention across time)
-    ):
-        assert not (self.has_cond and not exists(cond)), 'cond must be passed in if cond_dim specified'
-        batch, device = x.shape[0], x.device
-
-        focus_present_mask = default(focus_present_mask,
-                                     lambda: prob_mask_like((batch,), prob_focus_present, device=device))
-
-        time_rel_pos_bias = self.time_rel_pos_bias(x.shape[2], device=x.device)
-
-        x = self.init_conv(x)
-        r = x.clone()
-
-        x = self.init_temporal_attn(x, pos_bias=time_rel_pos_bias)
-
-        t = self.time_mlp(time) if exists(self.time_mlp) else None
-
-        # classifier free guidance
-
-        if self.has_cond:
-            batch, device = x.shape[0], x.device
-            self.null_cond_mask = prob_mask_like((batch,), null_cond_prob, device=device)
-            if none_cond_mask is not None:
-                self.null_cond_mask = torch.logical_or(self.null_cond_mask, torch.tensor(none_cond_mask).cuda())
-            cond = torch.where(rearrange(self.null_cond_mask, 'b -> b 1'), self.null_cond_emb, cond)
-            t = torch.cat((t, cond), dim=-1)
-
-        h = []
-
-        for block1, block2, spatial_attn, temporal_attn, downsample in self.downs:
-            x = block1(x, t)
-            x = block2(x, t)
-            x = spatial_attn(x)
-            x = temporal_attn(x, pos_bias=time_rel_pos_bias, focus_present_mask=focus_present_mask)
-            h.append(x)
-            x = downsample(x)
-
-        x = self.mid_block1(x, t)
-        x = self.mid_spatial_attn(x)
-        x = self.mid_temporal_attn(x, pos_bias=time_rel_pos_bias, focus_present_mask=focus_present_mask)
-        x = self.mid_block2(x, t)
-
-        for block1, block2, spatial_attn, temporal_attn, upsample in self.ups:
-            x = torch.cat((x, h.pop()), dim=1)
-            x = block1(x, t)
-            x = block2(x, t)
-            x = spatial_attn(x)
-            x = temporal_attn(x, pos_bias=time_rel_pos_bias, focus_present_mask=focus_present_mask)
-            x = upsample(x)
-
-        x = torch.cat((x, r), dim=1)
-        return torch.cat((self.final_conv(x), self.occlusion_map(x)), dim=1)
-
-# gaussian diffusion trainer class
-
-def extract(a, t, x_shape):
-    b, *_ = t.shape
-    out = a.gather(-1, t)
-    return out.reshape(b, *((1,) * (len(x_shape) - 1)))
-
-
-def cosine_beta_schedule(timesteps, s=0.008):
-    """
-    cosine schedule
-    as proposed in https://openreview.net/forum?id=-NEXDKk8gZ
-    """
-    steps = timesteps + 1
-    x = torch.linspace(0, timesteps, steps, dtype=torch.float64)
-    alphas_cumprod = torch.cos(((x / timesteps) + s) / (1 + s) * torch.pi * 0.5) ** 2
-    alphas_cumprod = alphas_cumprod / alphas_cumprod[0]
-    betas = 1 - (alphas_cumprod[1:] / alphas_cumprod[:-1])
-    return torch.clip(betas, 0, 0.9999)
-
-
-class GaussianDiffusion(nn.Module):
-    def __init__(
-            self,
-            denoise_fn,
-            *,
-            image_size,
-            num_frames,
-            text_use_bert_cls=False,
-            channels=3,
-            timesteps=1000,
-            sampling_timesteps=250,
-            ddim_sampling_eta=1.,
-            loss_type='l1',
-            use_dynamic_thres=False,  # from the Imagen paper
-            dynamic_thres_percentile=0.9,
-            null_cond_prob=0.1
-    ):
-        super().__init__()
-        self.null_cond_prob = null_cond_prob
-        self.channels = channels
-        self.image_size = image_size
-        self.num_frames = num_frames
-        self.denoise_fn = denoise_fn
-
-        betas = cosine_beta_schedule(timesteps)
-
-        alphas = 1. - betas
-        alphas_cumprod = torch.cumprod(alphas, axis=0)
-        alphas_cumprod_prev = F.pad(alphas_cumprod[:-1], (1, 0), value=1.)
-
-        timesteps, = betas.shape
-        self.num_timesteps = int(timesteps)
-        self.loss_type = loss_type
-
-        self.sampling_timesteps = default(sampling_timesteps,
-                                          timesteps)
-        self.is_ddim_sampling = self.sampling_timesteps < timesteps
-        if self.is_ddim_sampling:
-            print("using ddim samping with %d steps" % sampling_timesteps)
-        self.ddim_sampling_eta = ddim_sampling_eta
-
-        # register buffer helper function that casts float64 to float32
-
-        register_buffer = lambda name, val: self.register_buffer(name, val.to(torch.float32))
-
-        register_buffer('betas', betas)
-        register_buffer('alphas_cumprod', alphas_cumprod)
-        register_buffer('alphas_cumprod_prev', alphas_cumprod_prev)
-
-        # calculations for diffusion q(x_t | x_{t-1}) and others
-
-        register_buffer('sqrt_alphas_cumprod', torch.sqrt(alphas_cumprod))
-        register_buffer('sqrt_one_minus_alphas_cumprod', torch.sqrt(1. - alphas_cumprod))
-        register_buffer('log_one_minus_alphas_cumprod', torch.log(1. - alphas_cumprod))
-        register_buffer('sqrt_recip_alphas_cumprod', torch.sqrt(1. / alphas_cumprod))
-        register_buffer('sqrt_recipm1_alphas_cumprod', torch.sqrt(1. / alphas_cumprod - 1))
-
-        # calculations for posterior q(x_{t-1} | x_t, x_0)
-
-        posterior_variance = betas * (1. - alphas_cumprod_prev) / (1. - alphas_cumprod)
-
-        # above: equal to 1. / (1. / (1. - alpha_cumprod_tm1) + alpha_t / beta_t)
-
-        register_buffer('posterior_variance', posterior_variance)
-
-        # below: log calculation clipped because the posterior variance is 0 at the beginning of the diffusion chain
-
-        register_buffer('posterior_log_variance_clipped', torch.log(posterior_variance.clamp(min=1e-20)))
-        register_buffer('posterior_mean_coef1', betas * torch.sqrt(alphas_cumprod_prev) / (1. - alphas_cumprod))
-        register_buffer('posterior_mean_coef2', (1. - alphas_cumprod_prev) * torch.sqrt(alphas) / (1. - alphas_cumprod))
-
-        # text conditioning parameters
-
-        self.text_use_bert_cls = text_use_bert_cls
-
-        # dynamic thresholding when sampling
-
-        self.use_dynamic_thres = use_dynamic_thres
-        self.dynamic_thres_percentile = dynamic_thres_percentile
-
-    def q_mean_variance(self, x_start, t):
-        mean = extract(self.sqrt_alphas_cumprod, t, x_start.shape) * x_start
-        variance = extract(1. - self.alphas_cumprod, t, x_start.shape)
-        log_variance = extract(self.log_one_minus_alphas_cumprod, t, x_start.shape)
-        return mean, variance, log_variance
-
-    def predict_start_from_noise(self, x_t, t, noise):
-        return (
-                extract(self.sqrt_recip_alphas_cumprod, t, x_t.shape) * x_t -
-                extract(self.sqrt_recipm1_alphas_cumprod, t, x_t.shape) * noise
-        )
-
-    def q_posterior(self, x_start, x_t, t):
-        posterior_mean = (
-                extract(self.posterior_mean_coef1, t, x_t.shape) * x_start +
-                extract(self.posterior_mean_coef2, t, x_t.shape) * x_t
-        )
-        posterior_variance = extract(self.posterior_variance, t, x_t.shape)
-        posterior_log_variance_clipped = extract(self.posterior_log_variance_clipped, t, x_t.shape)
-        return posterior_mean, posterior_variance, posterior_log_variance_clipped
-
-    def p_mean_variance(self, x, t, fea, clip_denoised: bool, cond=None, cond_scale=1.):
-        fea = fea.unsqueeze(dim=2).repeat(1, 1, x.size(2), 1, 1)
-        x_recon = self.predict_start_from_noise(x, t=t, noise=self.denoise_fn.forward_with_cond_scale(torch.cat([x, fea], dim=1),
-                                                                                                      t,
-                                                                                                      cond=cond,
-                                                                                                      cond_scale=cond_scale))
-
-        if clip_denoised:
-            s = 1.
-            if self.use_dynamic_thres:
-                s = torch.quantile(
-                    rearrange(x_recon, 'b ... -> b (...)').abs(),
-                    self.dynamic_thres_percentile,
-                    dim=-1
-                )
-
-                s.clamp_(min=1.)
-                s = s.view(-1, *((1,) * (x_recon.ndim - 1)))
-
-            # clip by threshold, depending on whether static or dynamic
-            x_recon = x_recon.clamp(-s, s) / s
-
-        model_mean, posterior_variance, posterior_log_variance = self.q_posterior(x_start=x_recon, x_t=x, t=t)
-        return model_mean, posterior_variance, posterior_log_variance
-
-    @torch.inference_mode()
-    def p_sample(self, x, t, fea, cond=None, cond_scale=1., clip_denoised=True):
-        b, *_, device = *x.shape, x.device
-        model_mean, _, model_log_variance = self.p_mean_variance(x=x, t=t, fea=fea,
-                                                                 clip_denoised=clip_denoised, cond=cond,
-                                                                 cond_scale=cond_scale)
-        noise = torch.randn_like(x)
-        # no noise when t == 0
-        nonzero_mask = (1 - (t == 0).float()).reshape(b, *((1,) * (len(x.shape) - 1)))
-        return model_mean + nonzero_mask * (0.5 * model_log_variance).exp() * noise
-
-    @torch.inference_mode()
-    def p_sample_loop(self, fea, shape, cond=None, cond_scale=1.):
-        device = self.betas.device
-
-        b = shape[0]
-        img = torch.randn(shape, device=device)
-
-        for i in tqdm(reversed(range(0, self.num_timesteps)), desc='sampling loop time step', total=self.num_timesteps):
-            img = self.p_sample(img, torch.full((b,), i, device=device, dtype=torch.long), fea, cond=cond,
-                                cond_scale=cond_scale)
-
-        return img
-        # return unnormalize_img(img)
-
-    @torch.inference_mode()
-    def sample(self, fea, cond=None, cond_scale=1., batch_size=16):
-        device = next(self.denoise_fn.parameters()).device
-
-        if is_list_str(cond):
-            cond = bert_embed(tokenize(cond), return_cls_repr=self.text_use_bert_cls).to(device)
-
-        batch_size = cond.shape[0] if exists(cond) else batch_size
-        image_size = self.image_size
-        channels = self.channels
-        num_frames = self.num_frames
-        sample_fn = self.p_sample_loop if not self.is_ddim_sampling else self.ddim_sample
-        return sample_fn(fea, (batch_size, channels, num_frames, image_size, image_size), cond=cond,
-                         cond_scale=cond_scale)
-
-    # add by nhm
-    @torch.no_grad()
-    def ddim_sample(self, fea, shape, cond=None, cond_scale=1., clip_denoised=True):
-
-        batch, device, total_timesteps, sampling_timesteps, eta = \
-            shape[0], self.betas.device, self.num_timesteps, self.sampling_timesteps, self.ddim_sampling_eta
-
-        times = torch.linspace(0., total_timesteps, steps=sampling_timesteps + 2)[:-1]
-        times = list(reversed(times.int().tolist()))
-        time_pairs = list(zip(times[:-1], times[1:]))
-
-        img = torch.randn(shape, device=device)
-        fea = fea.unsqueeze(dim=2).repeat(1, 1, img.size(2), 1, 1)
-
-        for time, time_next in tqdm(time_pairs, desc='sampling loop time step'):
-            alpha = self.alphas_cumprod_prev[time]
-            alpha_next = self.alphas_cumprod_prev[time_next]
-
-            time_cond = torch.full((batch,), time, device=device, dtype=torch.long)
-
-            # pred_noise, x_start, *_ = self.model_predictions(img, time_cond, fea)
-            pred_noise = self.denoise_fn.forward_with_cond_scale(
-                torch.cat([img, fea], dim=1),
-                time_cond,
-                cond=cond,
-                cond_scale=cond_scale)
-            x_start = self.predict_start_from_noise(img, t=time_cond, noise=pred_noise)
-
-            if clip_denoised:
-                s = 1.
-                if self.use_dynamic_thres:
-                    s = torch.quantile(
-                        rearrange(x_start, 'b ... -> b (...)').abs(),
-                        self.dynamic_thres_percentile,
-                        dim=-1
-                    )
-
-                    s.clamp_(min=1.)
-                    s = s.view(-1, *((1,) * (x_start.ndim - 1)))
-
-                # clip by threshold, depending on whether static or dynamic
-                x_start = x_start.clamp(-s, s) / s
-
-            sigma = eta * ((1 - alpha / alpha_next) * (1 - alpha_next) / (1 - alpha)).sqrt()
-            c = ((1 - alpha_next) - sigma ** 2).sqrt()
-
-            noise = torch.randn_like(img) if time_next > 0 else 0.
-
-            img = x_start * alpha_next.sqrt() + \
-                  c * pred_noise + \
-                  sigma * noise
-
-        # img = unnormalize_to_zero_to_one(img)
-        return img
-
-    @torch.inference_mode()
-    def interpolate(self, x1, x2, t=None, lam=0.5):
-        b, *_, device = *x1.shape, x1.device
-        t = default(t, self.num_timesteps - 1)
-
-        assert x1.shape == x2.shape
-
-        t_batched = torch.stack([torch.tensor(t, device=device)] * b)
-        xt1, xt2 = map(lambda x: self.q_sample(x, t=t_batched), (x1, x2))
-
-        img = (1 - lam) * xt1 + lam * xt2
-        for i in tqdm(reversed(range(0, t)), desc='interpolation sample time step', total=t):
-            img = self.p_sample(img, torch.full((b,), i, device=device, dtype=torch.long))
-
-        return img
-
-    def q_sample(self, x_start, t, noise=None):
-        noise = default(noise, lambda: torch.randn_like(x_start))
-
-        return (
-                extract(self.sqrt_alphas_cumprod, t, x_start.shape) * x_start +
-                extract(self.sqrt_one_minus_alphas_cumprod, t, x_start.shape) * noise
-        )
-
-    def p_losses(self, x_start, t, fea, cond=None, noise=None, clip_denoised=True, **kwargs):
-        b, c, f, h, w, device = *x_start.shape, x_start.device
-        noise = default(noise, lambda: torch.randn_like(x_start))
-
-        x_noisy = self.q_sample(x_start=x_start, t=t, noise=noise)
-
-        if is_list_str(cond):
-            none_cond_mask = [ii == "None" for ii in cond]
-            cond = bert_embed(tokenize(cond), return_cls_repr=self.text_use_bert_cls)
-            cond = cond.to(device)
-
-        pred_noise = self.denoise_fn.forward(torch.cat([x_noisy, fea], dim=1), t, cond=cond,
-                                        null_cond_prob=self.null_cond_prob,
-                                        none_cond_mask=none_cond_mask,
-                                        **kwargs)
-
-        if self.loss_type == 'l1':
-            loss = F.l1_loss(noise, pred_noise)
-        elif self.loss_type == 'l2':
-            loss = F.mse_loss(noise, pred_noise)
-        else:
-            raise NotImplementedError()
-
-        pred_x0 = self.predict_start_from_noise(x_noisy, t, pred_noise)
-
-        if clip_denoised:
-            s = 1.
-            if self.use_dynamic_thres:
-                s = torch.quantile(
-                    rearrange(pred_x0, 'b ... -> b (...)').abs(),
-                    self.dynamic_thres_percentile,
-                    dim=-1
-                )
-
-                s.clamp_(min=1.)
-                s = s.view(-1, *((1,) * (pred_x0.ndim - 1)))
-
-            # clip by threshold, depending on whether static or dynamic
-            self.pred_x0 = pred_x0.clamp(-s, s) / s
-
-        return loss
-
-    def forward(self, x, fea, text, *args, **kwargs):
-        b, device, img_size, = x.shape[0], x.device, self.image_size
-        # check_shape(x, 'b c f h w', c=self.channels, f=self.num_frames, h=img_size, w=img_size)
-        t = torch.randint(0, self.num_timesteps, (b,), device=device).long()
-        fea = fea.unsqueeze(dim=2).repeat(1, 1, x.size(2), 1, 1)
-        # x = normalize_img(x)
-        return self.p_losses(x, t, fea, cond=text, *args, **kwargs)
-
-
-# trainer class
-
-CHANNELS_TO_MODE = {
-    1: 'L',
-    3: 'RGB',
-    4: 'RGBA'
-}
-
-
-def seek_all_images(img, channels=3):
-    assert channels in CHANNELS_TO_MODE, f'channels {channels} invalid'
-    mode = CHANNELS_TO_MODE[channels]
-
-    i = 0
-    while True:
-        try:
-            img.seek(i)
-            yield img.convert(mode)
-        except EOFError:
-            break
-        i += 1
-
-
-# tensor of shape (channels, frames, height, width) -> gif
-
-def video_tensor_to_gif(tensor, path, duration=120, loop=0, optimize=True):
-    images = map(T.ToPILImage(), tensor.unbind(dim=1))
-    first_img, *rest_imgs = images
-    first_img.save(path, save_all=True, append_images=rest_imgs, duration=duration, loop=loop, optimize=optimize)
-    return images
-
-
-# gif -> (channels, frame, height, width) tensor
-
-def gif_to_tensor(path, channels=3, transform=T.ToTensor()):
-    img = Image.open(path)
-    tensors = tuple(map(transform, seek_all_images(img, channels=channels)))
-    return torch.stack(tensors, dim=1)
-
-
-def identity(t, *args, **kwargs):
-    return t
-
-
-def normalize_img(t):
-    return t * 2 - 1
-
-
-# def unnormalize_img(t):
-#     return (t + 1) * 0.5
-
-
-def cast_num_frames(t, *, frames):
-    f = t.shape[1]
-
-    if f == frames:
-        return t
-
-    if f > frames:
-        return t[:, :frames]
-
-    return F.pad(t, (0, 0, 0, 0, 0, frames - f))
-
-
+import math
+import torch
+from torch import nn, einsum
+import torch.nn.functional as F
+from functools import partial
+
+from torchvision import transforms as T
+from PIL import Image
+
+from tqdm import tqdm
+from einops import rearrange
+from einops_exts import rearrange_many
+
+from rotary_embedding_torch import RotaryEmbedding
+from rotary_embedding_torch.rotary_embedding_torch import rotate_half
+
+from DM.modules.text import embed_texts, BERT_MODEL_DIM
+from LFAE.modules.util import autocast, checkpoint, checkpoint_levels
+
+
+# helpers functions
+
+def exists(x):
+    return x is not None
+
+
+def noop(*args, **kwargs):
+    pass
+
+
+def is_odd(n):
+    return (n % 2) == 1
+
+
+def default(val, d):
+    if exists(val):
+        return val
+    return d() if callable(d) else d
+
+
+def cycle(dl):
+    while True:
+        for data in dl:
+            yield data
+
+
+def num_to_groups(num, divisor):
+    groups = num // divisor
+    remainder = num % divisor
+    arr = [divisor] * groups
+    if remainder > 0:
+        arr.append(remainder)
+    return arr
+
+
+def double_batch(val, batch):
+    # stack a per-sample argument twice along the batch, for the cond / uncond halves of guidance
+    if torch.is_tensor(val) and val.dim() > 0 and val.shape[0] == batch:
+        return torch.cat((val, val), dim=0)
+    if isinstance(val, (list, tuple)) and len(val) == batch:
+        return list(val) + list(val)
+    return val
+
+
+def conv_fea(conv, fea):
+    """
+    The trailing fea.shape[1] input channels of a (1, k, k) Conv3d applied to a frame-invariant
+    feature (b, c, h, w) as a 2D conv, (b, c_out, 1, h, w) broadcasts over frames
+    """
+    weight = conv.weight[:, -fea.shape[1]:, 0]
+    return F.conv2d(fea, weight, None, padding=conv.padding[1:]).unsqueeze(2)
+
+
+def conv_with_fea(conv, x, fea_emb):
+    # same as conv(torch.cat([x, fea.unsqueeze(2).repeat(...)], dim=1)) with fea_emb = conv_fea(conv, fea)
+    return F.conv3d(x, conv.weight[:, :x.shape[1]], conv.bias, padding=conv.padding) + fea_emb
+
+
+def prob_mask_like(shape, prob, device):
+    if prob == 1:
+        return torch.ones(shape, device=device, dtype=torch.bool)
+    elif prob == 0:
+        return torch.zeros(shape, device=device, dtype=torch.bool)
+    else:
+        return torch.zeros(shape, device=device).float().uniform_(0, 1) < prob
+
+
+def is_list_str(x):
+    if not isinstance(x, (list, tuple)):
+        return False
+    return all([type(el) == str for el in x])
+
+
+# relative positional bias
+
+class RelativePositionBias(nn.Module):
+    def __init__(
+            self,
+            heads=8,
+            num_buckets=32,
+            max_distance=128
+    ):
+        super().__init__()
+        self.num_buckets = num_buckets
+        self.max_distance = max_distance
+        self.relative_attention_bias = nn.Embedding(num_buckets, heads)
+        # (n, device, dtype) -> ((weight storage, weight version), bias), only used when no gradient is needed.
+        # The storage tells apart a copy of the module (copy.deepcopy for the EMA), whose version counter restarts
+        self.bias_cache = {}
+
+    @staticmethod
+    def _relative_position_bucket(relative_position, num_buckets=32, max_distance=128):
+        ret = 0
+        n = -relative_position
+
+        num_buckets //= 2
+        ret += (n < 0).long() * num_buckets
+        n = torch.abs(n)
+
+        max_exact = num_buckets // 2
+        is_small = n < max_exact
+
+        val_if_large = max_exact + (
+                torch.log(n.float() / max_exact) / math.log(max_distance / max_exact) * (num_buckets - max_exact)
+        ).long()
+        val_if_large = torch.min(val_if_large, torch.full_like(val_if_large, num_buckets - 1))
+
+        ret += torch.where(is_small, n, val_if_large)
+        return ret
+
+    def forward(self, n, device):
+        weight = self.relative_attention_bias.weight
+        if torch.is_grad_enabled() and weight.requires_grad:
+            return self.compute_bias(n, device)
+        # the bias only depends on the frame count, rebuilt after every in-place update of the weight
+        key = (n, str(device), weight.dtype)
+        stamp = (weight.data_ptr(), weight._version)
+        if key not in self.bias_cache or self.bias_cache[key][0] != stamp:
+            with torch.inference_mode(False), torch.no_grad():
+                self.bias_cache[key] = (stamp, self.compute_bias(n, device))
+        return self.bias_cache[key][1]
+
+    def compute_bias(self, n, device):
+        q_pos = torch.arange(n, dtype=torch.long, device=device)
+        k_pos = torch.arange(n, dtype=torch.long, device=device)
+        rel_pos = rearrange(k_pos, 'j -> 1 j') - rearrange(q_pos, 'i -> i 1')
+        rp_bucket = self._relative_position_bucket(rel_pos, num_buckets=self.num_buckets,
+                                                   max_distance=self.max_distance)
+        values = self.relative_attention_bias(rp_bucket)
+        return rearrange(values, 'i j h -> h i j')
+
+
+class CachedRotaryEmbedding(RotaryEmbedding):
+    """
+    RotaryEmbedding with the cos / sin tables memoized per (frames, device, dtype), shared by every
+    temporal attention layer and every sampling step, rebuilt after every in-place update of freqs
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.table_cache = {}
+
+    def rotation_table(self, n, device, dtype):
+        key = (n, str(device), dtype)
+        # storage and version of freqs as in RelativePositionBias.forward
+        stamp = (self.freqs.data_ptr(), self.freqs._version)
+        if key not in self.table_cache or self.table_cache[key][0] != stamp:
+            with torch.inference_mode(False), torch.no_grad():
+                freqs = self(torch.arange(n, device=device, dtype=dtype)).float()
+                self.table_cache[key] = (stamp, freqs.cos(), freqs.sin())
+        return self.table_cache[key][1:]
+
+    def rotate_queries_or_keys(self, t, seq_dim=-2):
+        if self.freqs.requires_grad and torch.is_grad_enabled():
+            return super().rotate_queries_or_keys(t, seq_dim=seq_dim)
+        assert seq_dim == -2
+        cos, sin = self.rotation_table(t.shape[seq_dim], t.device, t.dtype)
+        rot_dim = cos.shape[-1]
+        t_rot, t_pass = t[..., :rot_dim], t[..., rot_dim:]
+        t_rot = t_rot * cos + rotate_half(t_rot) * sin
+        return torch.cat((t_rot, t_pass), dim=-1).type(t.dtype)
+
+
+# small helper modules
+
+class EMA():
+    """
+    Exponential moving average of the parameters of current_model into ma_model, a copy of it.
+    All parameters are averaged at once with torch._foreach_lerp_, the lists of parameters are built
+    on the first call. update is called after every optimizer step and averages every update_every
+    steps: ma_model follows current_model exactly for the first update_after_step steps, then the decay
+    warms up as min(beta, (1 + n) / (10 + n)) after n more steps. It is raised to the power update_every
+    so that the averaging horizon does not depend on the interval. Buffers are not averaged, those of
+    GaussianDiffusion are constant schedules
+    """
+
+    def __init__(self, beta, update_every=1, update_after_step=0):
+        super().__init__()
+        self.beta = beta
+        self.update_every = update_every
+        self.update_after_step = update_after_step
+        # optimizer steps seen by update, saved with the averaged weights to resume the warm-up
+        self.num_steps = 0
+        self.param_lists = {}
+
+    def get_param_lists(self, ma_model, current_model):
+        key = (id(ma_model), id(current_model))
+        if key not in self.param_lists:
+            # matched by name, ma_model may have been built from an earlier state of current_model
+            ma_params = dict(ma_model.named_parameters())
+            current_params = dict(current_model.named_parameters())
+            assert ma_params.keys() == current_params.keys(), "ma_model is not a copy of current_model"
+            self.param_lists[key] = ([ma_params[name] for name in current_params], list(current_params.values()))
+        return self.param_lists[key]
+
+    def get_decay(self):
+        num_steps = self.num_steps - self.update_after_step
+        if num_steps <= 0:
+            return 0.
+        return min(self.beta, (1 + num_steps) / (10 + num_steps)) ** self.update_every
+
+    @torch.no_grad()
+    def update(self, ma_model, current_model):
+        self.num_steps += 1
+        if self.num_steps % self.update_every != 0:
+            return
+        ma_params, current_params = self.get_param_lists(ma_model, current_model)
+        # a weight of 1 copies current_model exactly
+        torch._foreach_lerp_(ma_params, current_params, 1. - self.get_decay())
+
+    @torch.no_grad()
+    def update_model_average(self, ma_model, current_model):
+        ma_params, current_params = self.get_param_lists(ma_model, current_model)
+        torch._foreach_lerp_(ma_params, current_params, 1. - self.beta)
+
+    def update_average(self, old, new):
+        if old is None:
+            return new
+        return old * self.beta + (1 - self.beta) * new
+
+
+class Residual(nn.Module):
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+
+    def forward(self, x, *args, **kwargs):
+        return self.fn(x, *args, **kwargs) + x
+
+
+class SinusoidalPosEmb(nn.Module):
+    def __init__(self, dim):
+        super().__init__()
+        self.dim = dim
+
+    def forward(self, x):
+        device = x.device
+        half_dim = self.dim // 2
+        emb = math.log(10000) / (half_dim - 1)
+        emb = torch.exp(torch.arange(half_dim, device=device) * -emb)
+        emb = x[:, None] * emb[None, :]
+        emb = torch.cat((emb.sin(), emb.cos()), dim=-1)
+        return emb
+
+
+def Upsample(dim, use_deconv=True, padding_mode="reflect"):
+    if use_deconv:
+        return nn.ConvTranspose3d(dim, dim, (1, 4, 4), (1, 2, 2), (0, 1, 1))
+    else:
+        return nn.Sequential(
+            nn.Upsample(scale_factor=(1, 2, 2), mode='nearest'),
+            nn.Conv3d(dim, dim, (1, 3, 3), (1, 1, 1), (0, 1, 1), padding_mode=padding_mode)
+        )
+
+
+def Downsample(dim):
+    return nn.Conv3d(dim, dim, (1, 4, 4), (1, 2, 2), (0, 1, 1))
+
+
+class LayerNorm(nn.Module):
+    def __init__(self, dim, eps=1e-5):
+        super().__init__()
+        self.eps = eps
+        self.gamma = nn.Parameter(torch.ones(1, dim, 1, 1, 1))
+
+    def forward(self, x):
+        var = torch.var(x, dim=1, unbiased=False, keepdim=True)
+        mean = torch.mean(x, dim=1, keepdim=True)
+        return (x - mean) / (var + self.eps).sqrt() * self.gamma
+
+
+class PreNorm(nn.Module):
+    def __init__(self, dim, fn):
+        super().__init__()
+        self.fn = fn
+        self.norm = LayerNorm(dim)
+
+    def forward(self, x, **kwargs):
+        x = self.norm(x)
+        return self.fn(x, **kwargs)
+
+
+# building block modules
+
+
+class Block(nn.Module):
+    def __init__(self, dim, dim_out, groups=8):
+        super().__init__()
+        self.proj = nn.Conv3d(dim, dim_out, (1, 3, 3), padding=(0, 1, 1))
+        self.norm = nn.GroupNorm(groups, dim_out)
+        self.act = nn.SiLU()
+
+    def forward(self, x, scale_shift=None):
+        x = self.proj(x)
+        x = self.norm(x)
+
+        if exists(scale_shift):
+            scale, shift = scale_shift
+            x = x * (scale + 1) + shift
+
+        return self.act(x)
+
+
+class ResnetBlock(nn.Module):
+    def __init__(self, dim, dim_out, *, time_emb_dim=None, groups=8):
+        super().__init__()
+        self.mlp = nn.Sequential(
+            nn.SiLU(),
+            nn.Linear(time_emb_dim, dim_out * 2)
+        ) if exists(time_emb_dim) else None
+
+        self.block1 = Block(dim, dim_out, groups=groups)
+        self.block2 = Block(dim_out, dim_out, groups=groups)
+        self.res_conv = nn.Conv3d(dim, dim_out, 1) if dim != dim_out else nn.Identity()
+
+    def forward(self, x, time_emb=None):
+        scale_shift = None
+        if exists(self.mlp):
+            assert exists(time_emb), 'time emb must be passed in'
+            time_emb = self.mlp(time_emb)
+            time_emb = rearrange(time_emb, 'b c -> b c 1 1 1')
+            scale_shift = time_emb.chunk(2, dim=1)
+
+        h = self.block1(x, scale_shift=scale_shift)
+
+        h = self.block2(h)
+        return h + self.res_conv(x)
+
+
+class SpatialLinearAttention(nn.Module):
+    def __init__(self, dim, heads=4, dim_head=32):
+        super().__init__()
+        self.scale = dim_head ** -0.5
+        self.heads = heads
+        hidden_dim = dim_head * heads
+        self.to_qkv = nn.Conv2d(dim, hidden_dim * 3, 1, bias=False)
+        self.to_out = nn.Conv2d(hidden_dim, dim, 1)
+
+    def forward(self, x):
+        b, c, f, h, w = x.shape
+        x = rearrange(x, 'b c f h w -> (b f) c h w')
+
+        qkv = self.to_qkv(x).chunk(3, dim=1)
+        q, k, v = rearrange_many(qkv, 'b (h c) x y -> b h c (x y)', h=self.heads)
+
+        q = q.softmax(dim=-2)
+        k = k.softmax(dim=-1)
+
+        q = q * self.scale
+        context = torch.einsum('b h d n, b h e n -> b h d e', k, v)
+
+        out = torch.einsum('b h d e, b h d n -> b h e n', context, q)
+        out = rearrange(out, 'b h c (x y) -> b (h c) x y', h=self.heads, x=h, y=w)
+        out = self.to_out(out)
+        return rearrange(out, '(b f) c h w -> b c f h w', b=b)
+
+
+# attention along space and time
+
+class EinopsToAndFrom(nn.Module):
+    def __init__(self, from_einops, to_einops, fn):
+        super().__init__()
+        self.from_einops = from_einops
+        self.to_einops = to_einops
+        self.fn = fn
+
+    def forward(self, x, **kwargs):
+        shape = x.shape
+        reconstitute_kwargs = dict(tuple(zip(self.from_einops.split(' '), shape)))
+        x = rearrange(x, f'{self.from_einops} -> {self.to_einops}')
+        x = self.fn(x, **kwargs)
+        x = rearrange(x, f'{self.to_einops} -> {self.from_einops}', **reconstitute_kwargs)
+        return x
+
+
+# attention backends
+# "math" materializes the full (..., h, n, n) similarity like the original implementation,
+# "sdpa" runs F.scaled_dot_product_attention (flash / memory efficient kernels on GPU),
+# "chunked" computes the softmax over blocks of queries so that only (..., h, chunk, n) is alive at once,
+# "auto" picks sdpa on GPU when the installed torch has it and chunked otherwise
+
+ATTENTION_BACKENDS = ("auto", "math", "sdpa", "chunked")
+ATTENTION_BACKEND = "auto"
+ATTENTION_CHUNK_SIZE = 1024
+
+
+def set_attention_backend(backend, chunk_size=None):
+    global ATTENTION_BACKEND, ATTENTION_CHUNK_SIZE
+    assert backend in ATTENTION_BACKENDS, f'attention backend must be one of {ATTENTION_BACKENDS}'
+    ATTENTION_BACKEND = backend
+    ATTENTION_CHUNK_SIZE = default(chunk_size, ATTENTION_CHUNK_SIZE)
+
+
+def resolve_attention_backend(backend, device):
+    backend = default(backend, ATTENTION_BACKEND)
+    if backend == "auto":
+        has_sdpa = hasattr(F, "scaled_dot_product_attention")
+        return "sdpa" if has_sdpa and device.type == "cuda" else "chunked"
+    return backend
+
+
+def attend(q, k, v, scale, bias=None, backend=None, chunk_size=None):
+    """
+    softmax(q k^T * scale + bias) v for q, k, v of shape (..., h, n, d), bias broadcastable to (..., h, n, n)
+    """
+    backend = resolve_attention_backend(backend, q.device)
+
+    if backend == "sdpa":
+        *batch, h, n, d = q.shape
+        # the fused kernels want (b, h, n, d), the default sdpa scale is d ** -0.5
+        q, k, v = map(lambda t: t.reshape(-1, *t.shape[-3:]), (q, k, v))
+        if scale != d ** -0.5:
+            q = q * (scale * d ** 0.5)
+        if exists(bias):
+            bias = bias.to(q.dtype)
+            if bias.ndim > 4:
+                bias = bias.expand(*batch, h, n, k.shape[-2]).reshape(-1, h, n, k.shape[-2])
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=bias)
+        return out.reshape(*batch, h, n, d)
+
+    q = q * scale
+
+    if backend == "math":
+        chunk_size = q.shape[-2]
+    else:
+        chunk_size = default(chunk_size, ATTENTION_CHUNK_SIZE)
+
+    out = []
+    for i in range(0, q.shape[-2], chunk_size):
+        sim = einsum('... h i d, ... h j d -> ... h i j', q[..., i:i + chunk_size, :], k)
+
+        # relative positional bias
+
+        if exists(bias):
+            sim = sim + bias[..., i:i + chunk_size, :]
+
+        # numerical stability
+
+        sim = sim - sim.amax(dim=-1, keepdim=True).detach()
+        attn = sim.softmax(dim=-1)
+
+        # aggregate values
+
+        out.append(einsum('... h i j, ... h j d -> ... h i d', attn, v))
+    return torch.cat(out, dim=-2) if len(out) > 1 else out[0]
+
+
+def multihead_self_attention(mha, x, backend=None):
+    """
+    self attention of a batch_first nn.MultiheadAttention (no dropout, no masks) through attend,
+    using the module's own in_proj / out_proj weights
+    """
+    if default(backend, ATTENTION_BACKEND) == "math":
+        out, _ = mha(x, x, x)
+        return out
+    q, k, v = F.linear(x, mha.in_proj_weight, mha.in_proj_bias).chunk(3, dim=-1)
+    q, k, v = rearrange_many((q, k, v), 'b n (h d) -> b h n d', h=mha.num_heads)
+    out = attend(q, k, v, mha.head_dim ** -0.5, backend=backend)
+    out = rearrange(out, 'b h n d -> b n (h d)')
+    return mha.out_proj(out)
+
+
+class Attention(nn.Module):
+    def __init__(
+            self,
+            dim,
+            heads=4,
+            dim_head=32,
+            rotary_emb=None,
+            backend=None
+    ):
+        super().__init__()
+        self.scale = dim_head ** -0.5
+        self.heads = heads
+        hidden_dim = dim_head * heads
+
+        self.rotary_emb = rotary_emb
+        # None follows the module level ATTENTION_BACKEND
+        self.backend = backend
+        self.to_qkv = nn.Linear(dim, hidden_dim * 3, bias=False)
+        self.to_out = nn.Linear(hidden_dim, dim, bias=False)
+
+    def forward(
+            self,
+            x,
+            pos_bias=None,
+            focus_present_mask=None
+    ):
+        qkv = self.to_qkv(x).chunk(3, dim=-1)
+
+        if exists(focus_present_mask) and focus_present_mask.all():
+            # if all batch samples are focusing on present
+            # it would be equivalent to passing that token's values through to the output
+            values = qkv[-1]
+            return self.to_out(values)
+
+        # split out heads
+
+        q, k, v = rearrange_many(qkv, '... n (h d) -> ... h n d', h=self.heads)
+
+        # rotate positions into queries and keys for time attention
+        # (the rotation is linear, so the scale is applied inside attend)
+
+        if exists(self.rotary_emb):
+            q = self.rotary_emb.rotate_queries_or_keys(q)
+            k = self.rotary_emb.rotate_queries_or_keys(k)
+
+        out = attend(q, k, v, self.scale, bias=pos_bias, backend=self.backend)
+
+        if exists(focus_present_mask) and not (~focus_present_mask).all():
+            # a sample focusing on present only attends to itself, so its output is exactly its values
+            out = torch.where(rearrange(focus_present_mask, 'b -> b 1 1 1 1'), v, out)
+
+        out = rearrange(out, '... h n d -> ... n (h d)')
+        return self.to_out(out)
+
+
+# model
+
+class Unet3D(nn.Module):
+    def __init__(
+            self,
+            dim,
+            cond_dim=None,
+            out_grid_dim=2,
+            out_conf_dim=1,
+            dim_mults=(1, 2, 4, 8),
+            channels=3,
+            attn_heads=8,
+            attn_dim_head=32,
+            use_bert_text_cond=False,
+            init_dim=None,
+            init_kernel_size=7,
+            use_sparse_linear_attn=True,
+            resnet_groups=8,
+            use_final_activation=False,
+            learn_null_cond=False,
+            use_deconv=True,
+            padding_mode="zeros",
+            checkpoint_stages=(),
+    ):
+        super().__init__()
+        self.null_cond_mask = None
+        self.channels = channels
+        # stages whose activations are recomputed in backward, "downs", "mid", "ups" or single levels
+        # such as "downs.0", see LFAE.modules.util.set_checkpoint_stages
+        self.checkpoint_stages = tuple(checkpoint_stages)
+
+        # temporal attention and its relative positional encoding
+
+        rotary_emb = CachedRotaryEmbedding(min(32, attn_dim_head))
+
+        temporal_attn = lambda dim: EinopsToAndFrom('b c f h w', 'b (h w) f c',
+                                                    Attention(dim, heads=attn_heads, dim_head=attn_dim_head,
+                                                              rotary_emb=rotary_emb))
+
+        self.time_rel_pos_bias = RelativePositionBias(heads=attn_heads,
+                                                      max_distance=32)  # realistically will not be able to generate that many frames of video... yet
+
+        # initial conv
+
+        init_dim = default(init_dim, dim)
+        assert is_odd(init_kernel_size)
+
+        init_padding = init_kernel_size // 2
+        self.init_conv = nn.Conv3d(channels, init_dim, (1, init_kernel_size, init_kernel_size),
+                                   padding=(0, init_padding, init_padding))
+
+        self.init_temporal_attn = Residual(PreNorm(init_dim, temporal_attn(init_dim)))
+
+        # dimensions
+
+        dims = [init_dim, *map(lambda m: dim * m, dim_mults)]
+        in_out = list(zip(dims[:-1], dims[1:]))
+
+        # time conditioning
+
+        time_dim = dim * 4
+        self.time_mlp = nn.Sequential(
+            SinusoidalPosEmb(dim),
+            nn.Linear(dim, time_dim),
+            nn.GELU(),
+            nn.Linear(time_dim, time_dim)
+        )
+
+        # text conditioning
+
+        self.has_cond = exists(cond_dim) or use_bert_text_cond
+        cond_dim = BERT_MODEL_DIM if use_bert_text_cond else cond_dim
+
+        # modified by nhm
+        self.learn_null_cond = learn_null_cond
+        if self.learn_null_cond:
+            self.null_cond_emb = nn.Parameter(torch.randn(1, cond_dim)) if self.has_cond else None
+        else:
+            # buffer, follows the module to its device
+            self.register_buffer('null_cond_emb', torch.zeros(1, cond_dim) if self.has_cond else None,
+                                 persistent=False)
+
+        cond_dim = time_dim + int(cond_dim or 0)
+
+        # layers
+
+        self.downs = nn.ModuleList([])
+        self.ups = nn.ModuleList([])
+
+        num_resolutions = len(in_out)
+
+        # block type
+
+        block_klass = partial(ResnetBlock, groups=resnet_groups)
+        block_klass_cond = partial(block_klass, time_emb_dim=cond_dim)
+
+        # modules for all layers
+
+        for ind, (dim_in, dim_out) in enumerate(in_out):
+            is_last = ind >= (num_resolutions - 1)
+
+            self.downs.append(nn.ModuleList([
+                block_klass_cond(dim_in, dim_out),
+                block_klass_cond(dim_out, dim_out),
+                Residual(PreNorm(dim_out, SpatialLinearAttention(dim_out,
+                                                                 heads=attn_heads))) if use_sparse_linear_attn else nn.Identity(),
+                Residual(PreNorm(dim_out, temporal_attn(dim_out))),
+                Downsample(dim_out) if not is_last else nn.Identity()
+            ]))
+
+        mid_dim = dims[-1]
+        self.mid_block1 = block_klass_cond(mid_dim, mid_dim)
+
+        spatial_attn = EinopsToAndFrom('b c f h w', 'b f (h w) c', Attention(mid_dim, heads=attn_heads))
+
+        self.mid_spatial_attn = Residual(PreNorm(mid_dim, spatial_attn))
+        self.mid_temporal_attn = Residual(PreNorm(mid_dim, temporal_attn(mid_dim)))
+
+        self.mid_block2 = block_klass_cond(mid_dim, mid_dim)
+
+        for ind, (dim_in, dim_out) in enumerate(reversed(in_out)):
+            is_last = ind >= (num_resolutions - 1)
+
+            self.ups.append(nn.ModuleList([
+                block_klass_cond(dim_out * 2, dim_in),
+                block_klass_cond(dim_in, dim_in),
+                Residual(PreNorm(dim_in, SpatialLinearAttention(dim_in,
+                                                                heads=attn_heads))) if use_sparse_linear_attn else nn.Identity(),
+                Residual(PreNorm(dim_in, temporal_attn(dim_in))),
+                Upsample(dim_in, use_deconv, padding_mode) if not is_last else nn.Identity()
+            ]))
+
+        # out_dim = default(out_grid_dim, channels)
+        self.final_conv = nn.Sequential(
+            block_klass(dim * 2, dim),
+            nn.Conv3d(dim, out_grid_dim, 1)
+        )
+
+        # added by nhm
+        self.use_final_activation = use_final_activation
+        if self.use_final_activation:
+            self.final_activation = nn.Tanh()
+        else:
+            self.final_activation = nn.Identity()
+
+        # added by nhm for predicting occlusion mask
+        self.occlusion_map = nn.Sequential(
+            block_klass(dim * 2, dim),
+            nn.Conv3d(dim, out_conf_dim, 1)
+        )
+
+    def encode_fea(self, fea):
+        # frame-invariant reference feature (b, c, h, w) through the first conv, once per clip
+        return conv_fea(self.init_conv, fea)
+
+    def forward_with_cond_scale(
+            self,
+            x,
+            *args,
+            cond_scale=2.,
+            batched_cfg=True,
+            **kwargs
+    ):
+        if cond_scale == 0:
+            null_logits = self.forward(x, *args, null_cond_prob=1., **kwargs)
+            return null_logits
+
+        if cond_scale == 1 or not self.has_cond:
+            return self.forward(x, *args, null_cond_prob=0., **kwargs)
+
+        if not batched_cfg:
+            logits = self.forward(x, *args, null_cond_prob=0., **kwargs)
+            null_logits = self.forward(x, *args, null_cond_prob=1., **kwargs)
+            return null_logits + (logits - null_logits) * cond_scale
+
+        # conditional and unconditional samples in one pass, the first half keeps its condition
+        batch = x.shape[0]
+        null_cond_mask = torch.arange(2 * batch, device=x.device) >= batch
+        args = [double_batch(arg, batch) for arg in args]
+        kwargs = {key: double_batch(value, batch) for key, value in kwargs.items()}
+        logits, null_logits = self.forward(double_batch(x, batch), *args,
+                                           null_cond_mask=null_cond_mask, **kwargs).chunk(2, dim=0)
+        return null_logits + (logits - null_logits) * cond_scale
+
+    def forward(
+            self,
+            x,
+            time,
+            cond=None,
+            null_cond_prob=0.,
+            none_cond_mask=None,
+            focus_present_mask=None,
+            prob_focus_present=0.,
+            # probability at which a given batch sample will focus on the present (0. is all off, 1. is completely arrested attention across time)
+            null_cond_mask=None,
+            # explicit per-sample null condition mask, replaces the random mask drawn with null_cond_prob
+            fea_emb=None
+            # output of encode_fea, then x holds only the frame-dependent channels
+    ):
+        assert not (self.has_cond and not exists(cond)), 'cond must be passed in if cond_dim specified'
+        batch, device = x.shape[0], x.device
+
+        focus_present_mask = default(focus_present_mask,
+                                     lambda: prob_mask_like((batch,), prob_focus_present, device=device))
+
+        time_rel_pos_bias = self.time_rel_pos_bias(x.shape[2], device=x.device)
+
+        x = self.init_conv(x) if fea_emb is None else conv_with_fea(self.init_conv, x, fea_emb)
+        r = x.clone()
+
+        x = self.init_temporal_attn(x, pos_bias=time_rel_pos_bias)
+
+        t = self.time_mlp(time) if exists(self.time_mlp) else None
+
+        # classifier free guidance
+
+        if self.has_cond:
+            batch, device = x.shape[0], x.device
+            if null_cond_mask is not None:
+                self.null_cond_mask = null_cond_mask
+            else:
+                self.null_cond_mask = prob_mask_like((batch,), null_cond_prob, device=device)
+            if none_cond_mask is not None:
+                self.null_cond_mask = torch.logical_or(self.null_cond_mask, torch.tensor(none_cond_mask, device=device))
+            cond = torch.where(rearrange(self.null_cond_mask, 'b -> b 1'), self.null_cond_emb, cond)
+            t = torch.cat((t, cond), dim=-1)
+
+        h = []
+
+        down_levels = checkpoint_levels(self.checkpoint_stages, "downs", len(self.downs))
+        for ind, (*_, downsample) in enumerate(self.downs):
+            if ind in down_levels:
+                x = checkpoint(self.down_level, ind, x, t, time_rel_pos_bias, focus_present_mask)
+            else:
+                x = self.down_level(ind, x, t, time_rel_pos_bias, focus_present_mask)
+            h.append(x)
+            x = downsample(x)
+
+        if "mid" in self.checkpoint_stages:
+            x = checkpoint(self.mid_level, x, t, time_rel_pos_bias, focus_present_mask)
+        else:
+            x = self.mid_level(x, t, time_rel_pos_bias, focus_present_mask)
+
+        up_levels = checkpoint_levels(self.checkpoint_stages, "ups", len(self.ups))
+        for ind in range(len(self.ups)):
+            if ind in up_levels:
+                x = checkpoint(self.up_level, ind, x, h.pop(), t, time_rel_pos_bias, focus_present_mask)
+            else:
+                x = self.up_level(ind, x, h.pop(), t, time_rel_pos_bias, focus_present_mask)
+
+        x = torch.cat((x, r), dim=1)
+        return torch.cat((self.final_conv(x), self.occlusion_map(x)), dim=1)
+
+    def down_level(self, ind, x, t, time_rel_pos_bias, focus_present_mask):
+        # one resolution of the encoder up to its skip connection, the downsampling is left to forward
+        block1, block2, spatial_attn, temporal_attn, _ = self.downs[ind]
+        x = block1(x, t)
+        x = block2(x, t)
+        x = spatial_attn(x)
+        return temporal_attn(x, pos_bias=time_rel_pos_bias, focus_present_mask=focus_present_mask)
+
+    def mid_level(self, x, t, time_rel_pos_bias, focus_present_mask):
+        x = self.mid_block1(x, t)
+        x = self.mid_spatial_attn(x)
+        x = self.mid_temporal_attn(x, pos_bias=time_rel_pos_bias, focus_present_mask=focus_present_mask)
+        return self.mid_block2(x, t)
+
+    def up_level(self, ind, x, skip, t, time_rel_pos_bias, focus_present_mask):
+        block1, block2, spatial_attn, temporal_attn, upsample = self.ups[ind]
+        x = torch.cat((x, skip), dim=1)
+        x = block1(x, t)
+        x = block2(x, t)
+        x = spatial_attn(x)
+        x = temporal_attn(x, pos_bias=time_rel_pos_bias, focus_present_mask=focus_present_mask)
+        return upsample(x)
+
+# gaussian diffusion trainer class
+
+def extract(a, t, x_shape):
+    b, *_ = t.shape
+    out = a.gather(-1, t)
+    return out.reshape(b, *((1,) * (len(x_shape) - 1)))
+
+
+def cosine_beta_schedule(timesteps, s=0.008):
+    """
+    cosine schedule
+    as proposed in https://openreview.net/forum?id=-NEXDKk8gZ
+    """
+    steps = timesteps + 1
+    x = torch.linspace(0, timesteps, steps, dtype=torch.float64)
+    alphas_cumprod = torch.cos(((x / timesteps) + s) / (1 + s) * torch.pi * 0.5) ** 2
+    alphas_cumprod = alphas_cumprod / alphas_cumprod[0]
+    betas = 1 - (alphas_cumprod[1:] / alphas_cumprod[:-1])
+    return torch.clip(betas, 0, 0.9999)
+
+
+class DDIMSamplingPlan(object):
+    """
+    All per-step DDIM scalars of one (sampling_timesteps, eta, schedule) as device tensors, computed once.
+    Matches the step-by-step computation ddim_sample used to do on alphas_cumprod_prev.
+    """
+
+    def __init__(self, diffusion, sampling_timesteps, eta):
+        device = diffusion.betas.device
+        times = torch.linspace(0., diffusion.num_timesteps, steps=sampling_timesteps + 2)[:-1]
+        times = list(reversed(times.int().tolist()))
+        time = torch.tensor(times[:-1], device=device, dtype=torch.long)
+        time_next = torch.tensor(times[1:], device=device, dtype=torch.long)
+
+        alpha = diffusion.alphas_cumprod_prev[time]
+        alpha_next = diffusion.alphas_cumprod_prev[time_next]
+        sigma = eta * ((1 - alpha / alpha_next) * (1 - alpha_next) / (1 - alpha)).sqrt()
+        c = ((1 - alpha_next) - sigma ** 2).sqrt()
+
+        self.times = time
+        self.sqrt_recip_alphas_cumprod = diffusion.sqrt_recip_alphas_cumprod[time].contiguous()
+        self.sqrt_recipm1_alphas_cumprod = diffusion.sqrt_recipm1_alphas_cumprod[time].contiguous()
+        self.sqrt_alphas_next = alpha_next.sqrt()
+        self.c = c
+        self.sigma = sigma
+        self.has_noise = [time > 0 for time in times[1:]]
+        # one tuple of 0-dim device tensors per step, nothing is indexed or allocated on the host in the loop
+        self.steps = list(zip(self.times.unbind(), self.sqrt_recip_alphas_cumprod.unbind(),
+                              self.sqrt_recipm1_alphas_cumprod.unbind(), self.sqrt_alphas_next.unbind(),
+                              self.c.unbind(), self.sigma.unbind(), self.has_noise))
+
+    def __len__(self):
+        return len(self.steps)
+
+    @staticmethod
+    def predict_start_from_noise(x_t, noise, sqrt_recip, sqrt_recipm1):
+        return torch.mul(x_t, sqrt_recip).addcmul_(noise, sqrt_recipm1, value=-1)
+
+    @staticmethod
+    def update(x_start, pred_noise, noise, sqrt_alpha_next, c, sigma):
+        img = torch.mul(x_start, sqrt_alpha_next).addcmul_(pred_noise, c)
+        if noise is not None:
+            img.addcmul_(noise, sigma)
+        return img
+
+
+class GaussianDiffusion(nn.Module):
+    # name -> sampling method, all called as method(fea, shape, cond=cond, cond_scale=cond_scale)
+    SAMPLERS = {
+        "ddpm": "p_sample_loop",
+        "ddim": "ddim_sample",
+        "dpmpp_2m": "dpmpp_2m_sample",
+        "unipc": "unipc_sample",
+        "heun": "heun_sample",
+    }
+    # default timestep spacing of the ode solvers
+    SAMPLER_SPACING = {
+        "dpmpp_2m": "logsnr",
+        "unipc": "logsnr",
+        "heun": "uniform",
+    }
+
+    def __init__(
+            self,
+            denoise_fn,
+            *,
+            image_size,
+            num_frames,
+            text_use_bert_cls=False,
+            channels=3,
+            timesteps=1000,
+            sampling_timesteps=250,
+            ddim_sampling_eta=1.,
+            loss_type='l1',
+            use_dynamic_thres=False,  # from the Imagen paper
+            dynamic_thres_percentile=0.9,
+            null_cond_prob=0.1,
+            sampler=None,
+            timestep_spacing=None,
+            autocast_dtype=None,
+            loss_reduction='mean',
+            timesteps_per_clip=1
+    ):
+        super().__init__()
+        self.null_cond_prob = null_cond_prob
+        self.channels = channels
+        self.image_size = image_size
+        self.num_frames = num_frames
+        self.denoise_fn = denoise_fn
+
+        betas = cosine_beta_schedule(timesteps)
+
+        alphas = 1. - betas
+        alphas_cumprod = torch.cumprod(alphas, axis=0)
+        alphas_cumprod_prev = F.pad(alphas_cumprod[:-1], (1, 0), value=1.)
+
+        timesteps, = betas.shape
+        self.num_timesteps = int(timesteps)
+        self.loss_type = loss_type
+        # 'mean' reduces the loss on the device it is computed on, 'none' keeps the loss of every element
+        self.loss_reduction = loss_reduction
+        # independent (t, noise) draws per training sample, all sent through the denoiser as one batch
+        self.timesteps_per_clip = timesteps_per_clip
+        # clipped x_0 predicted in the last training step, see p_losses
+        self.pred_x0 = None
+
+        self.sampling_timesteps = default(sampling_timesteps,
+                                          timesteps)
+        self.is_ddim_sampling = self.sampling_timesteps < timesteps
+        if self.is_ddim_sampling:
+            print("using ddim samping with %d steps" % sampling_timesteps)
+        self.ddim_sampling_eta = ddim_sampling_eta
+        # one of SAMPLERS, the ancestral loop or ddim depending on sampling_timesteps by default
+        self.sampler = default(sampler, "ddim" if self.is_ddim_sampling else "ddpm")
+        assert self.sampler in self.SAMPLERS, "unknown sampler %s" % self.sampler
+        # one of "uniform", "quadratic", "logsnr", the sampler's own default if None
+        self.timestep_spacing = timestep_spacing
+        # DDIMSamplingPlan cache, see get_ddim_plan
+        self.ddim_plans = {}
+        # torch.float16 / torch.bfloat16 to run the denoiser under autocast, see run_denoiser
+        self.autocast_dtype = autocast_dtype
+
+        # register buffer helper function that casts float64 to float32
+
+        register_buffer = lambda name, val: self.register_buffer(name, val.to(torch.float32))
+
+        register_buffer('betas', betas)
+        register_buffer('alphas_cumprod', alphas_cumprod)
+        register_buffer('alphas_cumprod_prev', alphas_cumprod_prev)
+
+        # calculations for diffusion q(x_t | x_{t-1}) and others
+
+        register_buffer('sqrt_alphas_cumprod', torch.sqrt(alphas_cumprod))
+        register_buffer('sqrt_one_minus_alphas_cumprod', torch.sqrt(1. - alphas_cumprod))
+        register_buffer('log_one_minus_alphas_cumprod', torch.log(1. - alphas_cumprod))
+        register_buffer('sqrt_recip_alphas_cumprod', torch.sqrt(1. / alphas_cumprod))
+        register_buffer('sqrt_recipm1_alphas_cumprod', torch.sqrt(1. / alphas_cumprod - 1))
+        # half log snr, log(alpha_t / sigma_t), the time variable of the ode solvers. Derived from
+        # alphas_cumprod and left out of the state_dict, checkpoints saved without it still load
+        self.register_buffer('lambdas', (0.5 * (torch.log(alphas_cumprod) - torch.log(1. - alphas_cumprod)))
+                             .to(torch.float32), persistent=False)
+
+        # calculations for posterior q(x_{t-1} | x_t, x_0)
+
+        posterior_variance = betas * (1. - alphas_cumprod_prev) / (1. - alphas_cumprod)
+
+        # above: equal to 1. / (1. / (1. - alpha_cumprod_tm1) + alpha_t / beta_t)
+
+        register_buffer('posterior_variance', posterior_variance)
+
+        # below: log calculation clipped because the posterior variance is 0 at the beginning of the diffusion chain
+
+        register_buffer('posterior_log_variance_clipped', torch.log(posterior_variance.clamp(min=1e-20)))
+        register_buffer('posterior_mean_coef1', betas * torch.sqrt(alphas_cumprod_prev) / (1. - alphas_cumprod))
+        register_buffer('posterior_mean_coef2', (1. - alphas_cumprod_prev) * torch.sqrt(alphas) / (1. - alphas_cumprod))
+
+        # text conditioning parameters
+
+        self.text_use_bert_cls = text_use_bert_cls
+
+        # dynamic thresholding when sampling
+
+        self.use_dynamic_thres = use_dynamic_thres
+        self.dynamic_thres_percentile = dynamic_thres_percentile
+
+    def q_mean_variance(self, x_start, t):
+        mean = extract(self.sqrt_alphas_cumprod, t, x_start.shape) * x_start
+        variance = extract(1. - self.alphas_cumprod, t, x_start.shape)
+        log_variance = extract(self.log_one_minus_alphas_cumprod, t, x_start.shape)
+        return mean, variance, log_variance
+
+    def predict_start_from_noise(self, x_t, t, noise):
+        return (
+                extract(self.sqrt_recip_alphas_cumprod, t, x_t.shape) * x_t -
+                extract(self.sqrt_recipm1_alphas_cumprod, t, x_t.shape) * noise
+        )
+
+    def q_posterior(self, x_start, x_t, t):
+        posterior_mean = (
+                extract(self.posterior_mean_coef1, t, x_t.shape) * x_start +
+                extract(self.posterior_mean_coef2, t, x_t.shape) * x_t
+        )
+        posterior_variance = extract(self.posterior_variance, t, x_t.shape)
+        posterior_log_variance_clipped = extract(self.posterior_log_variance_clipped, t, x_t.shape)
+        return posterior_mean, posterior_variance, posterior_log_variance_clipped
+
+    def run_denoiser(self, fn, *args, **kwargs):
+        """
+        fn (a method of denoise_fn) under autocast with self.autocast_dtype, the output is cast back to float32
+        so that the diffusion arithmetic around the denoiser stays in full precision
+        """
+        if self.autocast_dtype is None:
+            return fn(*args, **kwargs)
+        with autocast(self.betas.device, self.autocast_dtype):
+            out = fn(*args, **kwargs)
+        return out.float() if exists(out) else out
+
+    def clip_x_start(self, x_start):
+        # clip by threshold, depending on whether static or dynamic
+        s = 1.
+        if self.use_dynamic_thres:
+            # torch.quantile only supports float32 / float64
+            s = torch.quantile(
+                rearrange(x_start, 'b ... -> b (...)').abs().float(),
+                self.dynamic_thres_percentile,
+                dim=-1
+            )
+
+            s.clamp_(min=1.)
+            s = s.view(-1, *((1,) * (x_start.ndim - 1)))
+        return x_start.clamp(-s, s) / s
+
+    def p_mean_variance(self, x, t, fea_emb, clip_denoised: bool, cond=None, cond_scale=1.):
+        # fea_emb: self.denoise_fn.encode_fea(fea)
+        x_recon = self.predict_start_from_noise(x, t=t, noise=self.run_denoiser(self.denoise_fn.forward_with_cond_scale,
+                                                                                x,
+                                                                                t,
+                                                                                cond=cond,
+                                                                                cond_scale=cond_scale,
+                                                                                fea_emb=fea_emb))
+
+        if clip_denoised:
+            x_recon = self.clip_x_start(x_recon)
+
+        model_mean, posterior_variance, posterior_log_variance = self.q_posterior(x_start=x_recon, x_t=x, t=t)
+        return model_mean, posterior_variance, posterior_log_variance
+
+    @torch.inference_mode()
+    def p_sample(self, x, t, fea_emb, cond=None, cond_scale=1., clip_denoised=True):
+        b, *_, device = *x.shape, x.device
+        model_mean, _, model_log_variance = self.p_mean_variance(x=x, t=t, fea_emb=fea_emb,
+                                                                 clip_denoised=clip_denoised, cond=cond,
+                                                                 cond_scale=cond_scale)
+        noise = torch.randn_like(x)
+        # no noise when t == 0
+        nonzero_mask = (1 - (t == 0).float()).reshape(b, *((1,) * (len(x.shape) - 1)))
+        return model_mean + nonzero_mask * (0.5 * model_log_variance).exp() * noise
+
+    @torch.inference_mode()
+    def p_sample_loop(self, fea, shape, cond=None, cond_scale=1.):
+        device = self.betas.device
+
+        b = shape[0]
+        img = torch.randn(shape, device=device)
+        # the reference feature is the same for every time step
+        fea_emb = self.run_denoiser(self.denoise_fn.encode_fea, fea)
+
+        for i in tqdm(reversed(range(0, self.num_timesteps)), desc='sampling loop time step', total=self.num_timesteps):
+            img = self.p_sample(img, torch.full((b,), i, device=device, dtype=torch.long), fea_emb, cond=cond,
+                                cond_scale=cond_scale)
+
+        return img
+        # return unnormalize_img(img)
+
+    @torch.inference_mode()
+    def sample(self, fea, cond=None, cond_scale=1., batch_size=16):
+        device = next(self.denoise_fn.parameters()).device
+
+        if is_list_str(cond):
+            cond = embed_texts(cond, return_cls_repr=self.text_use_bert_cls, device=device)
+
+        batch_size = cond.shape[0] if exists(cond) else batch_size
+        image_size = self.image_size
+        channels = self.channels
+        num_frames = self.num_frames
+        sample_fn = getattr(self, self.SAMPLERS[self.sampler])
+        return sample_fn(fea, (batch_size, channels, num_frames, image_size, image_size), cond=cond,
+                         cond_scale=cond_scale)
+
+    # ode solvers, sampling_timesteps denoiser calls (2 * sampling_timesteps - 1 for heun)
+
+    def get_sampling_timesteps(self, steps, spacing="uniform"):
+        """
+        Descending timesteps from num_timesteps - 1 to 0 followed by -1, the clean data (alpha = 1, sigma = 0)
+        """
+        total_timesteps = self.num_timesteps
+        if spacing == "uniform":
+            times = torch.linspace(total_timesteps - 1, 0, steps)
+        elif spacing == "quadratic":
+            # denser close to the data
+            times = torch.linspace(math.sqrt(total_timesteps - 1), 0, steps) ** 2
+        elif spacing == "logsnr":
+            # uniform in log snr, nearest discrete timestep
+            lambdas = self.lambdas.cpu()
+            targets = torch.linspace(lambdas[-1].item(), lambdas[0].item(), steps)
+            times = (lambdas[None, :] - targets[:, None]).abs().argmin(dim=1).float()
+        else:
+            raise ValueError("unknown timestep spacing %s" % spacing)
+        times = times.round().long().tolist()
+        # drop repeated timesteps of coarse spacings
+        times = [time for i, time in enumerate(times) if i == 0 or time != times[i - 1]]
+        return times + [-1]
+
+    def model_predictions(self, x, time, fea_emb, cond=None, cond_scale=1., clip_denoised=True):
+        time_cond = torch.full((x.shape[0],), time, device=x.device, dtype=torch.long)
+        pred_noise = self.run_denoiser(self.denoise_fn.forward_with_cond_scale, x, time_cond, cond=cond,
+                                       cond_scale=cond_scale, fea_emb=fea_emb)
+        x_start = self.predict_start_from_noise(x, t=time_cond, noise=pred_noise)
+        if clip_denoised:
+            x_start = self.clip_x_start(x_start)
+        return x_start
+
+    def solver_setup(self, fea, shape):
+        spacing = default(self.timestep_spacing, self.SAMPLER_SPACING[self.sampler])
+        times = self.get_sampling_timesteps(self.sampling_timesteps, spacing)
+        img = torch.randn(shape, device=self.betas.device)
+        # the reference feature is the same for every time step
+        return times, img, self.run_denoiser(self.denoise_fn.encode_fea, fea)
+
+    @torch.no_grad()
+    def dpmpp_2m_sample(self, fea, shape, cond=None, cond_scale=1., clip_denoised=True):
+        # DPM-Solver++(2M), data prediction, first order at the first and the final step
+        times, img, fea_emb = self.solver_setup(fea, shape)
+        x_start_prev, h_prev = None, None
+        for time, time_next in tqdm(list(zip(times[:-1], times[1:])), desc='sampling loop time step'):
+            x_start = self.model_predictions(img, time, fea_emb, cond=cond, cond_scale=cond_scale,
+                                             clip_denoised=clip_denoised)
+            if time_next < 0:
+                img = x_start
+                break
+            alpha_next, sigma, sigma_next = self.sqrt_alphas_cumprod[time_next], \
+                self.sqrt_one_minus_alphas_cumprod[time], self.sqrt_one_minus_alphas_cumprod[time_next]
+            h = self.lambdas[time_next] - self.lambdas[time]
+            if x_start_prev is None:
+                denoised = x_start
+            else:
+                r = h_prev / h
+                denoised = (1 + 1 / (2 * r)) * x_start - 1 / (2 * r) * x_start_prev
+            img = sigma_next / sigma * img - alpha_next * torch.expm1(-h) * denoised
+            x_start_prev, h_prev = x_start, h
+        return img
+
+    @torch.no_grad()
+    def unipc_sample(self, fea, shape, cond=None, cond_scale=1., clip_denoised=True):
+        # UniPC with a second order predictor and corrector (bh2), data prediction, no extra denoiser call
+        times, img, fea_emb = self.solver_setup(fea, shape)
+        x_start_prev, img_prev, order = None, None, 1
+        for i, (time, time_next) in enumerate(tqdm(list(zip(times[:-1], times[1:])),
+                                                   desc='sampling loop time step')):
+            x_start = self.model_predictions(img, time, fea_emb, cond=cond, cond_scale=cond_scale,
+                                             clip_denoised=clip_denoised)
+            if time_next < 0:
+                img = x_start
+                break
+            if img_prev is not None:
+                # corrector, refine the previous step with the model output at its end point
+                img = self.unipc_update(img_prev, times[i - 1], time, x_start_prev, x_start_prev_prev,
+                                        times[i - 2] if i > 1 else None, x_start_corr=x_start, order=order)
+            order = 1 if x_start_prev is None else 2
+            img_prev = img
+            # predictor
+            img = self.unipc_update(img, time, time_next, x_start, x_start_prev,
+                                    times[i - 1] if i > 0 else None, order=order)
+            x_start_prev_prev, x_start_prev = x_start_prev, x_start
+        return img
+
+    def unipc_update(self, img, time, time_next, x_start, x_start_prev, time_prev, x_start_corr=None, order=2):
+        """
+        One UniPC step from time to time_next, the predictor if x_start_corr is None, the corrector otherwise.
+        x_start_prev is the data prediction at time_prev, only used for order 2.
+        """
+        alpha_next, sigma, sigma_next = self.sqrt_alphas_cumprod[time_next], \
+            self.sqrt_one_minus_alphas_cumprod[time], self.sqrt_one_minus_alphas_cumprod[time_next]
+        h = self.lambdas[time_next] - self.lambdas[time]
+        hh = -h
+        h_phi_1 = torch.expm1(hh)
+        b_h = h_phi_1
+        # b_k = k! * phi_{k+1}(hh) / B(h), k = 0, 1
+        h_phi_2 = h_phi_1 / hh - 1
+        b = torch.stack([h_phi_2 / b_h, (h_phi_2 / hh - 0.5) * 2 / b_h])
+        img_next = sigma_next / sigma * img - alpha_next * h_phi_1 * x_start
+        res = 0.
+        if order == 2:
+            r = (self.lambdas[time_prev] - self.lambdas[time]) / h
+            d1 = (x_start_prev - x_start) / r
+            if x_start_corr is None:
+                res = 0.5 * d1
+            else:
+                rhos = torch.linalg.solve(torch.stack([torch.stack([torch.ones_like(r), torch.ones_like(r)]),
+                                                       torch.stack([r, torch.ones_like(r)])]), b)
+                res = rhos[0] * d1 + rhos[1] * (x_start_corr - x_start)
+        elif x_start_corr is not None:
+            res = 0.5 * (x_start_corr - x_start)
+        return img_next - alpha_next * b_h * res
+
+    @torch.no_grad()
+    def heun_sample(self, fea, shape, cond=None, cond_scale=1., clip_denoised=True):
+        # Heun's second order method on x / alpha against sigma / alpha (Karras et al.), euler to the data
+        times, img, fea_emb = self.solver_setup(fea, shape)
+        img = img / self.sqrt_alphas_cumprod[times[0]]
+        for time, time_next in tqdm(list(zip(times[:-1], times[1:])), desc='sampling loop time step'):
+            alpha = self.sqrt_alphas_cumprod[time]
+            sigma = self.sqrt_recipm1_alphas_cumprod[time]
+            x_start = self.model_predictions(img * alpha, time, fea_emb, cond=cond, cond_scale=cond_scale,
+                                             clip_denoised=clip_denoised)
+            if time_next < 0:
+                img = x_start
+                break
+            alpha_next = self.sqrt_alphas_cumprod[time_next]
+            sigma_next = self.sqrt_recipm1_alphas_cumprod[time_next]
+            d = (img - x_start) / sigma
+            img_next = img + (sigma_next - sigma) * d
+            x_start_next = self.model_predictions(img_next * alpha_next, time_next, fea_emb, cond=cond,
+                                                  cond_scale=cond_scale, clip_denoised=clip_denoised)
+            d_next = (img_next - x_start_next) / sigma_next
+            img = img + (sigma_next - sigma) * (d + d_next) / 2
+        return img
+
+    # add by nhm
+    @torch.no_grad()
+    def get_ddim_plan(self, sampling_timesteps=None, eta=None):
+        # built once per (steps, eta, device) and reused by every ddim_sample call
+        sampling_timesteps = default(sampling_timesteps, self.sampling_timesteps)
+        eta = default(eta, self.ddim_sampling_eta)
+        key = (sampling_timesteps, float(eta), str(self.betas.device))
+        if key not in self.ddim_plans:
+            self.ddim_plans[key] = DDIMSamplingPlan(self, sampling_timesteps, eta)
+        return self.ddim_plans[key]
+
+    @torch.no_grad()
+    def ddim_sample(self, fea, shape, cond=None, cond_scale=1., clip_denoised=True):
+        batch, device = shape[0], self.betas.device
+        plan = self.get_ddim_plan()
+
+        img = torch.randn(shape, device=device)
+        noise = torch.empty_like(img)
+        # the reference feature is the same for every time step
+        fea_emb = self.run_denoiser(self.denoise_fn.encode_fea, fea)
+
+        for time_cond, sqrt_recip, sqrt_recipm1, sqrt_alpha_next, c, sigma, has_noise in \
+                tqdm(plan.steps, desc='sampling loop time step'):
+            pred_noise = self.run_denoiser(
+                self.denoise_fn.forward_with_cond_scale,
+                img,
+                time_cond.expand(batch),
+                cond=cond,
+                cond_scale=cond_scale,
+                fea_emb=fea_emb)
+            x_start = plan.predict_start_from_noise(img, pred_noise, sqrt_recip, sqrt_recipm1)
+
+            if clip_denoised:
+                x_start = self.clip_x_start(x_start)
+
+            img = plan.update(x_start, pred_noise, noise.normal_() if has_noise else None,
+                              sqrt_alpha_next, c, sigma)
+
+        # img = unnormalize_to_zero_to_one(img)
+        return img
+
+    @torch.inference_mode()
+    def interpolate(self, x1, x2, t=None, lam=0.5):
+        b, *_, device = *x1.shape, x1.device
+        t = default(t, self.num_timesteps - 1)
+
+        assert x1.shape == x2.shape
+
+        t_batched = torch.stack([torch.tensor(t, device=device)] * b)
+        xt1, xt2 = map(lambda x: self.q_sample(x, t=t_batched), (x1, x2))
+
+        img = (1 - lam) * xt1 + lam * xt2
+        for i in tqdm(reversed(range(0, t)), desc='interpolation sample time step', total=t):
+            img = self.p_sample(img, torch.full((b,), i, device=device, dtype=torch.long))
+
+        return img
+
+    def q_sample(self, x_start, t, noise=None):
+        noise = default(noise, lambda: torch.randn_like(x_start))
+
+        return (
+                extract(self.sqrt_alphas_cumprod, t, x_start.shape) * x_start +
+                extract(self.sqrt_one_minus_alphas_cumprod, t, x_start.shape) * noise
+        )
+
+    def p_losses(self, x_start, t, fea_emb, cond=None, noise=None, clip_denoised=True, **kwargs):
+        b, c, f, h, w, device = *x_start.shape, x_start.device
+        noise = default(noise, lambda: torch.randn_like(x_start))
+
+        x_noisy = self.q_sample(x_start=x_start, t=t, noise=noise)
+
+        none_cond_mask = None
+        if is_list_str(cond):
+            none_cond_mask = [ii == "None" for ii in cond]
+            cond = embed_texts(cond, return_cls_repr=self.text_use_bert_cls, device=device)
+
+        pred_noise = self.run_denoiser(self.denoise_fn.forward, x_noisy, t, cond=cond, fea_emb=fea_emb,
+                                       null_cond_prob=self.null_cond_prob,
+                                       none_cond_mask=none_cond_mask,
+                                       **kwargs)
+
+        if self.loss_type == 'l1':
+            loss = F.l1_loss(noise, pred_noise, reduction=self.loss_reduction)
+        elif self.loss_type == 'l2':
+            loss = F.mse_loss(noise, pred_noise, reduction=self.loss_reduction)
+        else:
+            raise NotImplementedError()
+
+        pred_x0 = self.predict_start_from_noise(x_noisy, t, pred_noise)
+
+        if clip_denoised:
+            self.pred_x0 = self.clip_x_start(pred_x0)
+
+        return loss
+
+    def forward(self, x, fea, text, *args, **kwargs):
+        k = self.timesteps_per_clip
+        fea_emb = self.run_denoiser(self.denoise_fn.encode_fea, fea)
+        if k > 1:
+            # every sample is noised at k time steps, the flow and the feature of a clip are computed once
+            # and the loss is averaged over the b * k denoiser samples
+            x, fea_emb = x.repeat_interleave(k, dim=0), fea_emb.repeat_interleave(k, dim=0)
+            if is_list_str(text):
+                text = [el for el in text for _ in range(k)]
+            elif exists(text):
+                text = text.repeat_interleave(k, dim=0)
+        b, device, img_size, = x.shape[0], x.device, self.image_size
+        # check_shape(x, 'b c f h w', c=self.channels, f=self.num_frames, h=img_size, w=img_size)
+        t = torch.randint(0, self.num_timesteps, (b,), device=device).long()
+        # x = normalize_img(x)
+        loss = self.p_losses(x, t, fea_emb, cond=text, *args, **kwargs)
+        if k > 1 and self.pred_x0 is not None and self.pred_x0.shape[0] == b:
+            # prediction of the first time step of every sample, one per clip as with k = 1
+            self.pred_x0 = self.pred_x0[::k]
+        return loss
+
+
+# trainer class
+
+CHANNELS_TO_MODE = {
+    1: 'L',
+    3: 'RGB',
+    4: 'RGBA'
+}
+
+
+def seek_all_images(img, channels=3):
+    assert channels in CHANNELS_TO_MODE, f'channels {channels} invalid'
+    mode = CHANNELS_TO_MODE[channels]
+
+    i = 0
+    while True:
+        try:
+            img.seek(i)
+            yield img.convert(mode)
+        except EOFError:
+            break
+        i += 1
+
+
+# tensor of shape (channels, frames, height, width) -> gif
+
+def video_tensor_to_gif(tensor, path, duration=120, loop=0, optimize=True):
+    images = map(T.ToPILImage(), tensor.unbind(dim=1))
+    first_img, *rest_imgs = images
+    first_img.save(path, save_all=True, append_images=rest_imgs, duration=duration, loop=loop, optimize=optimize)
+    return images
+
+
+# gif -> (channels, frame, height, width) tensor
+
+def gif_to_tensor(path, channels=3, transform=T.ToTensor()):
+    img = Image.open(path)
+    tensors = tuple(map(transform, seek_all_images(img, channels=channels)))
+    return torch.stack(tensors, dim=1)
+
+
+def identity(t, *args, **kwargs):
+    return t
+
+
+def normalize_img(t):
+    return t * 2 - 1
+
+
+# def unnormalize_img(t):
+#     return (t + 1) * 0.5
+
+
+def cast_num_frames(t, *, frames):
+    f = t.shape[1]
+
+    if f == frames:
+        return t
+
+    if f > frames:
+        return t[:, :frames]
+
+    return F.pad(t, (0, 0, 0, 0, 0, frames - f))
+
+
+if __name__ == "__main__":
+    # denoiser step latency with classifier-free guidance, two sequential passes vs one batched pass
+    import timeit
+    bs = 2
+    num_frames = 40
+    img_size = 32
+    unet = Unet3D(dim=64, channels=3 + 256, out_grid_dim=2, out_conf_dim=1, dim_mults=(1, 2, 4, 8),
+                  use_bert_text_cond=True, learn_null_cond=False, use_final_activation=False).cuda().eval()
+    x = torch.randn((bs, 3 + 256, num_frames, img_size, img_size)).cuda()
+    t = torch.randint(0, 1000, (bs,)).cuda()
+    cond = torch.randn((bs, BERT_MODEL_DIM)).cuda()
+    with torch.no_grad():
+        for cond_scale in (1., 2., 4.):
+            for batched_cfg in (False, True):
+                for _ in range(3):
+                    unet.forward_with_cond_scale(x, t, cond=cond, cond_scale=cond_scale, batched_cfg=batched_cfg)
+                torch.cuda.synchronize()
+                start = timeit.default_timer()
+                for _ in range(10):
+                    out = unet.forward_with_cond_scale(x, t, cond=cond, cond_scale=cond_scale,
+                                                       batched_cfg=batched_cfg)
+                torch.cuda.synchronize()
+                print("cond_scale %.1f, batched %d: %.1f ms/step"
+                      % (cond_scale, batched_cfg, (timeit.default_timer() - start) * 100))
+        ref = unet.forward_with_cond_scale(x, t, cond=cond, cond_scale=2., batched_cfg=False)
+        out = unet.forward_with_cond_scale(x, t, cond=cond, cond_scale=2., batched_cfg=True)
+        print("max abs diff:", (ref - out).abs().max().item())
+
+        # reference feature repeated over frames and concatenated vs. the frame-invariant branch
+        flow, fea = x[:, :3], x[:, 3:, 0]
+        for use_fea_emb in (False, True):
+            torch.cuda.reset_peak_memory_stats()
+            torch.cuda.synchronize()
+            start = timeit.default_timer()
+            for _ in range(10):
+                if use_fea_emb:
+                    out = unet(flow, t, cond=cond, fea_emb=unet.encode_fea(fea))
+                else:
+                    out = unet(torch.cat([flow, fea.unsqueeze(dim=2).repeat(1, 1, num_frames, 1, 1)], dim=1),
+                               t, cond=cond)
+            torch.cuda.synchronize()
+            print("fea branch %d: %.1f ms/step, peak memory %.0f MB"
+                  % (use_fea_emb, (timeit.default_timer() - start) * 100, torch.cuda.max_memory_allocated() / 2 ** 20))
+        ref = unet(torch.cat([flow, fea.unsqueeze(dim=2).repeat(1, 1, num_frames, 1, 1)], dim=1), t, cond=cond)
+        out = unet(flow, t, cond=cond, fea_emb=unet.encode_fea(fea))
+        print("max abs diff:", (ref - out).abs().max().item())
+
+        # attention backends, peak memory and latency of one denoiser step
+        ref = None
+        for backend in ("math", "chunked", "sdpa"):
+            set_attention_backend(backend, chunk_size=256)
+            torch.cuda.reset_peak_memory_stats()
+            torch.cuda.synchronize()
+            start = timeit.default_timer()
+            for _ in range(10):
+                out = unet(flow, t, cond=cond, fea_emb=unet.encode_fea(fea))
+            torch.cuda.synchronize()
+            print("attention %s: %.1f ms/step, peak memory %.0f MB"
+                  % (backend, (timeit.default_timer() - start) * 100, torch.cuda.max_memory_allocated() / 2 ** 20))
+            ref = out if ref is None else ref
+            print("max abs diff:", (ref - out).abs().max().item())
+        set_attention_backend("auto")
@@ -1,273 +1,494 @@
-import os
-import torch
-import torch.nn as nn
-import torch.nn.functional as F
-from LFAE.modules.generator import Generator
-from LFAE.modules.bg_motion_predictor import BGMotionPredictor
-from LFAE.modules.region_predictor import RegionPredictor
-from DM.modules.vfd import Unet3D, GaussianDiffusion
-import yaml
-
-
-class FlowDiffusion(nn.Module):
-    def __init__(self, img_size=32, num_frames=40, sampling_timesteps=250,
-                 null_cond_prob=0.1, ddim_sampling_eta=1., timesteps=1000,
-                 dim_mults=(1, 2, 4, 8),
-                 lr=1e-4, adam_betas=(0.9, 0.99), is_train=True,
-                 only_use_flow=True,
-                 use_residual_flow=False,
-                 learn_null_cond=False,
-                 use_deconv=True,
-                 padding_mode="zeros",
-                 pretrained_pth="",
-                 config_pth=""):
-        super(FlowDiffusion, self).__init__()
-        self.use_residual_flow = use_residual_flow
-        self.only_use_flow = only_use_flow
-
-        if pretrained_pth != "":
-            checkpoint = torch.load(pretrained_pth)
-        with open(config_pth) as f:
-            config = yaml.safe_load(f)
-
-        self.generator = Generator(num_regions=config['model_params']['num_regions'],
-                                   num_channels=config['model_params']['num_channels'],
-                                   revert_axis_swap=config['model_params']['revert_axis_swap'],
-                                   **config['model_params']['generator_params']).cuda()
-        if pretrained_pth != "":
-            self.generator.load_state_dict(checkpoint['generator'])
-            self.generator.eval()
-            self.set_requires_grad(self.generator, False)
-
-        self.region_predictor = RegionPredictor(num_regions=config['model_params']['num_regions'],
-                                                num_channels=config['model_params']['num_channels'],
-                                                estimate_affine=config['model_params']['estimate_affine'],
-                                                **config['model_params']['region_predictor_params']).cuda()
-        if pretrained_pth != "":
-            self.region_predictor.load_state_dict(checkpoint['region_predictor'])
-            self.region_predictor.eval()
-            self.set_requires_grad(self.region_predictor, False)
-
-        self.bg_predictor = BGMotionPredictor(num_channels=config['model_params']['num_channels'],
-                                              **config['model_params']['bg_predictor_params'])
-        if pretrained_pth != "":
-            self.bg_predictor.load_state_dict(checkpoint['bg_predictor'])
-            self.bg_predictor.eval()
-            self.set_requires_grad(self.bg_predictor, False)
-
-        self.unet = Unet3D(dim=64,
-                           channels=3 + 256,
-                           out_grid_dim=2,
-                           out_conf_dim=1,
-                           dim_mults=dim_mults,
-                           use_bert_text_cond=True,
-                           learn_null_cond=learn_null_cond,
-                           use_final_activation=False,
-                           use_deconv=use_deconv,
-                           padding_mode=padding_mode)
-
-        self.diffusion = GaussianDiffusion(
-            self.unet,
-            image_size=img_size,
-            num_frames=num_frames,
-            sampling_timesteps=sampling_timesteps,
-            timesteps=timesteps,  # number of steps
-            loss_type='l2',  # L1 or L2
-            use_dynamic_thres=True,
-            null_cond_prob=null_cond_prob,
-            ddim_sampling_eta=ddim_sampling_eta,
-        )
-
-        self.ref_img = None
-        self.ref_img_fea = None
-        self.real_vid = None
-        self.real_out_vid = None
-        self.real_warped_vid = None
-        self.real_vid_grid = None
-        self.real_vid_conf = None
-
-        self.fake_out_vid = None
-        self.fake_warped_vid = None
-        self.fake_vid_grid = None
-        self.fake_vid_conf = None
-
-        self.sample_out_vid = None
-        self.sample_warped_vid = None
-        self.sample_vid_grid = None
-        self.sample_vid_conf = None
-
-        # training
-        self.is_train = is_train
-        if self.is_train:
-            self.unet.train()
-            self.diffusion.train()
-            self.lr = lr
-            self.loss = torch.tensor(0.0).cuda()
-            self.rec_loss = torch.tensor(0.0).cuda()
-            self.rec_warp_loss = torch.tensor(0.0).cuda()
-            self.optimizer_diff = torch.optim.Adam(self.diffusion.parameters(),
-                                                   lr=lr, betas=adam_betas)
-
-    def forward(self):
-        # compute pseudo ground-truth flow
-        b, _, nf, H, W = self.real_vid.size()
-
-        real_grid_list = []
-        real_conf_list = []
-        real_out_img_list = []
-        real_warped_img_list = []
-        with torch.no_grad():
-            source_region_params = self.region_predictor(self.ref_img)
-            for idx in range(nf):
-                driving_region_params = self.region_predictor(self.real_vid[:, :, idx, :, :])
-                bg_params = self.bg_predictor(self.ref_img, self.real_vid[:, :, idx, :, :])
-                generated = self.generator(self.ref_img, source_region_params=source_region_params,
-                                           driving_region_params=driving_region_params, bg_params=bg_params)
-                generated.update({'source_region_params': source_region_params,
-                                  'driving_region_params': driving_region_params})
-                real_grid_list.append(generated["optical_flow"].permute(0, 3, 1, 2))
-                # normalized occlusion map
-                real_conf_list.append(generated["occlusion_map"])
-                real_out_img_list.append(generated["prediction"])
-                real_warped_img_list.append(generated["deformed"])
-        self.real_vid_grid = torch.stack(real_grid_list, dim=2)
-        self.real_vid_conf = torch.stack(real_conf_list, dim=2)
-        self.real_out_vid = torch.stack(real_out_img_list, dim=2)
-        self.real_warped_vid = torch.stack(real_warped_img_list, dim=2)
-        # reference images are the same for different time steps, just pick the final one
-        self.ref_img_fea = generated["bottle_neck_feat"].clone().detach()
-
-        if self.is_train:
-            if self.use_residual_flow:
-                h, w, = H//4, W//4
-                identity_grid = self.get_grid(b, nf, h, w, normalize=True).cuda()
-                self.loss = self.diffusion(torch.cat((self.real_vid_grid - identity_grid,
-                                                      self.real_vid_conf*2-1), dim=1),
-                                           self.ref_img_fea,
-                                           self.ref_text)
-            else:
-                self.loss = self.diffusion(torch.cat((self.real_vid_grid,
-                                                      self.real_vid_conf*2-1), dim=1),
-                                           self.ref_img_fea,
-                                           self.ref_text)
-            with torch.no_grad():
-                fake_out_img_list = []
-                fake_warped_img_list = []
-                pred = self.diffusion.pred_x0
-                if self.use_residual_flow:
-                    self.fake_vid_grid = pred[:, :2, :, :, :] + identity_grid
-                else:
-                    self.fake_vid_grid = pred[:, :2, :, :, :]
-                self.fake_vid_conf = (pred[:, 2, :, :, :].unsqueeze(dim=1) + 1) * 0.5
-                for idx in range(nf):
-                    fake_grid = self.fake_vid_grid[:, :, idx, :, :].permute(0, 2, 3, 1)
-                    fake_conf = self.fake_vid_conf[:, :, idx, :, :]
-                    # predict fake out image and fake warped image
-                    generated = self.generator.forward_with_flow(source_image=self.ref_img,
-                                                                 optical_flow=fake_grid,
-                                                                 occlusion_map=fake_conf)
-                    fake_out_img_list.append(generated["prediction"])
-                    fake_warped_img_list.append(generated["deformed"])
-                self.fake_out_vid = torch.stack(fake_out_img_list, dim=2)
-                self.fake_warped_vid = torch.stack(fake_warped_img_list, dim=2)
-                self.rec_loss = nn.L1Loss()(self.real_vid, self.fake_out_vid)
-                self.rec_warp_loss = nn.L1Loss()(self.real_vid, self.fake_warped_vid)
-
-    def optimize_parameters(self):
-        self.forward()
-        self.optimizer_diff.zero_grad()
-        if self.only_use_flow:
-            self.loss.backward()
-        else:
-            (self.loss + self.rec_loss + self.rec_warp_loss).backward()
-        self.optimizer_diff.step()
-
-    def sample_one_video(self, cond_scale):
-        self.sample_img_fea = self.generator.compute_fea(self.sample_img)
-        # if cond_scale = 1.0, not using unconditional model
-        pred = self.diffusion.sample(self.sample_img_fea, cond=self.sample_text,
-                                     batch_size=1, cond_scale=cond_scale)
-        if self.use_residual_flow:
-            b, _, nf, h, w = pred[:, :2, :, :, :].size()
-            identity_grid = self.get_grid(b, nf, h, w, normalize=True).cuda()
-            self.sample_vid_grid = pred[:, :2, :, :, :] + identity_grid
-        else:
-            self.sample_vid_grid = pred[:, :2, :, :, :]
-        self.sample_vid_conf = (pred[:, 2, :, :, :].unsqueeze(dim=1) + 1) * 0.5
-        nf = self.sample_vid_grid.size(2)
-        with torch.no_grad():
-            sample_out_img_list = []
-            sample_warped_img_list = []
-            for idx in range(nf):
-                sample_grid = self.sample_vid_grid[:, :, idx, :, :].permute(0, 2, 3, 1)
-                sample_conf = self.sample_vid_conf[:, :, idx, :, :]
-                # predict fake out image and fake warped image
-                generated = self.generator.forward_with_flow(source_image=self.sample_img,
-                                                             optical_flow=sample_grid,
-                                                             occlusion_map=sample_conf)
-                sample_out_img_list.append(generated["prediction"])
-                sample_warped_img_list.append(generated["deformed"])
-        self.sample_out_vid = torch.stack(sample_out_img_list, dim=2)
-        self.sample_warped_vid = torch.stack(sample_warped_img_list, dim=2)
-
-    def set_train_input(self, ref_img, real_vid, ref_text):
-        self.ref_img = ref_img.cuda()
-        self.real_vid = real_vid.cuda()
-        self.ref_text = ref_text
-
-    def set_sample_input(self, sample_img, sample_text):
-        self.sample_img = sample_img.cuda()
-        self.sample_text = sample_text
-
-    def print_learning_rate(self):
-        lr = self.optimizer_diff.param_groups[0]['lr']
-        assert lr > 0
-        print('lr= %.7f' % lr)
-
-    def get_grid(self, b, nf, H, W, normalize=True):
-        if normalize:
-            h_range = torch.linspace(-1, 1, H)
-            w_range = torch.linspace(-1, 1, W)
-        else:
-            h_range = torch.arange(0, H)
-            w_range = torch.arange(0, W)
-        grid = torch.stack(torch.meshgrid([h_range, w_range]), -1).repeat(b, 1, 1, 1).flip(3).float()  # flip h,w to x,y
-        return grid.permute(0, 3, 1, 2).unsqueeze(dim=2).repeat(1, 1, nf, 1, 1)
-
-    def set_requires_grad(self, nets, requires_grad=False):
-        """Set requies_grad=Fasle for all the networks to avoid unnecessary computations
-        Parameters:
-            nets (network list)   -- a list of networks
-            requires_grad (bool)  -- whether the networks require gradients or not
-        """
-        if not isinstance(nets, list):
-            nets = [nets]
-        for net in nets:
-            if net is not None:
-                for param in net.parameters():
-                    param.requires_grad = requires_grad
-
-
-if __name__ == "__main__":
-    os.environ["CUDA_VISIBLE_DEVICES"] = "2"
-    bs = 5
-    img_size = 64
-    num_frames = 40
-    ref_text = ["play basketball"] * bs
-    ref_img = torch.rand((bs, 3, img_size, img_size), dtype=torch.float32)
-    real_vid = torch.rand((bs, 3, num_frames, img_size, img_size), dtype=torch.float32)
-    model = FlowDiffusion(use_residual_flow=False,
-                          sampling_timesteps=10,
-                          img_size=16,
-                          config_pth="/workspace/code/CVPR23_LFDM/config/mug128.yaml",
-                          pretrained_pth="")
-    model.cuda()
-    # model.train()
-    # model.set_train_input(ref_img=ref_img, real_vid=real_vid, ref_text=ref_text)
-    # model.optimize_parameters()
-    model.eval()
-    model.set_sample_input(sample_img=ref_img, sample_text=ref_text)
-    model.sample_one_video(cond_scale=1.0)
-
-
-
+import copy
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from LFAE.modules.generator import Generator
+from LFAE.modules.bg_motion_predictor import BGMotionPredictor
+from LFAE.modules.region_predictor import RegionPredictor
+from LFAE.modules.util import cached_identity_grid, autocast, PRECISION_DTYPES
+from DM.modules.vfd import Unet3D, GaussianDiffusion, EMA, BERT_MODEL_DIM
+import yaml
+
+
+def fold_frames(vid):
+    """
+    (b, c, nf, h, w) -> (b*nf, c, h, w), the frames of one video stay contiguous in the batch
+    """
+    b, c, nf, h, w = vid.size()
+    return vid.permute(0, 2, 1, 3, 4).reshape(b * nf, c, h, w)
+
+
+def unfold_frames(x, b):
+    """
+    (b*nf, c, ...) -> (b, c, nf, ...), inverse of fold_frames
+    """
+    x = x.view(b, -1, *x.shape[1:])
+    return x.transpose(1, 2).contiguous()
+
+
+def repeat_region_params(region_params, repeats):
+    return {key: value.repeat_interleave(repeats, dim=0) for key, value in region_params.items()}
+
+
+@torch.no_grad()
+def extract_pseudo_gt_flow(region_predictor, bg_predictor, generator, ref_img, real_vid, frame_chunk_size=None,
+                           dtype=None):
+    """
+    Run the frozen LFAE on every frame of real_vid w.r.t. ref_img.
+    Frames are folded into the batch dimension and processed frame_chunk_size frames at a time
+    (the whole clip if None) to cap peak memory. frame_chunk_size=1 is the original per-frame loop.
+    dtype (torch.float16 / torch.bfloat16) runs the LFAE under autocast, the outputs are float32 either way.
+    """
+    b, _, nf, H, W = real_vid.size()
+    chunk = nf if frame_chunk_size is None else max(1, min(int(frame_chunk_size), nf))
+
+    grid_list = []
+    conf_list = []
+    out_img_list = []
+    warped_img_list = []
+    with autocast(ref_img.device, dtype):
+        source_region_params = region_predictor(ref_img)
+        # the reference image is encoded once and shared by all frames
+        source_enc = generator.encode_source(ref_img)
+        for start in range(0, nf, chunk):
+            n = min(chunk, nf - start)
+            driving_img = fold_frames(real_vid[:, :, start:start + n, :, :])
+            source_img = ref_img.repeat_interleave(n, dim=0)
+            driving_region_params = region_predictor(driving_img)
+            bg_params = bg_predictor(source_img, driving_img)
+            generated = generator(source_img, source_region_params=repeat_region_params(source_region_params, n),
+                                  driving_region_params=driving_region_params, bg_params=bg_params,
+                                  source_enc=source_enc)
+            grid_list.append(unfold_frames(generated["optical_flow"].float().permute(0, 3, 1, 2), b))
+            # normalized occlusion map
+            conf_list.append(unfold_frames(generated["occlusion_map"].float(), b))
+            out_img_list.append(unfold_frames(generated["prediction"].float(), b))
+            warped_img_list.append(unfold_frames(generated["deformed"].float(), b))
+
+    output_dict = {}
+    output_dict["real_vid_grid"] = torch.cat(grid_list, dim=2)
+    output_dict["real_vid_conf"] = torch.cat(conf_list, dim=2)
+    output_dict["real_out_vid"] = torch.cat(out_img_list, dim=2)
+    output_dict["real_warped_vid"] = torch.cat(warped_img_list, dim=2)
+    output_dict["ref_img_fea"] = source_enc["skips"][-1].float().clone()
+    return output_dict
+
+
+def decode_flow_vid(generator, source_enc, vid_grid, vid_conf, frame_chunk_size=None, dtype=None):
+    """
+    Warp the encoded source (generator.encode_source) with a flow video vid_grid (b, 2, nf, h, w)
+    and occlusion video vid_conf (b, 1, nf, h, w), frame_chunk_size frames at a time (all if None),
+    under autocast if dtype is given. Returns the float32 output and warped video, both (b, c, nf, H, W).
+    """
+    b, _, nf, _, _ = vid_grid.size()
+    chunk = nf if frame_chunk_size is None else max(1, min(int(frame_chunk_size), nf))
+    out_img_list = []
+    warped_img_list = []
+    for start in range(0, nf, chunk):
+        n = min(chunk, nf - start)
+        grid = fold_frames(vid_grid[:, :, start:start + n]).permute(0, 2, 3, 1)
+        conf = fold_frames(vid_conf[:, :, start:start + n])
+        with autocast(grid.device, dtype):
+            generated = generator.decode_with_flow(source_enc, optical_flow=grid, occlusion_map=conf)
+        out_img_list.append(unfold_frames(generated["prediction"].float(), b))
+        warped_img_list.append(unfold_frames(generated["deformed"].float(), b))
+    return torch.cat(out_img_list, dim=2), torch.cat(warped_img_list, dim=2)
+
+
+class FlowDiffusionMixin(object):
+    """
+    Plumbing around self.diffusion shared by FlowDiffusion and FlowDiffusionGenTron: the optimizer and its loss
+    scaler, the DistributedDataParallel wrapper, the averaged copy sampled from, the checkpoint content and the
+    device of the inputs.
+    init_diffusion_training is called once self.diffusion exists.
+    """
+
+    def init_diffusion_training(self, is_train, lr, adam_betas, precision, ema_decay, ema_update_every,
+                                ema_update_after_step):
+        # DistributedDataParallel wrapper of self.diffusion, set by DM.modules.distributed.distribute_diffusion
+        self.diffusion_ddp = None
+        # averaged copy of self.diffusion, set by set_ema
+        self.ema = None
+        self.ema_diffusion = None
+        if is_train:
+            self.optimizer_diff = torch.optim.Adam(self.diffusion.parameters(), lr=lr, betas=adam_betas)
+            # loss scaling is only needed for fp16
+            self.scaler = torch.cuda.amp.GradScaler(enabled=precision == "fp16")
+            if ema_decay:
+                self.set_ema(ema_decay, ema_update_every, ema_update_after_step)
+
+    def set_ema(self, decay, update_every=10, update_after_step=0):
+        # exponential moving average of the diffusion weights in a frozen copy of it, updated after every
+        # optimizer step and sampled from, see DM.modules.vfd.EMA
+        self.ema = EMA(decay, update_every=update_every, update_after_step=update_after_step)
+        self.ema_diffusion = copy.deepcopy(self.diffusion).eval().requires_grad_(False)
+
+    def diffusion_loss(self, x, fea, text):
+        # through the DistributedDataParallel wrapper when there is one, it all-reduces the gradients in backward
+        diffusion = self.diffusion if self.diffusion_ddp is None else self.diffusion_ddp
+        return diffusion(x, fea, text)
+
+    def step_diffusion(self, loss):
+        self.optimizer_diff.zero_grad()
+        self.scaler.scale(loss).backward()
+        self.scaler.step(self.optimizer_diff)
+        self.scaler.update()
+        if self.ema is not None:
+            self.ema.update(self.ema_diffusion, self.diffusion)
+
+    def sampling_diffusion(self, use_ema=True):
+        # the averaged weights are a separate module, the trained ones are left untouched
+        return self.ema_diffusion if use_ema and self.ema_diffusion is not None else self.diffusion
+
+    def set_cached_train_input(self, real_vid_flow, ref_img_fea, ref_text):
+        # pseudo ground-truth flow precomputed by DM/precompute_flow_mhad.py (MHAD_flow), no LFAE pass needed
+        real_vid_flow = real_vid_flow.to(self.device)
+        self.ref_img = None
+        self.real_vid = None
+        self.real_vid_grid = real_vid_flow[:, :2]
+        self.real_vid_conf = (real_vid_flow[:, 2:3] + 1) * 0.5
+        self.ref_img_fea = ref_img_fea.to(self.device)
+        self.ref_text = ref_text
+
+    def checkpoint_dict(self, example, optimizer_state=None):
+        """
+        Training state saved by the trainers, example is the number of training clips seen so far.
+        optimizer_state replaces self.optimizer_diff.state_dict(), e.g. the full state of a sharded optimizer
+        gathered by DM.modules.distributed.optimizer_state_dict.
+        """
+        if optimizer_state is None:
+            optimizer_state = self.optimizer_diff.state_dict()
+        checkpoint = {'example': example,
+                      'diffusion': self.diffusion.state_dict(),
+                      'optimizer_diff': optimizer_state,
+                      'scaler': self.scaler.state_dict()}
+        if self.ema is not None:
+            # averaged weights, loaded in place of 'diffusion' for sampling by DM/test_vfd_mhad.py
+            checkpoint['ema'] = self.ema_diffusion.state_dict()
+            checkpoint['ema_steps'] = self.ema.num_steps
+        return checkpoint
+
+    def load_training_state(self, checkpoint):
+        """
+        Resume from a checkpoint_dict: the trained and averaged weights, the optimizer and the loss scaler.
+        Called after DM.modules.distributed.distribute_diffusion when there is one, every process then loads the
+        full optimizer state and keeps its own shard.
+        """
+        self.diffusion.load_state_dict(checkpoint['diffusion'])
+        self.load_ema(checkpoint)
+        if 'optimizer_diff' in checkpoint:
+            self.optimizer_diff.load_state_dict(checkpoint['optimizer_diff'])
+        # empty when saved without fp16, an enabled scaler refuses it
+        if checkpoint.get('scaler'):
+            self.scaler.load_state_dict(checkpoint['scaler'])
+
+    def load_ema(self, checkpoint):
+        if self.ema is None:
+            return
+        if 'ema' in checkpoint:
+            self.ema_diffusion.load_state_dict(checkpoint['ema'])
+            self.ema.num_steps = checkpoint['ema_steps']
+        else:
+            # no average saved yet, it starts from the restored weights
+            self.ema_diffusion.load_state_dict(self.diffusion.state_dict())
+
+    @property
+    def device(self):
+        # device of the diffusion model, the inputs are moved there
+        return self.diffusion.betas.device
+
+    def get_grid(self, b, nf, H, W, normalize=True):
+        # cached identity grid as a (b, 2, nf, H, W) view, x before y
+        return cached_identity_grid(b, nf, (H, W), device=self.device, normalized=normalize)
+
+
+class FlowDiffusion(FlowDiffusionMixin, nn.Module):
+    def __init__(self, img_size=32, num_frames=40, sampling_timesteps=250,
+                 null_cond_prob=0.1, ddim_sampling_eta=1., timesteps=1000,
+                 dim_mults=(1, 2, 4, 8),
+                 lr=1e-4, adam_betas=(0.9, 0.99), is_train=True,
+                 only_use_flow=True,
+                 use_residual_flow=False,
+                 learn_null_cond=False,
+                 use_deconv=True,
+                 padding_mode="zeros",
+                 pretrained_pth="",
+                 config_pth="",
+                 frame_chunk_size=None,
+                 sampler=None,
+                 timestep_spacing=None,
+                 precision="fp32",
+                 checkpoint_stages=(),
+                 timesteps_per_clip=1,
+                 ema_decay=None,
+                 ema_update_every=10,
+                 ema_update_after_step=0):
+        super(FlowDiffusion, self).__init__()
+        self.use_residual_flow = use_residual_flow
+        self.only_use_flow = only_use_flow
+        # number of frames sent through the frozen LFAE at once, None for the whole clip
+        self.frame_chunk_size = frame_chunk_size
+        # "fp32", "fp16" or "bf16", the LFAE and the denoiser run under autocast with the latter two
+        self.autocast_dtype = PRECISION_DTYPES[precision]
+
+        if pretrained_pth != "":
+            checkpoint = torch.load(pretrained_pth, map_location="cpu")
+        with open(config_pth) as f:
+            config = yaml.safe_load(f)
+
+        self.generator = Generator(num_regions=config['model_params']['num_regions'],
+                                   num_channels=config['model_params']['num_channels'],
+                                   revert_axis_swap=config['model_params']['revert_axis_swap'],
+                                   **config['model_params']['generator_params'])
+        if pretrained_pth != "":
+            self.generator.load_state_dict(checkpoint['generator'])
+            self.generator.eval()
+            self.set_requires_grad(self.generator, False)
+
+        self.region_predictor = RegionPredictor(num_regions=config['model_params']['num_regions'],
+                                                num_channels=config['model_params']['num_channels'],
+                                                estimate_affine=config['model_params']['estimate_affine'],
+                                                **config['model_params']['region_predictor_params'])
+        if pretrained_pth != "":
+            self.region_predictor.load_state_dict(checkpoint['region_predictor'])
+            self.region_predictor.eval()
+            self.set_requires_grad(self.region_predictor, False)
+
+        self.bg_predictor = BGMotionPredictor(num_channels=config['model_params']['num_channels'],
+                                              **config['model_params']['bg_predictor_params'])
+        if pretrained_pth != "":
+            self.bg_predictor.load_state_dict(checkpoint['bg_predictor'])
+            self.bg_predictor.eval()
+            self.set_requires_grad(self.bg_predictor, False)
+
+        self.unet = Unet3D(dim=64,
+                           channels=3 + 256,
+                           out_grid_dim=2,
+                           out_conf_dim=1,
+                           dim_mults=dim_mults,
+                           use_bert_text_cond=True,
+                           learn_null_cond=learn_null_cond,
+                           use_final_activation=False,
+                           use_deconv=use_deconv,
+                           padding_mode=padding_mode,
+                           checkpoint_stages=checkpoint_stages)
+
+        self.diffusion = GaussianDiffusion(
+            self.unet,
+            image_size=img_size,
+            num_frames=num_frames,
+            sampling_timesteps=sampling_timesteps,
+            timesteps=timesteps,  # number of steps
+            loss_type='l2',  # L1 or L2
+            use_dynamic_thres=True,
+            null_cond_prob=null_cond_prob,
+            ddim_sampling_eta=ddim_sampling_eta,
+            sampler=sampler,
+            timestep_spacing=timestep_spacing,
+            autocast_dtype=self.autocast_dtype,
+            # diffusion time steps trained per clip, the LFAE flow of a clip is extracted once for all of them
+            timesteps_per_clip=timesteps_per_clip
+        )
+
+        self.ref_img = None
+        self.ref_img_fea = None
+        self.real_vid = None
+        self.real_out_vid = None
+        self.real_warped_vid = None
+        self.real_vid_grid = None
+        self.real_vid_conf = None
+
+        self.fake_out_vid = None
+        self.fake_warped_vid = None
+        self.fake_vid_grid = None
+        self.fake_vid_conf = None
+
+        self.sample_out_vid = None
+        self.sample_warped_vid = None
+        self.sample_vid_grid = None
+        self.sample_vid_conf = None
+
+        # training
+        self.is_train = is_train
+        if self.is_train:
+            self.unet.train()
+            self.diffusion.train()
+            self.lr = lr
+            self.loss = torch.tensor(0.0)
+            self.rec_loss = torch.tensor(0.0)
+            self.rec_warp_loss = torch.tensor(0.0)
+        self.init_diffusion_training(is_train, lr, adam_betas, precision, ema_decay, ema_update_every,
+                                     ema_update_after_step)
+
+    def forward(self):
+        # compute pseudo ground-truth flow, already loaded by set_cached_train_input if real_vid is None
+        if self.real_vid is not None:
+            real_dict = extract_pseudo_gt_flow(self.region_predictor, self.bg_predictor, self.generator,
+                                               self.ref_img, self.real_vid, frame_chunk_size=self.frame_chunk_size,
+                                               dtype=self.autocast_dtype)
+            self.real_vid_grid = real_dict["real_vid_grid"]
+            self.real_vid_conf = real_dict["real_vid_conf"]
+            self.real_out_vid = real_dict["real_out_vid"]
+            self.real_warped_vid = real_dict["real_warped_vid"]
+            self.ref_img_fea = real_dict["ref_img_fea"].detach()
+        b, _, nf, h, w = self.real_vid_grid.size()
+
+        if self.is_train:
+            if self.use_residual_flow:
+                identity_grid = self.get_grid(b, nf, h, w, normalize=True)
+                self.loss = self.diffusion_loss(torch.cat((self.real_vid_grid - identity_grid,
+                                                           self.real_vid_conf*2-1), dim=1),
+                                                self.ref_img_fea,
+                                                self.ref_text)
+            else:
+                self.loss = self.diffusion_loss(torch.cat((self.real_vid_grid,
+                                                           self.real_vid_conf*2-1), dim=1),
+                                                self.ref_img_fea,
+                                                self.ref_text)
+            with torch.no_grad():
+                pred = self.diffusion.pred_x0
+                if self.use_residual_flow:
+                    self.fake_vid_grid = pred[:, :2, :, :, :] + identity_grid
+                else:
+                    self.fake_vid_grid = pred[:, :2, :, :, :]
+                self.fake_vid_conf = (pred[:, 2, :, :, :].unsqueeze(dim=1) + 1) * 0.5
+                if self.real_vid is None:
+                    # no frames with cached flow, skip the reconstruction losses
+                    return
+                # predict fake out video and fake warped video
+                self.fake_out_vid, self.fake_warped_vid = decode_flow_vid(self.generator,
+                                                                          self.generator.encode_source(self.ref_img),
+                                                                          self.fake_vid_grid, self.fake_vid_conf,
+                                                                          frame_chunk_size=self.frame_chunk_size,
+                                                                          dtype=self.autocast_dtype)
+                self.rec_loss = nn.L1Loss()(self.real_vid, self.fake_out_vid)
+                self.rec_warp_loss = nn.L1Loss()(self.real_vid, self.fake_warped_vid)
+
+    def optimize_parameters(self):
+        self.forward()
+        if self.only_use_flow:
+            self.step_diffusion(self.loss)
+        else:
+            self.step_diffusion(self.loss + self.rec_loss + self.rec_warp_loss)
+
+    def sample_one_video(self, cond_scale, use_ema=True):
+        with torch.no_grad(), autocast(self.sample_img.device, self.autocast_dtype):
+            sample_enc = self.generator.encode_source(self.sample_img)
+        self.sample_img_fea = sample_enc["skips"][-1]
+        diffusion = self.sampling_diffusion(use_ema)
+        # if cond_scale = 1.0, not using unconditional model
+        pred = diffusion.sample(self.sample_img_fea, cond=self.sample_text,
+                                batch_size=1, cond_scale=cond_scale)
+        if self.use_residual_flow:
+            b, _, nf, h, w = pred[:, :2, :, :, :].size()
+            identity_grid = self.get_grid(b, nf, h, w, normalize=True)
+            self.sample_vid_grid = pred[:, :2, :, :, :] + identity_grid
+        else:
+            self.sample_vid_grid = pred[:, :2, :, :, :]
+        self.sample_vid_conf = (pred[:, 2, :, :, :].unsqueeze(dim=1) + 1) * 0.5
+        with torch.no_grad():
+            # predict sample out video and sample warped video
+            self.sample_out_vid, self.sample_warped_vid = decode_flow_vid(self.generator, sample_enc,
+                                                                          self.sample_vid_grid, self.sample_vid_conf,
+                                                                          frame_chunk_size=self.frame_chunk_size,
+                                                                          dtype=self.autocast_dtype)
+
+    def set_train_input(self, ref_img, real_vid, ref_text):
+        self.ref_img = ref_img.to(self.device)
+        self.real_vid = real_vid.to(self.device)
+        self.ref_text = ref_text
+
+    def set_sample_input(self, sample_img, sample_text):
+        self.sample_img = sample_img.to(self.device)
+        self.sample_text = sample_text
+
+    def print_learning_rate(self):
+        lr = self.optimizer_diff.param_groups[0]['lr']
+        assert lr > 0
+        print('lr= %.7f' % lr)
+
+    def set_requires_grad(self, nets, requires_grad=False):
+        """Set requies_grad=Fasle for all the networks to avoid unnecessary computations
+        Parameters:
+            nets (network list)   -- a list of networks
+            requires_grad (bool)  -- whether the networks require gradients or not
+        """
+        if not isinstance(nets, list):
+            nets = [nets]
+        for net in nets:
+            if net is not None:
+                for param in net.parameters():
+                    param.requires_grad = requires_grad
+
+
+if __name__ == "__main__":
+    # the frame-folded and chunked extraction must match the per-frame loop it replaces,
+    # on the cpu with random LFAE weights
+    torch.manual_seed(0)
+    bs = 2
+    img_size = 128
+    num_frames = 5
+    model = FlowDiffusion(img_size=img_size // 4, num_frames=num_frames, config_pth="config/mhad128.yaml",
+                          is_train=False)
+    model.eval()
+    ref_img = torch.rand((bs, 3, img_size, img_size), dtype=torch.float32)
+    real_vid = torch.rand((bs, 3, num_frames, img_size, img_size), dtype=torch.float32)
+    with torch.no_grad():
+        loop_dict = {"real_vid_grid": [], "real_vid_conf": [], "real_out_vid": [], "real_warped_vid": []}
+        source_region_params = model.region_predictor(ref_img)
+        for idx in range(num_frames):
+            driving_region_params = model.region_predictor(real_vid[:, :, idx, :, :])
+            bg_params = model.bg_predictor(ref_img, real_vid[:, :, idx, :, :])
+            generated = model.generator(ref_img, source_region_params=source_region_params,
+                                        driving_region_params=driving_region_params, bg_params=bg_params)
+            loop_dict["real_vid_grid"].append(generated["optical_flow"].permute(0, 3, 1, 2))
+            loop_dict["real_vid_conf"].append(generated["occlusion_map"])
+            loop_dict["real_out_vid"].append(generated["prediction"])
+            loop_dict["real_warped_vid"].append(generated["deformed"])
+        loop_dict = {key: torch.stack(value, dim=2) for key, value in loop_dict.items()}
+        loop_dict["ref_img_fea"] = generated["bottle_neck_feat"]
+        # whole clip at once, uneven chunks and one frame at a time
+        for frame_chunk_size in (None, 2, 1):
+            out_dict = extract_pseudo_gt_flow(model.region_predictor, model.bg_predictor, model.generator,
+                                              ref_img, real_vid, frame_chunk_size=frame_chunk_size)
+            assert out_dict.keys() == loop_dict.keys()
+            for key in loop_dict.keys():
+                assert out_dict[key].shape == loop_dict[key].shape, key
+                diff = (out_dict[key] - loop_dict[key]).abs().max().item()
+                assert diff < 1e-4, "%s with frame_chunk_size %s: %.2e" % (key, frame_chunk_size, diff)
+    print("extract_pseudo_gt_flow matches the per-frame loop")
+
+    # bf16 autocast against fp32 with the same weights, the LFAE flow extraction and one denoiser step on the
+    # fp32 flow. Errors are relative to the norm of the fp32 output, bf16 keeps 8 bits of mantissa
+    model_bf16 = FlowDiffusion(img_size=img_size // 4, num_frames=num_frames, config_pth="config/mhad128.yaml",
+                               is_train=False, precision="bf16")
+    model_bf16.load_state_dict(model.state_dict())
+    model_bf16.eval()
+    ref_text = torch.randn((bs, BERT_MODEL_DIM), dtype=torch.float32)
+
+    def relative(x, ref):
+        assert x.dtype == torch.float32
+        return ((x - ref).norm() / ref.norm()).item()
+
+    with torch.no_grad():
+        fp32_dict, bf16_dict = [extract_pseudo_gt_flow(m.region_predictor, m.bg_predictor, m.generator, ref_img,
+                                                       real_vid, dtype=m.autocast_dtype)
+                                for m in (model, model_bf16)]
+        # the decoded frames resample uniform noise, a small shift of the flow changes them a lot
+        tolerances = {"real_vid_grid": 2e-2, "real_vid_conf": 2e-2, "ref_img_fea": 2e-2,
+                      "real_out_vid": 0.25, "real_warped_vid": 0.25}
+        for key in fp32_dict.keys():
+            diff = relative(bf16_dict[key], fp32_dict[key])
+            assert diff < tolerances[key], "bf16 %s: %.2e" % (key, diff)
+        x = torch.cat((fp32_dict["real_vid_grid"], fp32_dict["real_vid_conf"] * 2 - 1), dim=1)
+        steps = []
+        for m in (model, model_bf16):
+            # same time steps, noise and null condition draws
+            torch.manual_seed(1)
+            loss = m.diffusion(x, fp32_dict["ref_img_fea"], ref_text)
+            steps.append((loss, m.diffusion.pred_x0))
+        diff = relative(steps[1][0], steps[0][0])
+        assert diff < 2e-2, "bf16 denoiser loss: %.2e" % diff
+        diff = relative(steps[1][1], steps[0][1])
+        assert diff < 2e-2, "bf16 denoiser x0: %.2e" % diff
+    print("bf16 autocast matches fp32")
@@ -0,0 +1,149 @@
+# run the frozen LFAE once over all frames of the MHAD videos and store the pseudo ground-truth flow,
+# occlusion map and reference-image feature as float16 memmaps, read back by MHAD_flow in DM/datasets_mhad.py
+# so that the DM can be trained without any LFAE forward pass
+import argparse
+import os
+import json
+import timeit
+
+import imageio
+import numpy as np
+import torch
+import yaml
+import cv2
+from misc import resize
+from LFAE.modules.generator import Generator
+from LFAE.modules.bg_motion_predictor import BGMotionPredictor
+from LFAE.modules.region_predictor import RegionPredictor
+from DM.modules.vfdm import extract_pseudo_gt_flow
+from DM.datasets_mhad import MHAD
+
+data_dir = "/kaggle/input/mhad-mini/crop_image_mini"
+config_pth = "config/mhad128.yaml"
+# put your pretrained LFAE here
+AE_RESTORE_FROM = "/kaggle/input/checkpoints-mhad-clfdm/RegionMM.pth"
+CACHE_DIR = "log/flow_cache_mhad128"
+INPUT_SIZE = 128
+MEAN = (0.0, 0.0, 0.0)
+FRAME_CHUNK_SIZE = 40
+GPU = "0"
+
+
+def get_arguments():
+    """Parse all the arguments provided from the CLI.
+
+    Returns:
+      A list of parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Precompute LFAE flow for MHAD")
+    parser.add_argument("--data-dir", type=str, default=data_dir)
+    parser.add_argument("--config", type=str, default=config_pth)
+    parser.add_argument("--restore-from", default=AE_RESTORE_FROM)
+    parser.add_argument("--cache-dir", type=str, default=CACHE_DIR,
+                        help="Where to save the flow memmaps and index.json.")
+    parser.add_argument("--input-size", type=int, default=INPUT_SIZE)
+    parser.add_argument("--frame-chunk-size", type=int, default=FRAME_CHUNK_SIZE,
+                        help="Number of frames sent through the LFAE at once.")
+    parser.add_argument("--gpu", default=GPU,
+                        help="choose gpu device.")
+    return parser.parse_args()
+
+
+def load_lfae(config_pth, restore_from):
+    with open(config_pth) as f:
+        config = yaml.safe_load(f)
+    checkpoint = torch.load(restore_from, map_location="cpu")
+    generator = Generator(num_regions=config['model_params']['num_regions'],
+                          num_channels=config['model_params']['num_channels'],
+                          revert_axis_swap=config['model_params']['revert_axis_swap'],
+                          **config['model_params']['generator_params']).cuda()
+    generator.load_state_dict(checkpoint['generator'])
+    region_predictor = RegionPredictor(num_regions=config['model_params']['num_regions'],
+                                       num_channels=config['model_params']['num_channels'],
+                                       estimate_affine=config['model_params']['estimate_affine'],
+                                       **config['model_params']['region_predictor_params']).cuda()
+    region_predictor.load_state_dict(checkpoint['region_predictor'])
+    bg_predictor = BGMotionPredictor(num_channels=config['model_params']['num_channels'],
+                                     **config['model_params']['bg_predictor_params']).cuda()
+    bg_predictor.load_state_dict(checkpoint['bg_predictor'])
+    generator.eval()
+    region_predictor.eval()
+    bg_predictor.eval()
+    return generator, region_predictor, bg_predictor
+
+
+def read_video(video_path, image_size, mean):
+    """
+    All frames of one video as (1, 3, nf, H, W), same preprocessing as MHAD without color jitter
+    """
+    frame_name_list = os.listdir(video_path)
+    frame_name_list.sort()
+    frame_list = []
+    for frame_name in frame_name_list:
+        img = imageio.imread(os.path.join(video_path, frame_name)).astype(np.float32)
+        img = resize(img, image_size, interpolation=cv2.INTER_AREA)
+        frame_list.append(img - np.array(mean))
+    vid = np.stack(frame_list, axis=0).transpose((3, 0, 1, 2)) / 255.0
+    return torch.from_numpy(vid.astype(np.float32)).unsqueeze(0)
+
+
+def main():
+    args = get_arguments()
+    os.environ["CUDA_VISIBLE_DEVICES"] = args.gpu
+    os.makedirs(args.cache_dir, exist_ok=True)
+    start = timeit.default_timer()
+
+    generator, region_predictor, bg_predictor = load_lfae(args.config, args.restore_from)
+
+    video_name_list = os.listdir(args.data_dir)
+    video_name_list.sort()
+    # every frame is cached, the frames of a clip are sampled when loading
+    videos = []
+    offset = 0
+    for idx, video_name in enumerate(video_name_list):
+        num_frames = len(os.listdir(os.path.join(args.data_dir, video_name)))
+        videos.append({"name": video_name,
+                       "index": idx,
+                       "action": int(video_name.split("_")[0][1:]),
+                       "subject": int(video_name.split("_")[1][1:]),
+                       "offset": offset,
+                       "num_frames": num_frames})
+        offset += num_frames
+    total_num_frames = offset
+    print("num videos, num frames:", len(videos), total_num_frames)
+
+    flow_store = None
+    fea_store = None
+    for video in videos:
+        real_vid = read_video(os.path.join(args.data_dir, video["name"]), args.input_size, MEAN).cuda()
+        ref_img = real_vid[:, :, 0, :, :].clone()
+        output_dict = extract_pseudo_gt_flow(region_predictor, bg_predictor, generator, ref_img, real_vid,
+                                             frame_chunk_size=args.frame_chunk_size)
+        # (1, 3, nf, h, w) -> (nf, 3, h, w)
+        flow = torch.cat((output_dict["real_vid_grid"], output_dict["real_vid_conf"]), dim=1)[0].transpose(0, 1)
+        fea = output_dict["ref_img_fea"][0]
+        if flow_store is None:
+            # shapes are only known after the first LFAE pass
+            flow_store = np.lib.format.open_memmap(os.path.join(args.cache_dir, "flow.npy"), mode="w+",
+                                                   dtype=np.float16, shape=(total_num_frames,) + tuple(flow.shape[1:]))
+            fea_store = np.lib.format.open_memmap(os.path.join(args.cache_dir, "fea.npy"), mode="w+",
+                                                  dtype=np.float16, shape=(len(videos),) + tuple(fea.shape))
+        flow_store[video["offset"]:video["offset"] + video["num_frames"]] = flow.cpu().numpy().astype(np.float16)
+        fea_store[video["index"]] = fea.cpu().numpy().astype(np.float16)
+        print(video["name"], video["num_frames"], "%.1fs" % (timeit.default_timer() - start))
+
+    flow_store.flush()
+    fea_store.flush()
+    index = {"image_size": args.input_size,
+             "restore_from": args.restore_from,
+             "flow_shape": list(flow_store.shape),
+             "fea_shape": list(fea_store.shape),
+             "action_list": MHAD(args.data_dir, split_train_test=False).action_list,
+             "videos": videos}
+    with open(os.path.join(args.cache_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+    print("done, %.1fs" % (timeit.default_timer() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# time per clip of the clip-level augmentation of LFAE/augmentation.py against the former frame by frame
+# skimage / PIL path, with the same parameter draws, and the largest difference between their outputs.
+# The jitter differs by a few uint8 levels: PIL rounds to uint8 after every op and shifts the hue of a uint8
+# HSV image, the clip path stays in float32 like torchvision on tensors
+import argparse
+import random
+import timeit
+import warnings
+
+import numpy as np
+import torchvision
+import yaml
+from skimage import img_as_ubyte, img_as_float
+from skimage.transform import rotate
+from LFAE.augmentation import ColorJitter, RandomRotation
+
+config_pth = "config/mhad128.yaml"
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Clip augmentation benchmark")
+    parser.add_argument("--config", default=config_pth)
+    parser.add_argument("--num-frames", type=int, default=40)
+    parser.add_argument("--image-size", type=int, default=128)
+    parser.add_argument("--degrees", type=float, default=10)
+    parser.add_argument("--num-clips", type=int, default=20)
+    return parser.parse_args()
+
+
+def frame_jitter(jitter, clip):
+    # former numpy.ndarray path of ColorJitter: every frame through uint8 PIL, same draws and order
+    brightness, contrast, saturation, hue = jitter.get_params(
+        jitter.brightness, jitter.contrast, jitter.saturation, jitter.hue)
+    img_transforms = []
+    if brightness is not None:
+        img_transforms.append(lambda img: torchvision.transforms.functional.adjust_brightness(img, brightness))
+    if saturation is not None:
+        img_transforms.append(lambda img: torchvision.transforms.functional.adjust_saturation(img, saturation))
+    if hue is not None:
+        img_transforms.append(lambda img: torchvision.transforms.functional.adjust_hue(img, hue))
+    if contrast is not None:
+        img_transforms.append(lambda img: torchvision.transforms.functional.adjust_contrast(img, contrast))
+    random.shuffle(img_transforms)
+    img_transforms = [img_as_ubyte, torchvision.transforms.ToPILImage()] + img_transforms + [np.array, img_as_float]
+    jittered_clip = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for img in clip:
+            for func in img_transforms:
+                img = func(img)
+            jittered_clip.append(img.astype('float32'))
+    return np.stack(jittered_clip)
+
+
+def frame_rotation(rotation, clip):
+    # former numpy.ndarray path of RandomRotation
+    angle = random.uniform(rotation.degrees[0], rotation.degrees[1])
+    return np.stack([rotate(image=img, angle=angle, preserve_range=True) for img in clip])
+
+
+def compare(name, frame_fn, clip_fn, clips):
+    diff = 0.
+    for seed, clip in enumerate(clips):
+        random.seed(seed)
+        frame_out = frame_fn(clip)
+        random.seed(seed)
+        clip_out = clip_fn(clip)
+        diff = max(diff, float(np.abs(frame_out - clip_out).max()))
+    frame_time = timeit.timeit(lambda: [frame_fn(clip) for clip in clips], number=1) / len(clips)
+    clip_time = timeit.timeit(lambda: [clip_fn(clip) for clip in clips], number=1) / len(clips)
+    print("%-10s frames %7.1f ms/clip, clip %7.1f ms/clip, x%.1f, max abs diff %.2e"
+          % (name, frame_time * 1e3, clip_time * 1e3, frame_time / clip_time, diff))
+
+
+def main():
+    args = get_arguments()
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    jitter = ColorJitter(**config["dataset_params"]["augmentation_params"]["jitter_param"])
+    rotation = RandomRotation(args.degrees)
+    rng = np.random.RandomState(0)
+    clips = [rng.rand(args.num_frames, args.image_size, args.image_size, 3).astype(np.float32)
+             for _ in range(args.num_clips)]
+    print("%d clips of %d frames, %dx%d" % (args.num_clips, args.num_frames, args.image_size, args.image_size))
+
+    compare("jitter", lambda clip: frame_jitter(jitter, clip), jitter, clips)
+    compare("rotation", lambda clip: frame_rotation(rotation, clip), rotation, clips)
+
+
+if __name__ == "__main__":
+    main()
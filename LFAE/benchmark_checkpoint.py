@@ -0,0 +1,109 @@
+# time spent in the training loop to save a LFAE checkpoint (generator, region and background predictors and
+# their Adam state) with an inline torch.save against LFAE/checkpoint_manager.py, which only copies the
+# state_dicts there and writes in the background. Also checks that the written checkpoint loads back unchanged
+# and that the retention policy keeps the expected files
+import argparse
+import os
+import tempfile
+import timeit
+
+import torch
+import yaml
+from LFAE.modules.generator import Generator
+from LFAE.modules.bg_motion_predictor import BGMotionPredictor
+from LFAE.modules.region_predictor import RegionPredictor
+from LFAE.checkpoint_manager import CheckpointManager
+from LFAE.train import checkpoint_dict
+
+config_pth = "config/mhad128.yaml"
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Checkpoint writing benchmark")
+    parser.add_argument("--config", type=str, default=config_pth)
+    parser.add_argument("--num-saves", type=int, default=5)
+    parser.add_argument("--keep-last", type=int, default=2)
+    parser.add_argument("--milestone-every", type=int, default=3)
+    parser.add_argument("--snapshot-dir", type=str, default=None,
+                        help="Where to write, a temporary directory if None.")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    return parser.parse_args()
+
+
+def build(args):
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    model_params = config['model_params']
+    generator = Generator(num_regions=model_params['num_regions'], num_channels=model_params['num_channels'],
+                          revert_axis_swap=model_params['revert_axis_swap'],
+                          **model_params['generator_params']).to(args.device)
+    region_predictor = RegionPredictor(num_regions=model_params['num_regions'],
+                                       num_channels=model_params['num_channels'],
+                                       estimate_affine=model_params['estimate_affine'],
+                                       **model_params['region_predictor_params']).to(args.device)
+    bg_predictor = BGMotionPredictor(num_channels=model_params['num_channels'],
+                                     **model_params['bg_predictor_params']).to(args.device)
+    params = list(generator.parameters()) + list(region_predictor.parameters()) + list(bg_predictor.parameters())
+    optimizer = torch.optim.Adam(params, lr=1e-4)
+    # one step so that the optimizer state is filled
+    for p in params:
+        p.grad = torch.randn_like(p)
+    optimizer.step()
+    return generator, region_predictor, bg_predictor, optimizer, params
+
+
+def perturb(params):
+    # stands for a training step between two saves, must not leak into a checkpoint taken before it
+    with torch.no_grad():
+        for p in params:
+            p.add_(1.)
+
+
+def main():
+    args = get_arguments()
+    is_cuda = torch.device(args.device).type == "cuda"
+    generator, region_predictor, bg_predictor, optimizer, params = build(args)
+    snapshot_dir = args.snapshot_dir or tempfile.mkdtemp()
+    os.makedirs(snapshot_dir, exist_ok=True)
+    num_bytes = sum(p.numel() * p.element_size() for p in params) * 3
+    print("%.1f MB of weights and Adam state, %s, writing to %s" % (num_bytes / 2 ** 20, args.device, snapshot_dir))
+
+    def state(step):
+        return checkpoint_dict(step, 0, generator, region_predictor, bg_predictor, optimizer, 1)
+
+    inline_time = 0.
+    for step in range(args.num_saves):
+        start = timeit.default_timer()
+        torch.save(state(step), os.path.join(snapshot_dir, "inline.pth"))
+        inline_time += timeit.default_timer() - start
+        perturb(params)
+
+    manager = CheckpointManager(keep_last=args.keep_last, milestone_every=args.milestone_every)
+    loop_time = 0.
+    expected = None
+    for step in range(1, args.num_saves + 1):
+        if is_cuda:
+            torch.cuda.synchronize()
+        start = timeit.default_timer()
+        manager.save(state(step), os.path.join(snapshot_dir, "RegionMM_S%06d.pth" % step), step=step)
+        loop_time += timeit.default_timer() - start
+        if step == args.num_saves:
+            expected = {key: value.cpu().clone() for key, value in generator.state_dict().items()}
+        perturb(params)
+    flush_start = timeit.default_timer()
+    manager.flush()
+    flush_time = timeit.default_timer() - flush_start
+
+    print("inline torch.save %8.1f ms/save in the loop" % (1e3 * inline_time / args.num_saves))
+    print("checkpoint manager %7.1f ms/save in the loop, %.1f ms left to write at the end"
+          % (1e3 * loop_time / args.num_saves, 1e3 * flush_time))
+
+    saved = torch.load(os.path.join(snapshot_dir, "RegionMM_S%06d.pth" % args.num_saves))
+    diff = max((saved['generator'][key].float() - value.float()).abs().max().item()
+               for key, value in expected.items())
+    print("max abs diff of the last checkpoint %.2e" % diff)
+    print("kept:", " ".join(sorted(name for name in os.listdir(snapshot_dir) if name.startswith("RegionMM"))))
+
+
+if __name__ == "__main__":
+    main()
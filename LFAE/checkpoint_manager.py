@@ -0,0 +1,123 @@
+# checkpoints written in a background thread so that the training loop only pays for a copy of the state_dicts:
+# cuda tensors are copied asynchronously to pinned memory, the thread waits for the copies, serializes, writes
+# to a temporary file and renames it over the checkpoint, a checkpoint on disk is always complete.
+# Used by LFAE/train.py, LFAE/train_ddp.py and the DM trainers
+import os
+import queue
+import threading
+import timeit
+import atexit
+from collections import OrderedDict
+
+import torch
+
+
+def snapshot_to_cpu(obj, devices):
+    """
+    Copy of a nested dict / list / tuple of tensors and python values (a state_dict, an optimizer state_dict)
+    with every tensor on the cpu, training may go on modifying the original. cuda tensors are copied into
+    pinned memory without waiting, the devices copied from are added to the set devices
+    """
+    if isinstance(obj, torch.Tensor):
+        tensor = obj.detach()
+        if not tensor.is_cuda:
+            return tensor.clone()
+        copy = torch.empty_like(tensor, device="cpu", pin_memory=True)
+        copy.copy_(tensor, non_blocking=True)
+        devices.add(tensor.device)
+        return copy
+    if isinstance(obj, dict):
+        copy = type(obj)() if isinstance(obj, OrderedDict) else {}
+        for key, value in obj.items():
+            copy[key] = snapshot_to_cpu(value, devices)
+        if hasattr(obj, "_metadata"):
+            # module versions of a state_dict, read by load_state_dict
+            copy._metadata = obj._metadata
+        return copy
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_to_cpu(value, devices) for value in obj)
+    return obj
+
+
+class CheckpointManager(object):
+    """
+    save(state, path) snapshots state to the cpu and returns, a background thread writes it to path.
+    At most max_pending checkpoints wait to be written, save blocks beyond that.
+    Checkpoints saved with a step are periodic snapshots: only the last keep_last of them are kept
+    (all if 0) plus the milestones, those whose step is a multiple of milestone_every. Checkpoints saved
+    without a step (the rolling RegionMM.pth / flowdiff.pth) are just replaced. Only files written by the
+    manager are ever removed.
+    flush waits for all pending writes, it is also run at exit. A failed write raises on the next call
+    """
+
+    def __init__(self, keep_last=0, milestone_every=0, max_pending=2):
+        self.keep_last = keep_last
+        self.milestone_every = milestone_every
+        # (step, path) of the periodic snapshots written, oldest first
+        self.snapshots = []
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.run, name="checkpoint-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def save(self, state, path, step=None):
+        self.check()
+        start = timeit.default_timer()
+        devices = set()
+        state = snapshot_to_cpu(state, devices)
+        # the copies are queued on the current streams, the writer waits for these events
+        events = [torch.cuda.current_stream(device).record_event() for device in devices]
+        self.queue.put((state, events, path, step, timeit.default_timer() - start))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                self.write(*item)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, state, events, path, step, snapshot_time):
+        start = timeit.default_timer()
+        for event in events:
+            event.synchronize()
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                torch.save(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+        if step is not None:
+            self.retain(path, step)
+        print("checkpoint %s written in %.1fs (%.3fs in the training loop)"
+              % (path, timeit.default_timer() - start, snapshot_time))
+
+    def retain(self, path, step):
+        self.snapshots = [snapshot for snapshot in self.snapshots if snapshot[1] != path] + [(step, path)]
+        if self.keep_last <= 0:
+            return
+        kept = []
+        for idx, (old_step, old_path) in enumerate(self.snapshots):
+            recent = idx >= len(self.snapshots) - self.keep_last
+            milestone = self.milestone_every > 0 and old_step % self.milestone_every == 0
+            if recent or milestone:
+                kept.append((old_step, old_path))
+            elif os.path.isfile(old_path):
+                os.remove(old_path)
+        self.snapshots = kept
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("writing a checkpoint failed") from error
+
+    def flush(self):
+        self.queue.join()
+        self.check()
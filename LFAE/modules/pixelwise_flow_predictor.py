@@ -1,128 +1,217 @@
-from torch import nn
-import torch.nn.functional as F
-import torch
-from LFAE.modules.util import Hourglass, AntiAliasInterpolation2d, make_coordinate_grid, region2gaussian
-from LFAE.modules.util import to_homogeneous, from_homogeneous
-
-
-class PixelwiseFlowPredictor(nn.Module):
-    """
-    Module that predicts a pixelwise flow from sparse motion representation given by
-    source_region_params and driving_region_params
-    """
-
-    def __init__(self, block_expansion, num_blocks, max_features, num_regions, num_channels,
-                 estimate_occlusion_map=False, scale_factor=1, region_var=0.01,
-                 use_covar_heatmap=False, use_deformed_source=True, revert_axis_swap=False):
-        super(PixelwiseFlowPredictor, self).__init__()
-        self.hourglass = Hourglass(block_expansion=block_expansion,
-                                   in_features=(num_regions + 1) * (num_channels * use_deformed_source + 1),
-                                   max_features=max_features, num_blocks=num_blocks)
-
-        self.mask = nn.Conv2d(self.hourglass.out_filters, num_regions + 1, kernel_size=(7, 7), padding=(3, 3))
-
-        if estimate_occlusion_map:
-            self.occlusion = nn.Conv2d(self.hourglass.out_filters, 1, kernel_size=(7, 7), padding=(3, 3))
-        else:
-            self.occlusion = None
-
-        self.num_regions = num_regions
-        self.scale_factor = scale_factor
-        self.region_var = region_var
-        self.use_covar_heatmap = use_covar_heatmap
-        self.use_deformed_source = use_deformed_source
-        self.revert_axis_swap = revert_axis_swap
-
-        if self.scale_factor != 1:
-            self.down = AntiAliasInterpolation2d(num_channels, self.scale_factor)
-
-    def create_heatmap_representations(self, source_image, driving_region_params, source_region_params):
-        """
-        Eq 6. in the paper H_k(z)
-        """
-        spatial_size = source_image.shape[2:]
-        covar = self.region_var if not self.use_covar_heatmap else driving_region_params['covar']
-        gaussian_driving = region2gaussian(driving_region_params['shift'], covar=covar, spatial_size=spatial_size)
-        covar = self.region_var if not self.use_covar_heatmap else source_region_params['covar']
-        gaussian_source = region2gaussian(source_region_params['shift'], covar=covar, spatial_size=spatial_size)
-
-        heatmap = gaussian_driving - gaussian_source
-
-        # adding background feature
-        zeros = torch.zeros(heatmap.shape[0], 1, spatial_size[0], spatial_size[1])
-        heatmap = torch.cat([zeros.type(heatmap.type()), heatmap], dim=1)
-        heatmap = heatmap.unsqueeze(2)
-        return heatmap
-
-    def create_sparse_motions(self, source_image, driving_region_params, source_region_params, bg_params=None):
-        bs, _, h, w = source_image.shape
-        identity_grid = make_coordinate_grid((h, w), type=source_region_params['shift'].type())
-        identity_grid = identity_grid.view(1, 1, h, w, 2)
-        coordinate_grid = identity_grid - driving_region_params['shift'].view(bs, self.num_regions, 1, 1, 2)
-        if 'affine' in driving_region_params:
-            affine = torch.matmul(source_region_params['affine'], torch.inverse(driving_region_params['affine']))
-            if self.revert_axis_swap:
-                affine = affine * torch.sign(affine[:, :, 0:1, 0:1])
-            affine = affine.unsqueeze(-3).unsqueeze(-3)
-            affine = affine.repeat(1, 1, h, w, 1, 1)
-            coordinate_grid = torch.matmul(affine, coordinate_grid.unsqueeze(-1))
-            coordinate_grid = coordinate_grid.squeeze(-1)
-
-        driving_to_source = coordinate_grid + source_region_params['shift'].view(bs, self.num_regions, 1, 1, 2)
-
-        # adding background feature
-        if bg_params is None:
-            bg_grid = identity_grid.repeat(bs, 1, 1, 1, 1)
-        else:
-            bg_grid = identity_grid.repeat(bs, 1, 1, 1, 1)
-            bg_grid = to_homogeneous(bg_grid)
-            bg_grid = torch.matmul(bg_params.view(bs, 1, 1, 1, 3, 3), bg_grid.unsqueeze(-1)).squeeze(-1)
-            bg_grid = from_homogeneous(bg_grid)
-
-        sparse_motions = torch.cat([bg_grid, driving_to_source], dim=1)
-
-        return sparse_motions
-
-    def create_deformed_source_image(self, source_image, sparse_motions):
-        bs, _, h, w = source_image.shape
-        source_repeat = source_image.unsqueeze(1).unsqueeze(1).repeat(1, self.num_regions + 1, 1, 1, 1, 1)
-        source_repeat = source_repeat.view(bs * (self.num_regions + 1), -1, h, w)
-        sparse_motions = sparse_motions.view((bs * (self.num_regions + 1), h, w, -1))
-        sparse_deformed = F.grid_sample(source_repeat, sparse_motions)
-        sparse_deformed = sparse_deformed.view((bs, self.num_regions + 1, -1, h, w))
-        return sparse_deformed
-
-    def forward(self, source_image, driving_region_params, source_region_params, bg_params=None):
-        if self.scale_factor != 1:
-            source_image = self.down(source_image)
-
-        bs, _, h, w = source_image.shape
-
-        out_dict = dict()
-        heatmap_representation = self.create_heatmap_representations(source_image, driving_region_params,
-                                                                     source_region_params)
-        sparse_motion = self.create_sparse_motions(source_image, driving_region_params,
-                                                   source_region_params, bg_params=bg_params)
-        deformed_source = self.create_deformed_source_image(source_image, sparse_motion)
-        if self.use_deformed_source:
-            predictor_input = torch.cat([heatmap_representation, deformed_source], dim=2)
-        else:
-            predictor_input = heatmap_representation
-        predictor_input = predictor_input.view(bs, -1, h, w)
-
-        prediction = self.hourglass(predictor_input)
-
-        mask = self.mask(prediction)
-        mask = F.softmax(mask, dim=1)
-        mask = mask.unsqueeze(2)
-        sparse_motion = sparse_motion.permute(0, 1, 4, 2, 3)
-        deformation = (sparse_motion * mask).sum(dim=1)
-        deformation = deformation.permute(0, 2, 3, 1)
-
-        out_dict['optical_flow'] = deformation
-
-        if self.occlusion:
-            occlusion_map = torch.sigmoid(self.occlusion(prediction))
-            out_dict['occlusion_map'] = occlusion_map
-
-        return out_dict
+from torch import nn
+import torch.nn.functional as F
+import torch
+from LFAE.modules.util import Hourglass, AntiAliasInterpolation2d, coordinate_grid, region2gaussian
+from LFAE.modules.util import to_homogeneous, from_homogeneous, full_precision
+
+
+class PixelwiseFlowPredictor(nn.Module):
+    """
+    Module that predicts a pixelwise flow from sparse motion representation given by
+    source_region_params and driving_region_params
+    """
+
+    def __init__(self, block_expansion, num_blocks, max_features, num_regions, num_channels,
+                 estimate_occlusion_map=False, scale_factor=1, region_var=0.01,
+                 use_covar_heatmap=False, use_deformed_source=True, revert_axis_swap=False):
+        super(PixelwiseFlowPredictor, self).__init__()
+        self.hourglass = Hourglass(block_expansion=block_expansion,
+                                   in_features=(num_regions + 1) * (num_channels * use_deformed_source + 1),
+                                   max_features=max_features, num_blocks=num_blocks)
+
+        self.mask = nn.Conv2d(self.hourglass.out_filters, num_regions + 1, kernel_size=(7, 7), padding=(3, 3))
+
+        if estimate_occlusion_map:
+            self.occlusion = nn.Conv2d(self.hourglass.out_filters, 1, kernel_size=(7, 7), padding=(3, 3))
+        else:
+            self.occlusion = None
+
+        self.num_regions = num_regions
+        self.scale_factor = scale_factor
+        self.region_var = region_var
+        self.use_covar_heatmap = use_covar_heatmap
+        self.use_deformed_source = use_deformed_source
+        self.revert_axis_swap = revert_axis_swap
+
+        if self.scale_factor != 1:
+            self.down = AntiAliasInterpolation2d(num_channels, self.scale_factor)
+
+    def create_heatmap_representations(self, source_image, driving_region_params, source_region_params):
+        """
+        Eq 6. in the paper H_k(z)
+        """
+        spatial_size = source_image.shape[2:]
+        covar = self.region_var if not self.use_covar_heatmap else driving_region_params['covar']
+        gaussian_driving = region2gaussian(driving_region_params['shift'], covar=covar, spatial_size=spatial_size)
+        covar = self.region_var if not self.use_covar_heatmap else source_region_params['covar']
+        gaussian_source = region2gaussian(source_region_params['shift'], covar=covar, spatial_size=spatial_size)
+
+        heatmap = gaussian_driving - gaussian_source
+
+        # adding background feature
+        zeros = heatmap.new_zeros(heatmap.shape[0], 1, spatial_size[0], spatial_size[1])
+        heatmap = torch.cat([zeros, heatmap], dim=1)
+        heatmap = heatmap.unsqueeze(2)
+        return heatmap
+
+    def create_sparse_motions(self, source_image, driving_region_params, source_region_params, bg_params=None):
+        bs, _, h, w = source_image.shape
+        identity_grid = coordinate_grid((h, w), dtype=source_region_params['shift'].dtype,
+                                        device=source_region_params['shift'].device)
+        if 'affine' in driving_region_params:
+            affine = torch.matmul(source_region_params['affine'], torch.inverse(driving_region_params['affine']))
+            if self.revert_axis_swap:
+                affine = affine * torch.sign(affine[:, :, 0:1, 0:1])
+            # affine (z - shift_d) + shift_s is an affine map of the identity grid, one 2x3 matrix per region
+            shift = torch.matmul(affine, driving_region_params['shift'].unsqueeze(-1)).squeeze(-1)
+            shift = source_region_params['shift'] - shift
+            theta = torch.cat([affine, shift.unsqueeze(-1)], dim=-1).view(bs * self.num_regions, 2, 3)
+            driving_to_source = F.affine_grid(theta, [bs * self.num_regions, 1, h, w], align_corners=True)
+            driving_to_source = driving_to_source.view(bs, self.num_regions, h, w, 2)
+        else:
+            shift = source_region_params['shift'] - driving_region_params['shift']
+            driving_to_source = identity_grid + shift.view(bs, self.num_regions, 1, 1, 2)
+
+        # adding background feature
+        if bg_params is None:
+            bg_grid = identity_grid.expand(bs, 1, h, w, 2)
+        else:
+            bg_grid = to_homogeneous(identity_grid)
+            bg_grid = torch.einsum('bij,hwj->bhwi', bg_params.view(bs, 3, 3), bg_grid)
+            bg_grid = from_homogeneous(bg_grid).unsqueeze(1)
+
+        sparse_motions = torch.cat([bg_grid, driving_to_source], dim=1)
+
+        return sparse_motions
+
+    def create_deformed_source_image(self, source_image, sparse_motions):
+        bs, _, h, w = source_image.shape
+        # the grids of all regions are stacked along the height, so the source is sampled once per region
+        # without replicating it
+        sparse_motions = sparse_motions.view((bs, (self.num_regions + 1) * h, w, -1))
+        sparse_deformed = F.grid_sample(source_image, sparse_motions)
+        sparse_deformed = sparse_deformed.view((bs, -1, self.num_regions + 1, h, w)).transpose(1, 2)
+        return sparse_deformed
+
+    def forward(self, source_image, driving_region_params, source_region_params, bg_params=None):
+        if self.scale_factor != 1:
+            source_image = self.down(source_image)
+
+        bs, _, h, w = source_image.shape
+
+        out_dict = dict()
+        # region gaussians, sampling grids and the flow are coordinates, they stay in float32 under autocast
+        with full_precision(source_image.device):
+            source_image = source_image.float()
+            heatmap_representation = self.create_heatmap_representations(source_image, driving_region_params,
+                                                                         source_region_params)
+            sparse_motion = self.create_sparse_motions(source_image, driving_region_params,
+                                                       source_region_params, bg_params=bg_params)
+            deformed_source = self.create_deformed_source_image(source_image, sparse_motion)
+        if self.use_deformed_source:
+            predictor_input = torch.cat([heatmap_representation, deformed_source], dim=2)
+        else:
+            predictor_input = heatmap_representation
+        predictor_input = predictor_input.view(bs, -1, h, w)
+
+        prediction = self.hourglass(predictor_input)
+
+        mask = self.mask(prediction)
+        with full_precision(mask.device):
+            mask = F.softmax(mask.float(), dim=1)
+            deformation = torch.einsum('bkhwc,bkhw->bhwc', sparse_motion, mask)
+
+        out_dict['optical_flow'] = deformation
+
+        if self.occlusion:
+            occlusion_map = torch.sigmoid(self.occlusion(prediction))
+            out_dict['occlusion_map'] = occlusion_map
+
+        return out_dict
+
+
+if __name__ == "__main__":
+    # parity with the formulation that repeated the affines, grids and source per region and pixel
+    from LFAE.modules.util import make_coordinate_grid
+
+    def region2gaussian_reference(center, covar, spatial_size):
+        mean = center
+        grid = make_coordinate_grid(spatial_size, mean.type())
+        number_of_leading_dimensions = len(mean.shape) - 1
+        shape = (1,) * number_of_leading_dimensions + grid.shape
+        grid = grid.view(*shape).repeat(*(mean.shape[:number_of_leading_dimensions] + (1, 1, 1)))
+        mean = mean.view(*(mean.shape[:number_of_leading_dimensions] + (1, 1, 2)))
+        mean_sub = grid - mean
+        if isinstance(covar, float):
+            return torch.exp(-0.5 * (mean_sub ** 2).sum(-1) / covar)
+        covar_inverse = torch.inverse(covar).view(*(mean.shape[:number_of_leading_dimensions] + (1, 1, 2, 2)))
+        under_exp = torch.matmul(torch.matmul(mean_sub.unsqueeze(-2), covar_inverse), mean_sub.unsqueeze(-1))
+        return torch.exp(-0.5 * under_exp.sum(dim=(-1, -2)))
+
+    def create_sparse_motions_reference(predictor, source_image, driving_region_params, source_region_params,
+                                        bg_params=None):
+        bs, _, h, w = source_image.shape
+        identity_grid = make_coordinate_grid((h, w), type=source_region_params['shift'].type())
+        identity_grid = identity_grid.view(1, 1, h, w, 2)
+        grid = identity_grid - driving_region_params['shift'].view(bs, predictor.num_regions, 1, 1, 2)
+        if 'affine' in driving_region_params:
+            affine = torch.matmul(source_region_params['affine'], torch.inverse(driving_region_params['affine']))
+            if predictor.revert_axis_swap:
+                affine = affine * torch.sign(affine[:, :, 0:1, 0:1])
+            affine = affine.unsqueeze(-3).unsqueeze(-3).repeat(1, 1, h, w, 1, 1)
+            grid = torch.matmul(affine, grid.unsqueeze(-1)).squeeze(-1)
+        driving_to_source = grid + source_region_params['shift'].view(bs, predictor.num_regions, 1, 1, 2)
+        bg_grid = identity_grid.repeat(bs, 1, 1, 1, 1)
+        if bg_params is not None:
+            bg_grid = to_homogeneous(bg_grid)
+            bg_grid = torch.matmul(bg_params.view(bs, 1, 1, 1, 3, 3), bg_grid.unsqueeze(-1)).squeeze(-1)
+            bg_grid = from_homogeneous(bg_grid)
+        return torch.cat([bg_grid, driving_to_source], dim=1)
+
+    def create_deformed_source_image_reference(predictor, source_image, sparse_motions):
+        bs, _, h, w = source_image.shape
+        source_repeat = source_image.unsqueeze(1).unsqueeze(1).repeat(1, predictor.num_regions + 1, 1, 1, 1, 1)
+        source_repeat = source_repeat.view(bs * (predictor.num_regions + 1), -1, h, w)
+        sparse_motions = sparse_motions.view((bs * (predictor.num_regions + 1), h, w, -1))
+        sparse_deformed = F.grid_sample(source_repeat, sparse_motions)
+        return sparse_deformed.view((bs, predictor.num_regions + 1, -1, h, w))
+
+    def region_params(bs, num_regions, affine):
+        params = {'shift': torch.rand(bs, num_regions, 2) * 1.6 - 0.8}
+        if affine:
+            jac = torch.eye(2) + 0.3 * torch.randn(bs, num_regions, 2, 2)
+            params['affine'] = jac
+            params['covar'] = torch.matmul(jac, jac.transpose(-1, -2)) * 0.01
+        return params
+
+    torch.manual_seed(0)
+    bs, num_regions, h, w = 2, 10, 32, 40
+    source_image = torch.rand(bs, 3, h, w)
+    bg = torch.eye(3) + 0.05 * torch.randn(bs, 3, 3)
+    for revert_axis_swap in (False, True):
+        predictor = PixelwiseFlowPredictor(block_expansion=8, num_blocks=2, max_features=16, num_regions=num_regions,
+                                           num_channels=3, use_covar_heatmap=True,
+                                           revert_axis_swap=revert_axis_swap)
+        for affine in (False, True):
+            driving, source = region_params(bs, num_regions, affine), region_params(bs, num_regions, affine)
+            for covar in ((0.01, driving['covar']) if affine else (0.01,)):
+                diff = (region2gaussian(driving['shift'], covar, (h, w))
+                        - region2gaussian_reference(driving['shift'], covar, (h, w))).abs().max().item()
+                assert diff < 1e-5, "region2gaussian (affine %s): %.2e" % (affine, diff)
+            for bg_params in (None, bg):
+                motions = predictor.create_sparse_motions(source_image, driving, source, bg_params=bg_params)
+                motions_ref = create_sparse_motions_reference(predictor, source_image, driving, source,
+                                                              bg_params=bg_params)
+                diff = (motions - motions_ref).abs().max().item()
+                assert diff < 1e-5, "sparse motions (affine %s, bg %s, revert_axis_swap %s): %.2e" \
+                                    % (affine, bg_params is not None, revert_axis_swap, diff)
+                # same grids on both sides, the sampling itself must agree to rounding
+                deformed = predictor.create_deformed_source_image(source_image, motions_ref)
+                deformed_ref = create_deformed_source_image_reference(predictor, source_image, motions_ref)
+                diff = (deformed - deformed_ref).abs().max().item()
+                assert diff < 1e-6, "deformed source (affine %s, bg %s): %.2e" % (affine, bg_params is not None, diff)
+                mask = F.softmax(torch.randn(bs, num_regions + 1, h, w), dim=1)
+                flow_ref = (motions_ref.permute(0, 1, 4, 2, 3) * mask.unsqueeze(2)).sum(dim=1).permute(0, 2, 3, 1)
+                diff = (torch.einsum('bkhwc,bkhw->bhwc', motions, mask) - flow_ref).abs().max().item()
+                assert diff < 1e-5, "flow (affine %s, bg %s): %.2e" % (affine, bg_params is not None, diff)
+    print("pixelwise flow predictor matches the reference formulation")
@@ -1,108 +1,194 @@
-from torch import nn
-import torch
-import torch.nn.functional as F
-from LFAE.modules.util import Hourglass, make_coordinate_grid, AntiAliasInterpolation2d, Encoder
-
-
-def svd(covar, fast=False):
-    if fast:
-        from torch_batch_svd import svd as fast_svd
-        return fast_svd(covar)
-    else:
-        u, s, v = torch.svd(covar.cpu())
-        s = s.to(covar.device)
-        u = u.to(covar.device)
-        v = v.to(covar.device)
-        return u, s, v
-
-
-class RegionPredictor(nn.Module):
-    """
-    Region estimating. Estimate affine parameters of the region.
-    """
-
-    def __init__(self, block_expansion, num_regions, num_channels, max_features,
-                 num_blocks, temperature, estimate_affine=False, scale_factor=1,
-                 pca_based=False, fast_svd=False, pad=3):
-        super(RegionPredictor, self).__init__()
-        self.predictor = Hourglass(block_expansion, in_features=num_channels,
-                                   max_features=max_features, num_blocks=num_blocks)
-
-        self.regions = nn.Conv2d(in_channels=self.predictor.out_filters, out_channels=num_regions, kernel_size=(7, 7),
-                                 padding=pad)
-
-        # FOMM-like regression based representation
-        if estimate_affine and not pca_based:
-            self.jacobian = nn.Conv2d(in_channels=self.predictor.out_filters,
-                                      out_channels=4, kernel_size=(7, 7), padding=pad)
-            self.jacobian.weight.data.zero_()
-            self.jacobian.bias.data.copy_(torch.tensor([1, 0, 0, 1], dtype=torch.float))
-        else:
-            self.jacobian = None
-
-        self.temperature = temperature
-        self.scale_factor = scale_factor
-        self.pca_based = pca_based
-        self.fast_svd = fast_svd
-
-        if self.scale_factor != 1:
-            self.down = AntiAliasInterpolation2d(num_channels, self.scale_factor)
-
-    def region2affine(self, region):
-        shape = region.shape
-        region = region.unsqueeze(-1)
-        grid = make_coordinate_grid(shape[2:], region.type()).unsqueeze_(0).unsqueeze_(0)
-        mean = (region * grid).sum(dim=(2, 3))
-
-        region_params = {'shift': mean}
-
-        if self.pca_based:
-            mean_sub = grid - mean.unsqueeze(-2).unsqueeze(-2)
-            covar = torch.matmul(mean_sub.unsqueeze(-1), mean_sub.unsqueeze(-2))
-            covar = covar * region.unsqueeze(-1)
-            covar = covar.sum(dim=(2, 3))
-            region_params['covar'] = covar
-
-        return region_params
-
-    def forward(self, x):
-        if self.scale_factor != 1:
-            x = self.down(x)
-
-        feature_map = self.predictor(x)
-        prediction = self.regions(feature_map)
-
-        final_shape = prediction.shape
-        region = prediction.view(final_shape[0], final_shape[1], -1)
-        region = F.softmax(region / self.temperature, dim=2)
-        region = region.view(*final_shape)
-
-        region_params = self.region2affine(region)
-        region_params['heatmap'] = region
-
-        # Regression-based estimation
-        if self.jacobian is not None:
-            jacobian_map = self.jacobian(feature_map)
-            jacobian_map = jacobian_map.reshape(final_shape[0], 1, 4, final_shape[2],
-                                                final_shape[3])
-            region = region.unsqueeze(2)
-
-            jacobian = region * jacobian_map
-            jacobian = jacobian.view(final_shape[0], final_shape[1], 4, -1)
-            jacobian = jacobian.sum(dim=-1)
-            jacobian = jacobian.view(jacobian.shape[0], jacobian.shape[1], 2, 2)
-            region_params['affine'] = jacobian
-            region_params['covar'] = torch.matmul(jacobian, jacobian.permute(0, 1, 3, 2))
-        elif self.pca_based:
-            covar = region_params['covar']
-            shape = covar.shape
-            covar = covar.view(-1, 2, 2)
-            u, s, v = svd(covar, self.fast_svd)
-            d = torch.diag_embed(s ** 0.5)
-            sqrt = torch.matmul(u, d)
-            sqrt = sqrt.view(*shape)
-            region_params['affine'] = sqrt
-            region_params['u'] = u
-            region_params['d'] = d
-
-        return region_params
+from torch import nn
+import torch
+import torch.nn.functional as F
+from LFAE.modules.util import Hourglass, coordinate_grid, AntiAliasInterpolation2d, Encoder, full_precision
+
+
+def symmetric_eig2x2(covar):
+    """
+    Closed-form eigendecomposition of a batch of symmetric positive semi-definite 2x2 matrices (..., 2, 2),
+    returned in the layout of torch.svd: eigenvalues in descending order and u = v.
+    u = [[-cos, -sin], [-sin, cos]] is a reflection like the one LAPACK returns, it can differ from the CPU svd
+    by a global sign, which revert_axis_swap cancels in the relative affine transforms.
+    """
+    a = covar[..., 0, 0]
+    b = covar[..., 0, 1]
+    d = covar[..., 1, 1]
+    half_trace = (a + d) / 2
+    half_diff = (a - d) / 2
+
+    # isotropic matrices have no preferred direction, keep the gradient finite there
+    degenerate = (half_diff == 0) & (b == 0)
+    half_diff_safe = torch.where(degenerate, torch.ones_like(half_diff), half_diff)
+    b_safe = torch.where(degenerate, torch.zeros_like(b), b)
+    radius = torch.where(degenerate, torch.zeros_like(half_diff), torch.hypot(half_diff_safe, b_safe))
+    s = torch.stack([half_trace + radius, (half_trace - radius).abs()], dim=-1)
+
+    # direction of the principal axis, cos >= 0
+    theta = torch.atan2(b_safe, half_diff_safe) / 2
+    cos, sin = theta.cos(), theta.sin()
+    u = torch.stack([torch.stack([-cos, -sin], dim=-1), torch.stack([-sin, cos], dim=-1)], dim=-2)
+    return u, s, u
+
+
+def svd(covar, fast=False, analytic=False):
+    if analytic:
+        return symmetric_eig2x2(covar)
+    elif fast:
+        from torch_batch_svd import svd as fast_svd
+        return fast_svd(covar)
+    else:
+        u, s, v = torch.svd(covar.cpu())
+        s = s.to(covar.device)
+        u = u.to(covar.device)
+        v = v.to(covar.device)
+        return u, s, v
+
+
+class RegionPredictor(nn.Module):
+    """
+    Region estimating. Estimate affine parameters of the region.
+    """
+
+    def __init__(self, block_expansion, num_regions, num_channels, max_features,
+                 num_blocks, temperature, estimate_affine=False, scale_factor=1,
+                 pca_based=False, fast_svd=False, analytic_svd=False, pad=3):
+        super(RegionPredictor, self).__init__()
+        self.predictor = Hourglass(block_expansion, in_features=num_channels,
+                                   max_features=max_features, num_blocks=num_blocks)
+
+        self.regions = nn.Conv2d(in_channels=self.predictor.out_filters, out_channels=num_regions, kernel_size=(7, 7),
+                                 padding=pad)
+
+        # FOMM-like regression based representation
+        if estimate_affine and not pca_based:
+            self.jacobian = nn.Conv2d(in_channels=self.predictor.out_filters,
+                                      out_channels=4, kernel_size=(7, 7), padding=pad)
+            self.jacobian.weight.data.zero_()
+            self.jacobian.bias.data.copy_(torch.tensor([1, 0, 0, 1], dtype=torch.float))
+        else:
+            self.jacobian = None
+
+        self.temperature = temperature
+        self.scale_factor = scale_factor
+        self.pca_based = pca_based
+        self.fast_svd = fast_svd
+        # closed-form 2x2 solver on the input device instead of a host round trip per call
+        self.analytic_svd = analytic_svd
+
+        if self.scale_factor != 1:
+            self.down = AntiAliasInterpolation2d(num_channels, self.scale_factor)
+
+    def region2affine(self, region):
+        shape = region.shape
+        region = region.unsqueeze(-1)
+        grid = coordinate_grid(shape[2:], dtype=region.dtype, device=region.device).unsqueeze(0).unsqueeze(0)
+        mean = (region * grid).sum(dim=(2, 3))
+
+        region_params = {'shift': mean}
+
+        if self.pca_based:
+            mean_sub = grid - mean.unsqueeze(-2).unsqueeze(-2)
+            covar = torch.matmul(mean_sub.unsqueeze(-1), mean_sub.unsqueeze(-2))
+            covar = covar * region.unsqueeze(-1)
+            covar = covar.sum(dim=(2, 3))
+            region_params['covar'] = covar
+
+        return region_params
+
+    def forward(self, x):
+        if self.scale_factor != 1:
+            x = self.down(x)
+
+        feature_map = self.predictor(x)
+        prediction = self.regions(feature_map)
+        jacobian_map = self.jacobian(feature_map) if self.jacobian is not None else None
+
+        # the softmax, region moments and their decomposition stay in float32 under autocast
+        with full_precision(x.device):
+            return self.predict_region_params(prediction.float(), jacobian_map)
+
+    def predict_region_params(self, prediction, jacobian_map=None):
+        final_shape = prediction.shape
+        region = prediction.view(final_shape[0], final_shape[1], -1)
+        region = F.softmax(region / self.temperature, dim=2)
+        region = region.view(*final_shape)
+
+        region_params = self.region2affine(region)
+        region_params['heatmap'] = region
+
+        # Regression-based estimation
+        if jacobian_map is not None:
+            jacobian_map = jacobian_map.float().reshape(final_shape[0], 1, 4, final_shape[2],
+                                                final_shape[3])
+            region = region.unsqueeze(2)
+
+            jacobian = region * jacobian_map
+            jacobian = jacobian.view(final_shape[0], final_shape[1], 4, -1)
+            jacobian = jacobian.sum(dim=-1)
+            jacobian = jacobian.view(jacobian.shape[0], jacobian.shape[1], 2, 2)
+            region_params['affine'] = jacobian
+            region_params['covar'] = torch.matmul(jacobian, jacobian.permute(0, 1, 3, 2))
+        elif self.pca_based:
+            covar = region_params['covar']
+            shape = covar.shape
+            covar = covar.view(-1, 2, 2)
+            u, s, v = svd(covar, self.fast_svd, self.analytic_svd)
+            d = torch.diag_embed(s ** 0.5)
+            sqrt = torch.matmul(u, d)
+            sqrt = sqrt.view(*shape)
+            region_params['affine'] = sqrt
+            region_params['u'] = u
+            region_params['d'] = d
+
+        return region_params
+
+
+if __name__ == "__main__":
+    # parity of the closed-form solver with torch.linalg.svd, including near-degenerate covariances.
+    # errors are relative to the largest entry / singular value of each matrix
+    tolerances = {torch.float64: 1e-10, torch.float32: 1e-5}
+
+    def relative(x, ref, dims):
+        return ((x - ref).abs().amax(dims) / ref.abs().amax(dims).clamp_min(1e-30)).max().item()
+
+    torch.manual_seed(0)
+    jac = torch.randn(100000, 2, 2, dtype=torch.float64)
+    covar = torch.matmul(jac, jac.transpose(-1, -2))
+    iso = torch.rand(1000, 1, 1, dtype=torch.float64) * torch.eye(2, dtype=torch.float64)
+    near_iso = iso + 1e-7 * covar[:1000]
+    rank_one = torch.matmul(jac[:1000, :, :1], jac[:1000, :, :1].transpose(-1, -2))
+    for name, c in (("random", covar), ("isotropic", iso), ("near isotropic", near_iso), ("rank one", rank_one)):
+        for dtype, tol in tolerances.items():
+            c = c.to(dtype)
+            u, s, _ = svd(c, analytic=True)
+            u_ref, s_ref, _ = torch.linalg.svd(c)
+            diff = relative(s, s_ref, -1)
+            assert diff < tol, "%s %s: singular values %.2e" % (name, dtype, diff)
+            rec = torch.matmul(u * s.unsqueeze(-2), u.transpose(-1, -2))
+            diff = relative(rec, c, (-1, -2))
+            assert diff < tol, "%s %s: reconstruction %.2e" % (name, dtype, diff)
+            # the sign convention of the docstring: where the principal axis is well defined
+            # u is the LAPACK one up to a global sign
+            separated = (s_ref[:, 0] - s_ref[:, 1]) > 1e-2 * s_ref[:, 0]
+            if separated.any():
+                diff = torch.minimum((u - u_ref).abs().amax((-1, -2)),
+                                     (u + u_ref).abs().amax((-1, -2)))[separated].max().item()
+                assert diff < 100 * tol, "%s %s: u up to a global sign %.2e" % (name, dtype, diff)
+
+    # relative affine between two frames as in PixelwiseFlowPredictor with revert_axis_swap
+    def relative_affine(u, s):
+        sqrt = torch.matmul(u, torch.diag_embed(s ** 0.5))
+        affine = torch.matmul(sqrt[1::2], torch.inverse(sqrt[::2]))
+        return affine * torch.sign(affine[:, 0:1, 0:1])
+    for dtype, tol in tolerances.items():
+        c = (covar + 0.01 * torch.eye(2, dtype=torch.float64)).to(dtype)
+        diff = relative(relative_affine(*svd(c, analytic=True)[:2]), relative_affine(*svd(c)[:2]), (-1, -2))
+        assert diff < 100 * tol, "relative affine vs cpu svd %s: %.2e" % (dtype, diff)
+
+    # also through the degenerate branch
+    c = torch.cat([covar[:1000], iso, near_iso, rank_one]).float().requires_grad_()
+    u, s, _ = svd(c, analytic=True)
+    (u.sum() + s.sum()).backward()
+    assert torch.isfinite(c.grad).all(), "non finite gradient"
+    print("closed-form svd matches torch.linalg.svd")
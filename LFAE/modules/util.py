@@ -1,417 +1,535 @@
-from torch import nn
-
-import torch.nn.functional as F
-import torch
-from sync_batchnorm import SynchronizedBatchNorm2d as BatchNorm2d
-
-import numpy as np
-import matplotlib.pyplot as plt
-from skimage.draw import disk as circle
-import math
-
-
-def region2gaussian(center, covar, spatial_size):
-    """
-    Transform region parameters into gaussian-like heatmap
-    """
-    mean = center
-    coordinate_grid = make_coordinate_grid(spatial_size, mean.type())
-    number_of_leading_dimensions = len(mean.shape) - 1
-    shape = (1,) * number_of_leading_dimensions + coordinate_grid.shape
-    coordinate_grid = coordinate_grid.view(*shape)
-    repeats = mean.shape[:number_of_leading_dimensions] + (1, 1, 1)
-    coordinate_grid = coordinate_grid.repeat(*repeats)
-
-    # Preprocess kp shape
-    shape = mean.shape[:number_of_leading_dimensions] + (1, 1, 2)
-    mean = mean.view(*shape)
-
-    mean_sub = (coordinate_grid - mean)
-    if isinstance(covar, float):
-        out = torch.exp(-0.5 * (mean_sub ** 2).sum(-1) / covar)
-    else:
-        shape = mean.shape[:number_of_leading_dimensions] + (1, 1, 2, 2)
-        covar = covar.clone().detach().to(dtype=torch.float32, device=mean.device)
-        try:
-            covar_inverse = torch.inverse(covar).view(*shape)
-        except RuntimeError as e:
-            print(f"[WARNING] torch.inverse failed: {e}, using torch.pinverse instead.")
-            covar_inverse = torch.pinverse(covar).view(*shape)
-
-        under_exp = torch.matmul(torch.matmul(mean_sub.unsqueeze(-2), covar_inverse), mean_sub.unsqueeze(-1))
-        out = torch.exp(-0.5 * under_exp.sum(dim=(-1, -2)))
-
-    return out
-
-
-def make_coordinate_grid(spatial_size, type):
-    """
-    Create a meshgrid [-1,1] x [-1,1] of given spatial_size.
-    """
-    h, w = spatial_size
-    x = torch.arange(w).type(type)
-    y = torch.arange(h).type(type)
-
-    x = (2 * (x / (w - 1)) - 1)
-    y = (2 * (y / (h - 1)) - 1)
-
-    yy = y.view(-1, 1).repeat(1, w)
-    xx = x.view(1, -1).repeat(h, 1)
-
-    meshed = torch.cat([xx.unsqueeze_(2), yy.unsqueeze_(2)], 2)
-
-    return meshed
-
-
-class ResBlock2d(nn.Module):
-    """
-    Res block, preserve spatial resolution.
-    """
-
-    def __init__(self, in_features, kernel_size, padding):
-        super(ResBlock2d, self).__init__()
-        self.conv1 = nn.Conv2d(in_channels=in_features, out_channels=in_features, kernel_size=kernel_size,
-                               padding=padding)
-        self.conv2 = nn.Conv2d(in_channels=in_features, out_channels=in_features, kernel_size=kernel_size,
-                               padding=padding)
-        self.norm1 = BatchNorm2d(in_features, affine=True)
-        self.norm2 = BatchNorm2d(in_features, affine=True)
-
-    def forward(self, x):
-        out = self.norm1(x)
-        out = F.relu(out)
-        out = self.conv1(out)
-        out = self.norm2(out)
-        out = F.relu(out)
-        out = self.conv2(out)
-        out += x
-        return out
-
-
-class UpBlock2d(nn.Module):
-    """
-    Upsampling block for use in decoder.
-    """
-
-    def __init__(self, in_features, out_features, kernel_size=3, padding=1, groups=1):
-        super(UpBlock2d, self).__init__()
-
-        self.conv = nn.Conv2d(in_channels=in_features, out_channels=out_features, kernel_size=kernel_size,
-                              padding=padding, groups=groups)
-        self.norm = BatchNorm2d(out_features, affine=True)
-
-    def forward(self, x):
-        out = F.interpolate(x, scale_factor=2)
-        out = self.conv(out)
-        out = self.norm(out)
-        out = F.relu(out)
-        return out
-
-
-class DownBlock2d(nn.Module):
-    """
-    Downsampling block for use in encoder.
-    """
-
-    def __init__(self, in_features, out_features, kernel_size=3, padding=1, groups=1):
-        super(DownBlock2d, self).__init__()
-        self.conv = nn.Conv2d(in_channels=in_features, out_channels=out_features, kernel_size=kernel_size,
-                              padding=padding, groups=groups)
-        self.norm = BatchNorm2d(out_features, affine=True)
-        self.pool = nn.AvgPool2d(kernel_size=(2, 2))
-
-    def forward(self, x):
-        out = self.conv(x)
-        out = self.norm(out)
-        out = F.relu(out)
-        out = self.pool(out)
-        return out
-
-
-class SameBlock2d(nn.Module):
-    """
-    Simple block, preserve spatial resolution.
-    """
-
-    def __init__(self, in_features, out_features, groups=1, kernel_size=3, padding=1):
-        super(SameBlock2d, self).__init__()
-        self.conv = nn.Conv2d(in_channels=in_features, out_channels=out_features,
-                              kernel_size=kernel_size, padding=padding, groups=groups)
-        self.norm = BatchNorm2d(out_features, affine=True)
-
-    def forward(self, x):
-        out = self.conv(x)
-        out = self.norm(out)
-        out = F.relu(out)
-        return out
-
-
-class Encoder(nn.Module):
-    """
-    Hourglass Encoder
-    """
-
-    def __init__(self, block_expansion, in_features, num_blocks=3, max_features=256):
-        super(Encoder, self).__init__()
-
-        down_blocks = []
-        for i in range(num_blocks):
-            down_blocks.append(DownBlock2d(in_features if i == 0 else min(max_features, block_expansion * (2 ** i)),
-                                           min(max_features, block_expansion * (2 ** (i + 1))),
-                                           kernel_size=3, padding=1))
-        self.down_blocks = nn.ModuleList(down_blocks)
-
-    def forward(self, x):
-        outs = [x]
-        for down_block in self.down_blocks:
-            outs.append(down_block(outs[-1]))
-        return outs
-
-
-class Decoder(nn.Module):
-    """
-    Hourglass Decoder
-    """
-
-    def __init__(self, block_expansion, in_features, num_blocks=3, max_features=256):
-        super(Decoder, self).__init__()
-
-        up_blocks = []
-
-        for i in range(num_blocks)[::-1]:
-            in_filters = (1 if i == num_blocks - 1 else 2) * min(max_features, block_expansion * (2 ** (i + 1)))
-            out_filters = min(max_features, block_expansion * (2 ** i))
-            up_blocks.append(UpBlock2d(in_filters, out_filters, kernel_size=3, padding=1))
-
-        self.up_blocks = nn.ModuleList(up_blocks)
-        self.out_filters = block_expansion + in_features
-
-    def forward(self, x):
-        out = x.pop()
-        for up_block in self.up_blocks:
-            out = up_block(out)
-            skip = x.pop()
-            out = torch.cat([out, skip], dim=1)
-        return out
-
-
-class Hourglass(nn.Module):
-    """
-    Hourglass architecture.
-    """
-
-    def __init__(self, block_expansion, in_features, num_blocks=3, max_features=256):
-        super(Hourglass, self).__init__()
-        self.encoder = Encoder(block_expansion, in_features, num_blocks, max_features)
-        self.decoder = Decoder(block_expansion, in_features, num_blocks, max_features)
-        self.out_filters = self.decoder.out_filters
-
-    def forward(self, x):
-        return self.decoder(self.encoder(x))
-
-
-class AntiAliasInterpolation2d(nn.Module):
-    """
-    Band-limited downsampling, for better preservation of the input signal.
-    """
-
-    def __init__(self, channels, scale):
-        super(AntiAliasInterpolation2d, self).__init__()
-        sigma = (1 / scale - 1) / 2
-        kernel_size = 2 * round(sigma * 4) + 1
-        self.ka = kernel_size // 2
-        self.kb = self.ka - 1 if kernel_size % 2 == 0 else self.ka
-
-        kernel_size = [kernel_size, kernel_size]
-        sigma = [sigma, sigma]
-        # The gaussian kernel is the product of the
-        # gaussian function of each dimension.
-        kernel = 1
-        meshgrids = torch.meshgrid(
-            [
-                torch.arange(size, dtype=torch.float32)
-                for size in kernel_size
-            ]
-        )
-        for size, std, mgrid in zip(kernel_size, sigma, meshgrids):
-            mean = (size - 1) / 2
-            kernel *= torch.exp(-(mgrid - mean) ** 2 / (2 * std ** 2))
-
-        # Make sure sum of values in gaussian kernel equals 1.
-        kernel = kernel / torch.sum(kernel)
-        # Reshape to depthwise convolutional weight
-        kernel = kernel.view(1, 1, *kernel.size())
-        kernel = kernel.repeat(channels, *[1] * (kernel.dim() - 1))
-
-        self.register_buffer('weight', kernel)
-        self.groups = channels
-        self.scale = scale
-        inv_scale = 1 / scale
-        self.int_inv_scale = int(inv_scale)
-
-    def forward(self, input):
-        if self.scale == 1.0:
-            return input
-
-        out = F.pad(input, (self.ka, self.kb, self.ka, self.kb))
-        out = F.conv2d(out, weight=self.weight, groups=self.groups)
-        out = out[:, :, ::self.int_inv_scale, ::self.int_inv_scale]
-
-        return out
-
-
-def to_homogeneous(coordinates):
-    ones_shape = list(coordinates.shape)
-    ones_shape[-1] = 1
-    ones = torch.ones(ones_shape).type(coordinates.type())
-
-    return torch.cat([coordinates, ones], dim=-1)
-
-
-def from_homogeneous(coordinates):
-    return coordinates[..., :2] / coordinates[..., 2:3]
-
-
-def draw_colored_heatmap(heatmap, colormap, bg_color):
-    parts = []
-    weights = []
-    bg_color = np.array(bg_color).reshape((1, 1, 1, 3))
-    num_regions = heatmap.shape[-1]
-    for i in range(num_regions):
-        color = np.array(colormap(i / num_regions))[:3]
-        color = color.reshape((1, 1, 1, 3))
-        part = heatmap[:, :, :, i:(i + 1)]
-        part = part / np.max(part, axis=(1, 2), keepdims=True)
-        weights.append(part)
-
-        color_part = part * color
-        parts.append(color_part)
-
-    weight = sum(weights)
-    bg_weight = 1 - np.minimum(1, weight)
-    weight = np.maximum(1, weight)
-    result = sum(parts) / weight + bg_weight * bg_color
-    return result
-
-
-class Visualizer:
-    def __init__(self, kp_size=5, draw_border=False, colormap='gist_rainbow', region_bg_color=(0, 0, 0)):
-        self.kp_size = kp_size
-        self.draw_border = draw_border
-        self.colormap = plt.get_cmap(colormap)
-        self.region_bg_color = np.array(region_bg_color)
-
-    def draw_image_with_kp(self, image, kp_array):
-        image = np.copy(image)
-        spatial_size = np.array(image.shape[:2][::-1])[np.newaxis]
-        kp_array = spatial_size * (kp_array + 1) / 2
-        num_regions = kp_array.shape[0]
-        for kp_ind, kp in enumerate(kp_array):
-            rr, cc = circle((kp[1], kp[0]), self.kp_size, shape=image.shape[:2])
-            image[rr, cc] = np.array(self.colormap(kp_ind / num_regions))[:3]
-        return image
-
-    def create_image_column_with_kp(self, images, kp):
-        image_array = np.array([self.draw_image_with_kp(v, k) for v, k in zip(images, kp)])
-        return self.create_image_column(image_array)
-
-    def create_image_column(self, images):
-        if self.draw_border:
-            images = np.copy(images)
-            images[:, :, [0, -1]] = (1, 1, 1)
-            images[:, :, [0, -1]] = (1, 1, 1)
-        return np.concatenate(list(images), axis=0)
-
-    def create_image_grid(self, *args):
-        out = []
-        for arg in args:
-            if type(arg) == tuple:
-                out.append(self.create_image_column_with_kp(arg[0], arg[1]))
-            else:
-                out.append(self.create_image_column(arg))
-        return np.concatenate(out, axis=1)
-
-    @staticmethod
-    def sample(x, index):
-        return x[index].unsqueeze(dim=0).clone().detach()
-
-    def visualize(self, driving, source, out, index=0):
-        images = []
-
-        # Source image with region centers
-        source = self.sample(source, index)
-        source = source.data.cpu()
-        source_region_params = self.sample(out['source_region_params']['shift'], index)
-        source_region_params = source_region_params.data.cpu().numpy()
-        source = np.transpose(source, [0, 2, 3, 1])
-        images.append((source, source_region_params))
-
-        if 'heatmap' in out['source_region_params']:
-            source_heatmap = self.sample(out['source_region_params']['heatmap'], index)
-            source_heatmap = F.interpolate(source_heatmap, size=source.shape[1:3])
-            source_heatmap = np.transpose(source_heatmap.data.cpu().numpy(), [0, 2, 3, 1])
-            images.append(draw_colored_heatmap(source_heatmap, self.colormap, self.region_bg_color))
-
-        # Deformed image
-        if 'deformed' in out:
-            deformed = self.sample(out['deformed'], index)
-            deformed = deformed.data.cpu().numpy()
-            deformed = np.transpose(deformed, [0, 2, 3, 1])
-            images.append(deformed)
-
-        # Equivariance visualization
-        if 'transformed_frame' in out:
-            transformed = self.sample(out['transformed_frame'], index)
-            transformed = transformed.data.cpu().numpy()
-            transformed = np.transpose(transformed, [0, 2, 3, 1])
-            transformed_kp = self.sample(out['transformed_region_params']['shift'], index)
-            transformed_kp = transformed_kp.data.cpu().numpy()
-            images.append((transformed, transformed_kp))
-
-        # Driving image with region centers
-        driving_region_params = self.sample(out['driving_region_params']['shift'], index)
-        driving_region_params = driving_region_params.data.cpu().numpy()
-        driving = self.sample(driving, index)
-        driving = driving.data.cpu().numpy()
-        driving = np.transpose(driving, [0, 2, 3, 1])
-        images.append((driving, driving_region_params))
-
-        # Heatmaps visualizations
-        if 'heatmap' in out['driving_region_params']:
-            driving_heatmap = self.sample(out['driving_region_params']['heatmap'], index)
-            driving_heatmap = F.interpolate(driving_heatmap, size=source.shape[1:3])
-            driving_heatmap = np.transpose(driving_heatmap.data.cpu().numpy(), [0, 2, 3, 1])
-            images.append(draw_colored_heatmap(driving_heatmap, self.colormap, self.region_bg_color))
-
-        # Result
-        prediction = self.sample(out['prediction'], index)
-        prediction = prediction.data.cpu().numpy()
-        prediction = np.transpose(prediction, [0, 2, 3, 1])
-        images.append(prediction)
-
-        # Occlusion map
-        if 'occlusion_map' in out:
-            occlusion_map = self.sample(out['occlusion_map'], index)
-            occlusion_map = occlusion_map.data.cpu().repeat(1, 3, 1, 1)
-            occlusion_map = F.interpolate(occlusion_map, size=source.shape[1:3]).numpy()
-            occlusion_map = np.transpose(occlusion_map, [0, 2, 3, 1])
-            images.append(occlusion_map)
-
-        image = self.create_image_grid(*images)
-        # reshape (1, 8) to (2, 4)
-        H, W, _ = image.shape
-        base = H
-        num_image = W // H
-        row, col = 2, math.ceil(num_image/2)
-        new_image = np.zeros((row*base, col*base, 3), dtype=np.float32)
-        cnt = 0
-        for ii in range(row):
-            for jj in range(col):
-                try:
-                    new_image[ii*base:(ii+1)*base, jj*base:(jj+1)*base, :] = image[:, cnt*base:(cnt+1)*base, :]
-                except:
-                    pass
-                cnt += 1
-        new_image = (255 * new_image).astype(np.uint8)
-        return new_image
-
+from torch import nn
+
+import contextlib
+import torch.nn.functional as F
+import torch
+import torch.utils.checkpoint
+from sync_batchnorm import SynchronizedBatchNorm2d as BatchNorm2d
+
+import numpy as np
+import matplotlib.pyplot as plt
+from skimage.draw import disk as circle
+import math
+
+
+# autocast dtype of each precision, fp16 needs cuda, bf16 also runs on cpu
+PRECISION_DTYPES = {"fp32": None, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def autocast(device, dtype=None):
+    """
+    Mixed precision region on device, does nothing if dtype is None
+    """
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(torch.device(device).type, dtype=dtype)
+
+
+def full_precision(device):
+    """
+    float32 island inside an autocast region, tensors coming in still have to be cast with .float()
+    """
+    return torch.autocast(torch.device(device).type, enabled=False)
+
+
+def checkpoint_levels(stages, name, num_levels):
+    """
+    Indices of the levels of stage name that are checkpointed, stages holds whole stages ("downs")
+    or single levels ("downs.1")
+    """
+    stages = set(stages)
+    if name in stages:
+        return set(range(num_levels))
+    return {i for i in range(num_levels) if "%s.%d" % (name, i) in stages}
+
+
+def set_checkpoint_stages(model, stages):
+    """
+    Activation checkpointing for every submodule of model with a checkpoint_stages attribute,
+    each of them picks the stage names it knows from stages, () turns it off
+    """
+    for module in model.modules():
+        if hasattr(module, "checkpoint_stages"):
+            module.checkpoint_stages = tuple(stages)
+
+
+@contextlib.contextmanager
+def frozen_batch_norm_stats(module):
+    # momentum 0 keeps the running statistics of the batch norms as they are
+    norms = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    momentums = [m.momentum for m in norms]
+    for m in norms:
+        m.momentum = 0.
+    try:
+        yield
+    finally:
+        for m, momentum in zip(norms, momentums):
+            m.momentum = momentum
+
+
+def checkpoint(function, *args, **kwargs):
+    """
+    function(*args, **kwargs) without keeping its activations, they are recomputed during backward.
+    function is a module or a method of one, the recomputation does not update its batch norm
+    running statistics a second time.
+    """
+    if not torch.is_grad_enabled():
+        return function(*args, **kwargs)
+    module = function if isinstance(function, nn.Module) else function.__self__
+    recompute = []
+
+    def run(*args, **kwargs):
+        if not recompute:
+            recompute.append(True)
+            return function(*args, **kwargs)
+        with frozen_batch_norm_stats(module):
+            return function(*args, **kwargs)
+
+    return torch.utils.checkpoint.checkpoint(run, *args, use_reentrant=False, **kwargs)
+
+
+def region2gaussian(center, covar, spatial_size):
+    """
+    Transform region parameters into gaussian-like heatmap, in float32 also under autocast
+    """
+    with full_precision(center.device):
+        mean = center.float()
+        grid = coordinate_grid(spatial_size, dtype=mean.dtype, device=mean.device)
+        number_of_leading_dimensions = len(mean.shape) - 1
+
+        # the grid is separable, broadcast x over columns and y over rows instead of repeating it per region
+        shape = mean.shape[:number_of_leading_dimensions] + (1, 1)
+        x_sub = grid[0, :, 0] - mean[..., 0].view(*shape)
+        y_sub = grid[:, 0, 1].view(-1, 1) - mean[..., 1].view(*shape)
+        if isinstance(covar, float):
+            out = torch.exp(-0.5 * (x_sub ** 2 + y_sub ** 2) / covar)
+        else:
+            covar = covar.clone().detach().to(dtype=torch.float32, device=mean.device)
+            try:
+                covar_inverse = torch.inverse(covar)
+            except RuntimeError as e:
+                print(f"[WARNING] torch.inverse failed: {e}, using torch.pinverse instead.")
+                covar_inverse = torch.pinverse(covar)
+            # (x, y) covar_inverse (x, y)^T with one inverse per region
+            covar_inverse = covar_inverse.view(*shape, 2, 2)
+            under_exp = covar_inverse[..., 0, 0] * x_sub ** 2 + covar_inverse[..., 1, 1] * y_sub ** 2 \
+                + (covar_inverse[..., 0, 1] + covar_inverse[..., 1, 0]) * x_sub * y_sub
+            out = torch.exp(-0.5 * under_exp)
+
+        return out
+
+
+def make_coordinate_grid(spatial_size, type):
+    """
+    Create a meshgrid [-1,1] x [-1,1] of given spatial_size.
+    """
+    h, w = spatial_size
+    x = torch.arange(w).type(type)
+    y = torch.arange(h).type(type)
+
+    x = (2 * (x / (w - 1)) - 1)
+    y = (2 * (y / (h - 1)) - 1)
+
+    yy = y.view(-1, 1).repeat(1, w)
+    xx = x.view(1, -1).repeat(h, 1)
+
+    meshed = torch.cat([xx.unsqueeze_(2), yy.unsqueeze_(2)], 2)
+
+    return meshed
+
+
+# identity grids are requested with the same few shapes on every forward,
+# one copy per (size, dtype, device, normalized) is kept for the whole process
+COORDINATE_GRID_CACHE = {}
+
+
+def coordinate_grid(spatial_size, dtype=torch.float32, device="cpu", normalized=True):
+    """
+    Cached (h, w, 2) grid of (x, y) coordinates, [-1,1] x [-1,1] as make_coordinate_grid if normalized,
+    pixel indices otherwise. The tensor is shared, use it through broadcasting and views, never in place.
+    """
+    device = torch.device(device)
+    if device.type == "cuda" and device.index is None:
+        device = torch.device("cuda", torch.cuda.current_device())
+    key = (tuple(spatial_size), dtype, device, normalized)
+    grid = COORDINATE_GRID_CACHE.get(key)
+    if grid is None:
+        h, w = spatial_size
+        # built outside of inference mode so that it can also be used by autograd
+        with torch.inference_mode(False), torch.no_grad():
+            x = torch.arange(w, dtype=torch.float64, device=device)
+            y = torch.arange(h, dtype=torch.float64, device=device)
+            if normalized:
+                x = (2 * (x / (w - 1)) - 1)
+                y = (2 * (y / (h - 1)) - 1)
+            grid = torch.stack(torch.meshgrid(x, y, indexing="xy"), dim=-1).to(dtype)
+        COORDINATE_GRID_CACHE[key] = grid
+    return grid
+
+
+def cached_identity_grid(b, nf, spatial_size, dtype=torch.float32, device="cpu", normalized=True):
+    """
+    Cached identity flow as a (b, 2, nf, h, w) expanded view, the layout used by the DM
+    """
+    grid = coordinate_grid(spatial_size, dtype=dtype, device=device, normalized=normalized)
+    return grid.permute(2, 0, 1).unsqueeze(1).expand(b, 2, nf, *spatial_size)
+
+
+class ResBlock2d(nn.Module):
+    """
+    Res block, preserve spatial resolution.
+    """
+
+    def __init__(self, in_features, kernel_size, padding):
+        super(ResBlock2d, self).__init__()
+        self.conv1 = nn.Conv2d(in_channels=in_features, out_channels=in_features, kernel_size=kernel_size,
+                               padding=padding)
+        self.conv2 = nn.Conv2d(in_channels=in_features, out_channels=in_features, kernel_size=kernel_size,
+                               padding=padding)
+        self.norm1 = BatchNorm2d(in_features, affine=True)
+        self.norm2 = BatchNorm2d(in_features, affine=True)
+
+    def forward(self, x):
+        out = self.norm1(x)
+        out = F.relu(out)
+        out = self.conv1(out)
+        out = self.norm2(out)
+        out = F.relu(out)
+        out = self.conv2(out)
+        out += x
+        return out
+
+
+class UpBlock2d(nn.Module):
+    """
+    Upsampling block for use in decoder.
+    """
+
+    def __init__(self, in_features, out_features, kernel_size=3, padding=1, groups=1):
+        super(UpBlock2d, self).__init__()
+
+        self.conv = nn.Conv2d(in_channels=in_features, out_channels=out_features, kernel_size=kernel_size,
+                              padding=padding, groups=groups)
+        self.norm = BatchNorm2d(out_features, affine=True)
+
+    def forward(self, x):
+        out = F.interpolate(x, scale_factor=2)
+        out = self.conv(out)
+        out = self.norm(out)
+        out = F.relu(out)
+        return out
+
+
+class DownBlock2d(nn.Module):
+    """
+    Downsampling block for use in encoder.
+    """
+
+    def __init__(self, in_features, out_features, kernel_size=3, padding=1, groups=1):
+        super(DownBlock2d, self).__init__()
+        self.conv = nn.Conv2d(in_channels=in_features, out_channels=out_features, kernel_size=kernel_size,
+                              padding=padding, groups=groups)
+        self.norm = BatchNorm2d(out_features, affine=True)
+        self.pool = nn.AvgPool2d(kernel_size=(2, 2))
+
+    def forward(self, x):
+        out = self.conv(x)
+        out = self.norm(out)
+        out = F.relu(out)
+        out = self.pool(out)
+        return out
+
+
+class SameBlock2d(nn.Module):
+    """
+    Simple block, preserve spatial resolution.
+    """
+
+    def __init__(self, in_features, out_features, groups=1, kernel_size=3, padding=1):
+        super(SameBlock2d, self).__init__()
+        self.conv = nn.Conv2d(in_channels=in_features, out_channels=out_features,
+                              kernel_size=kernel_size, padding=padding, groups=groups)
+        self.norm = BatchNorm2d(out_features, affine=True)
+
+    def forward(self, x):
+        out = self.conv(x)
+        out = self.norm(out)
+        out = F.relu(out)
+        return out
+
+
+class Encoder(nn.Module):
+    """
+    Hourglass Encoder
+    """
+
+    def __init__(self, block_expansion, in_features, num_blocks=3, max_features=256, checkpoint_stages=()):
+        super(Encoder, self).__init__()
+        # "encoder" or "encoder.i", see checkpoint_levels
+        self.checkpoint_stages = tuple(checkpoint_stages)
+
+        down_blocks = []
+        for i in range(num_blocks):
+            down_blocks.append(DownBlock2d(in_features if i == 0 else min(max_features, block_expansion * (2 ** i)),
+                                           min(max_features, block_expansion * (2 ** (i + 1))),
+                                           kernel_size=3, padding=1))
+        self.down_blocks = nn.ModuleList(down_blocks)
+
+    def forward(self, x):
+        levels = checkpoint_levels(self.checkpoint_stages, "encoder", len(self.down_blocks))
+        outs = [x]
+        for i, down_block in enumerate(self.down_blocks):
+            outs.append(checkpoint(down_block, outs[-1]) if i in levels else down_block(outs[-1]))
+        return outs
+
+
+class Decoder(nn.Module):
+    """
+    Hourglass Decoder
+    """
+
+    def __init__(self, block_expansion, in_features, num_blocks=3, max_features=256, checkpoint_stages=()):
+        super(Decoder, self).__init__()
+        # "decoder" or "decoder.i", see checkpoint_levels
+        self.checkpoint_stages = tuple(checkpoint_stages)
+
+        up_blocks = []
+
+        for i in range(num_blocks)[::-1]:
+            in_filters = (1 if i == num_blocks - 1 else 2) * min(max_features, block_expansion * (2 ** (i + 1)))
+            out_filters = min(max_features, block_expansion * (2 ** i))
+            up_blocks.append(UpBlock2d(in_filters, out_filters, kernel_size=3, padding=1))
+
+        self.up_blocks = nn.ModuleList(up_blocks)
+        self.out_filters = block_expansion + in_features
+
+    def forward(self, x):
+        levels = checkpoint_levels(self.checkpoint_stages, "decoder", len(self.up_blocks))
+        out = x.pop()
+        for i, up_block in enumerate(self.up_blocks):
+            out = checkpoint(up_block, out) if i in levels else up_block(out)
+            skip = x.pop()
+            out = torch.cat([out, skip], dim=1)
+        return out
+
+
+class Hourglass(nn.Module):
+    """
+    Hourglass architecture.
+    """
+
+    def __init__(self, block_expansion, in_features, num_blocks=3, max_features=256, checkpoint_stages=()):
+        super(Hourglass, self).__init__()
+        self.encoder = Encoder(block_expansion, in_features, num_blocks, max_features, checkpoint_stages)
+        self.decoder = Decoder(block_expansion, in_features, num_blocks, max_features, checkpoint_stages)
+        self.out_filters = self.decoder.out_filters
+
+    def forward(self, x):
+        return self.decoder(self.encoder(x))
+
+
+class AntiAliasInterpolation2d(nn.Module):
+    """
+    Band-limited downsampling, for better preservation of the input signal.
+    """
+
+    def __init__(self, channels, scale):
+        super(AntiAliasInterpolation2d, self).__init__()
+        sigma = (1 / scale - 1) / 2
+        kernel_size = 2 * round(sigma * 4) + 1
+        self.ka = kernel_size // 2
+        self.kb = self.ka - 1 if kernel_size % 2 == 0 else self.ka
+
+        kernel_size = [kernel_size, kernel_size]
+        sigma = [sigma, sigma]
+        # The gaussian kernel is the product of the
+        # gaussian function of each dimension.
+        kernel = 1
+        meshgrids = torch.meshgrid(
+            [
+                torch.arange(size, dtype=torch.float32)
+                for size in kernel_size
+            ]
+        )
+        for size, std, mgrid in zip(kernel_size, sigma, meshgrids):
+            mean = (size - 1) / 2
+            kernel *= torch.exp(-(mgrid - mean) ** 2 / (2 * std ** 2))
+
+        # Make sure sum of values in gaussian kernel equals 1.
+        kernel = kernel / torch.sum(kernel)
+        # Reshape to depthwise convolutional weight
+        kernel = kernel.view(1, 1, *kernel.size())
+        kernel = kernel.repeat(channels, *[1] * (kernel.dim() - 1))
+
+        self.register_buffer('weight', kernel)
+        self.groups = channels
+        self.scale = scale
+        inv_scale = 1 / scale
+        self.int_inv_scale = int(inv_scale)
+
+    def forward(self, input):
+        if self.scale == 1.0:
+            return input
+
+        out = F.pad(input, (self.ka, self.kb, self.ka, self.kb))
+        out = F.conv2d(out, weight=self.weight, groups=self.groups)
+        out = out[:, :, ::self.int_inv_scale, ::self.int_inv_scale]
+
+        return out
+
+
+def to_homogeneous(coordinates):
+    ones_shape = list(coordinates.shape)
+    ones_shape[-1] = 1
+    ones = torch.ones(ones_shape).type(coordinates.type())
+
+    return torch.cat([coordinates, ones], dim=-1)
+
+
+def from_homogeneous(coordinates):
+    return coordinates[..., :2] / coordinates[..., 2:3]
+
+
+def draw_colored_heatmap(heatmap, colormap, bg_color):
+    parts = []
+    weights = []
+    bg_color = np.array(bg_color).reshape((1, 1, 1, 3))
+    num_regions = heatmap.shape[-1]
+    for i in range(num_regions):
+        color = np.array(colormap(i / num_regions))[:3]
+        color = color.reshape((1, 1, 1, 3))
+        part = heatmap[:, :, :, i:(i + 1)]
+        part = part / np.max(part, axis=(1, 2), keepdims=True)
+        weights.append(part)
+
+        color_part = part * color
+        parts.append(color_part)
+
+    weight = sum(weights)
+    bg_weight = 1 - np.minimum(1, weight)
+    weight = np.maximum(1, weight)
+    result = sum(parts) / weight + bg_weight * bg_color
+    return result
+
+
+class Visualizer:
+    def __init__(self, kp_size=5, draw_border=False, colormap='gist_rainbow', region_bg_color=(0, 0, 0)):
+        self.kp_size = kp_size
+        self.draw_border = draw_border
+        self.colormap = plt.get_cmap(colormap)
+        self.region_bg_color = np.array(region_bg_color)
+
+    def draw_image_with_kp(self, image, kp_array):
+        image = np.copy(image)
+        spatial_size = np.array(image.shape[:2][::-1])[np.newaxis]
+        kp_array = spatial_size * (kp_array + 1) / 2
+        num_regions = kp_array.shape[0]
+        for kp_ind, kp in enumerate(kp_array):
+            rr, cc = circle((kp[1], kp[0]), self.kp_size, shape=image.shape[:2])
+            image[rr, cc] = np.array(self.colormap(kp_ind / num_regions))[:3]
+        return image
+
+    def create_image_column_with_kp(self, images, kp):
+        image_array = np.array([self.draw_image_with_kp(v, k) for v, k in zip(images, kp)])
+        return self.create_image_column(image_array)
+
+    def create_image_column(self, images):
+        if self.draw_border:
+            images = np.copy(images)
+            images[:, :, [0, -1]] = (1, 1, 1)
+            images[:, :, [0, -1]] = (1, 1, 1)
+        return np.concatenate(list(images), axis=0)
+
+    def create_image_grid(self, *args):
+        out = []
+        for arg in args:
+            if type(arg) == tuple:
+                out.append(self.create_image_column_with_kp(arg[0], arg[1]))
+            else:
+                out.append(self.create_image_column(arg))
+        return np.concatenate(out, axis=1)
+
+    @staticmethod
+    def sample(x, index):
+        return x[index].unsqueeze(dim=0).clone().detach()
+
+    def visualize(self, driving, source, out, index=0):
+        images = []
+
+        # Source image with region centers
+        source = self.sample(source, index)
+        source = source.data.cpu()
+        source_region_params = self.sample(out['source_region_params']['shift'], index)
+        source_region_params = source_region_params.data.cpu().numpy()
+        source = np.transpose(source, [0, 2, 3, 1])
+        images.append((source, source_region_params))
+
+        if 'heatmap' in out['source_region_params']:
+            source_heatmap = self.sample(out['source_region_params']['heatmap'], index)
+            source_heatmap = F.interpolate(source_heatmap, size=source.shape[1:3])
+            source_heatmap = np.transpose(source_heatmap.data.cpu().numpy(), [0, 2, 3, 1])
+            images.append(draw_colored_heatmap(source_heatmap, self.colormap, self.region_bg_color))
+
+        # Deformed image
+        if 'deformed' in out:
+            deformed = self.sample(out['deformed'], index)
+            deformed = deformed.data.cpu().numpy()
+            deformed = np.transpose(deformed, [0, 2, 3, 1])
+            images.append(deformed)
+
+        # Equivariance visualization
+        if 'transformed_frame' in out:
+            transformed = self.sample(out['transformed_frame'], index)
+            transformed = transformed.data.cpu().numpy()
+            transformed = np.transpose(transformed, [0, 2, 3, 1])
+            transformed_kp = self.sample(out['transformed_region_params']['shift'], index)
+            transformed_kp = transformed_kp.data.cpu().numpy()
+            images.append((transformed, transformed_kp))
+
+        # Driving image with region centers
+        driving_region_params = self.sample(out['driving_region_params']['shift'], index)
+        driving_region_params = driving_region_params.data.cpu().numpy()
+        driving = self.sample(driving, index)
+        driving = driving.data.cpu().numpy()
+        driving = np.transpose(driving, [0, 2, 3, 1])
+        images.append((driving, driving_region_params))
+
+        # Heatmaps visualizations
+        if 'heatmap' in out['driving_region_params']:
+            driving_heatmap = self.sample(out['driving_region_params']['heatmap'], index)
+            driving_heatmap = F.interpolate(driving_heatmap, size=source.shape[1:3])
+            driving_heatmap = np.transpose(driving_heatmap.data.cpu().numpy(), [0, 2, 3, 1])
+            images.append(draw_colored_heatmap(driving_heatmap, self.colormap, self.region_bg_color))
+
+        # Result
+        prediction = self.sample(out['prediction'], index)
+        prediction = prediction.data.cpu().numpy()
+        prediction = np.transpose(prediction, [0, 2, 3, 1])
+        images.append(prediction)
+
+        # Occlusion map
+        if 'occlusion_map' in out:
+            occlusion_map = self.sample(out['occlusion_map'], index)
+            occlusion_map = occlusion_map.data.cpu().repeat(1, 3, 1, 1)
+            occlusion_map = F.interpolate(occlusion_map, size=source.shape[1:3]).numpy()
+            occlusion_map = np.transpose(occlusion_map, [0, 2, 3, 1])
+            images.append(occlusion_map)
+
+        image = self.create_image_grid(*images)
+        # reshape (1, 8) to (2, 4)
+        H, W, _ = image.shape
+        base = H
+        num_image = W // H
+        row, col = 2, math.ceil(num_image/2)
+        new_image = np.zeros((row*base, col*base, 3), dtype=np.float32)
+        cnt = 0
+        for ii in range(row):
+            for jj in range(col):
+                try:
+                    new_image[ii*base:(ii+1)*base, jj*base:(jj+1)*base, :] = image[:, cnt*base:(cnt+1)*base, :]
+                except:
+                    pass
+                cnt += 1
+        new_image = (255 * new_image).astype(np.uint8)
+        return new_image
+
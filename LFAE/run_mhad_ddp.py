@@ -0,0 +1,105 @@
+# multi-process LFAE training on MHAD, one process per device, e.g.
+#   torchrun --nproc_per_node=4 -m LFAE.run_mhad_ddp --config config/mhad128.yaml
+#   torchrun --nproc_per_node=2 -m LFAE.run_mhad_ddp --backend gloo    (cpu, to test scaling locally)
+# multi-node runs add --nnodes, --node_rank and --rdzv_endpoint to torchrun
+import os
+import sys
+import math
+import yaml
+from argparse import ArgumentParser
+from shutil import copy
+
+import torch
+import torch.distributed as dist
+import torch.backends.cudnn as cudnn
+
+from LFAE.mhad_dataset import FramesDataset
+from LFAE.modules.generator import Generator
+from LFAE.modules.bg_motion_predictor import BGMotionPredictor
+from LFAE.modules.region_predictor import RegionPredictor
+from LFAE.run_mhad import Logger, setup_seed
+from LFAE.train_ddp import train_ddp
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--postfix", default="")
+    parser.add_argument("--random-seed", default=1234, type=int)
+    parser.add_argument("--set-start", default=False)
+    parser.add_argument("--config",
+                        default="config/mhad128.yaml",
+                        help="path to config")
+    parser.add_argument("--log_dir",
+                        default='log',
+                        help="path to log into")
+    parser.add_argument("--checkpoint",
+                        default=None,
+                        help="path to checkpoint to restore")
+    parser.add_argument("--fp16", action="store_true",
+                        help="Mixed precision training with fp16 autocast and loss scaling.")
+    parser.add_argument("--bf16", action="store_true",
+                        help="Mixed precision training with bf16 autocast.")
+    parser.add_argument("--backend", default="nccl" if torch.cuda.is_available() else "gloo",
+                        choices=["nccl", "gloo"],
+                        help="nccl trains on one gpu per process, gloo on cpu")
+    opt = parser.parse_args()
+
+    # RANK, LOCAL_RANK, WORLD_SIZE and the rendezvous address are set by torchrun
+    dist.init_process_group(backend=opt.backend)
+    rank = dist.get_rank()
+    if opt.backend == "nccl":
+        device = torch.device("cuda", int(os.environ["LOCAL_RANK"]))
+        torch.cuda.set_device(device)
+        cudnn.enabled = True
+        cudnn.benchmark = True
+    else:
+        device = torch.device("cpu")
+
+    # same initialization on every process, DDP broadcasts the parameters of rank 0 anyway
+    setup_seed(opt.random_seed)
+
+    with open(opt.config) as f:
+        config = yaml.safe_load(f)
+
+    log_dir = os.path.join(opt.log_dir, os.path.basename(opt.config).split('.')[0]+opt.postfix)
+    config["snapshots"] = os.path.join(log_dir, 'snapshots'+opt.postfix)
+    config["imgshots"] = os.path.join(log_dir, 'imgshots'+opt.postfix)
+    config["set_start"] = opt.set_start
+    if rank == 0:
+        os.makedirs(config["snapshots"], exist_ok=True)
+        os.makedirs(config["imgshots"], exist_ok=True)
+        if not os.path.exists(os.path.join(log_dir, os.path.basename(opt.config))):
+            copy(opt.config, log_dir)
+        log_txt = os.path.join(log_dir,
+                               "B"+format(config['train_params']['batch_size'], "04d")+
+                               "E"+format(config['train_params']['max_epochs'], "04d")+".log")
+        sys.stdout = Logger(log_txt, sys.stdout)
+
+        print("postfix:", opt.postfix)
+        print("checkpoint:", opt.checkpoint)
+        print("batch size:", config['train_params']['batch_size'], "over", dist.get_world_size(), "processes")
+
+    generator = Generator(num_regions=config['model_params']['num_regions'],
+                          num_channels=config['model_params']['num_channels'],
+                          revert_axis_swap=config['model_params']['revert_axis_swap'],
+                          **config['model_params']['generator_params']).to(device)
+
+    region_predictor = RegionPredictor(num_regions=config['model_params']['num_regions'],
+                                       num_channels=config['model_params']['num_channels'],
+                                       estimate_affine=config['model_params']['estimate_affine'],
+                                       **config['model_params']['region_predictor_params']).to(device)
+
+    bg_predictor = BGMotionPredictor(num_channels=config['model_params']['num_channels'],
+                                     **config['model_params']['bg_predictor_params']).to(device)
+
+    dataset = FramesDataset(**config['dataset_params'])
+    config["num_example_per_epoch"] = config['train_params']['num_repeats'] * len(dataset)
+    config["num_step_per_epoch"] = math.ceil(config["num_example_per_epoch"]/float(config['train_params']['batch_size']))
+    config["save_ckpt_freq"] = config["num_step_per_epoch"] * (config['train_params']['max_epochs'] // 10)
+    # save 10 checkpoints in total
+    if rank == 0:
+        print("save ckpt freq:", config["save_ckpt_freq"])
+        print("Training...")
+    train_ddp(config, generator, region_predictor, bg_predictor, opt.checkpoint, log_dir, dataset, device,
+              precision="bf16" if opt.bf16 else "fp16" if opt.fp16 else "fp32")
+    dist.destroy_process_group()
@@ -0,0 +1,158 @@
+# train a LFAE with one process per device, launched by LFAE/run_mhad_ddp.py
+import os.path
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from LFAE.modules.model import ReconstructionModel
+from torch.optim.lr_scheduler import MultiStepLR
+from LFAE.frames_dataset import DatasetRepeater
+from LFAE.modules.util import set_checkpoint_stages
+from LFAE.train import AverageMeter, checkpoint_dict
+from LFAE.checkpoint_manager import CheckpointManager
+import timeit
+import math
+
+
+def save_checkpoint(ckpt_manager, path, actual_step, epoch_cnt, generator, region_predictor, bg_predictor, optimizer,
+                    batch_size, scaler, step=None):
+    # same content as the checkpoints of LFAE/train.py, only written by rank 0, in the background
+    if dist.get_rank() != 0:
+        return
+    ckpt_manager.save(checkpoint_dict(actual_step, epoch_cnt, generator, region_predictor, bg_predictor, optimizer,
+                                      batch_size, scaler), path, step=step)
+
+
+def train_ddp(config, generator, region_predictor, bg_predictor, checkpoint, log_dir, dataset, device,
+              precision="fp32"):
+    """
+    Same schedule as LFAE.train.train with DistributedDataParallel, the global batch
+    train_params['batch_size'] is split over the processes of the default process group.
+    """
+    train_params = config['train_params']
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    assert train_params['batch_size'] % world_size == 0, "batch_size must be divisible by the number of processes"
+    batch_size = train_params['batch_size'] // world_size
+
+    optimizer = torch.optim.Adam(list(generator.parameters()) +
+                                 list(region_predictor.parameters()) +
+                                 list(bg_predictor.parameters()), lr=train_params['lr'], betas=(0.5, 0.999))
+    scaler = torch.cuda.amp.GradScaler(enabled=precision == "fp16")
+
+    start_epoch = 0
+    start_step = 0
+    if checkpoint is not None:
+        ckpt = torch.load(checkpoint, map_location=device)
+        if config["set_start"]:
+            start_step = int(math.ceil(ckpt['example'] / train_params['batch_size']))
+            start_epoch = ckpt['epoch']
+        generator.load_state_dict(ckpt['generator'])
+        region_predictor.load_state_dict(ckpt['region_predictor'])
+        bg_predictor.load_state_dict(ckpt['bg_predictor'])
+        if 'optimizer' in list(ckpt.keys()):
+            optimizer.load_state_dict(ckpt['optimizer'])
+        # empty when saved without fp16, an enabled scaler refuses it
+        if ckpt.get('scaler'):
+            scaler.load_state_dict(ckpt['scaler'])
+
+    scheduler = MultiStepLR(optimizer, train_params['epoch_milestones'], gamma=0.1, last_epoch=start_epoch - 1)
+    if train_params.get('num_repeats', 1) != 1:
+        dataset = DatasetRepeater(dataset, train_params['num_repeats'])
+
+    # every process reads a disjoint 1 / world_size of each epoch
+    sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True, drop_last=True)
+    dataloader = DataLoader(dataset, batch_size=batch_size, sampler=sampler,
+                            num_workers=train_params['dataloader_workers'], drop_last=True,
+                            pin_memory=device.type == "cuda", persistent_workers=train_params['dataloader_workers'] > 0)
+
+    model = ReconstructionModel(region_predictor, bg_predictor, generator, train_params,
+                                precision=precision).to(device)
+    set_checkpoint_stages(model, train_params.get('checkpoint_stages', ()))
+    if device.type == "cuda":
+        # batch statistics over the global batch, torch SyncBatchNorm only runs on gpus,
+        # with gloo on cpu every process normalizes its own share of the batch
+        model = torch.nn.SyncBatchNorm.convert_sync_batchnorm(model)
+    # needed when some loss weights are 0, e.g. the generator is unused without the perceptual loss
+    model = DistributedDataParallel(model, device_ids=[device.index] if device.type == "cuda" else None,
+                                    find_unused_parameters=train_params.get('find_unused_parameters', False))
+
+    # rank 0 writes the checkpoints in the background, see LFAE.train.train for keep_ckpt and milestone_ckpt_freq
+    ckpt_manager = CheckpointManager(keep_last=train_params.get('keep_ckpt', 0),
+                                     milestone_every=train_params.get('milestone_ckpt_freq', 0)) if rank == 0 else None
+    batch_time = AverageMeter()
+    data_time = AverageMeter()
+    loss_meters = {}
+
+    cnt = 0
+    epoch_cnt = start_epoch
+    actual_step = start_step
+    final_step = config["num_step_per_epoch"] * train_params["max_epochs"]
+
+    while actual_step < final_step:
+        sampler.set_epoch(epoch_cnt)
+        iter_end = timeit.default_timer()
+
+        for i_iter, x in enumerate(dataloader):
+            actual_step = int(start_step + cnt)
+            data_time.update(timeit.default_timer() - iter_end)
+            x = {key: value.to(device, non_blocking=True) if torch.is_tensor(value) else value
+                 for key, value in x.items()}
+            optimizer.zero_grad(set_to_none=True)
+            losses, generated = model(x)
+            loss_values = {key: val.mean() for key, val in losses.items()}
+            loss = sum(loss_values.values())
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+
+            batch_time.update(timeit.default_timer() - iter_end)
+            iter_end = timeit.default_timer()
+
+            # kept on device, synchronized once per epoch
+            for key, value in [("loss", loss)] + list(loss_values.items()):
+                loss_meters.setdefault(key, AverageMeter()).update(value.detach(), batch_size)
+
+            if actual_step % config["save_ckpt_freq"] == 0 and cnt != 0:
+                if rank == 0:
+                    print('taking snapshot...')
+                save_checkpoint(ckpt_manager,
+                                os.path.join(config["snapshots"],
+                                             'RegionMM_' + format(train_params["batch_size"], "04d") +
+                                             '_S' + format(actual_step, "06d") + '.pth'),
+                                actual_step, epoch_cnt, generator, region_predictor, bg_predictor, optimizer,
+                                train_params["batch_size"], scaler, step=actual_step)
+
+            if actual_step % train_params["update_ckpt_freq"] == 0 and cnt != 0:
+                if rank == 0:
+                    print('updating snapshot...')
+                save_checkpoint(ckpt_manager, os.path.join(config["snapshots"], 'RegionMM.pth'),
+                                actual_step, epoch_cnt, generator, region_predictor, bg_predictor, optimizer,
+                                train_params["batch_size"], scaler)
+
+            if actual_step >= final_step:
+                break
+
+            cnt += 1
+
+        scheduler.step()
+        epoch_cnt += 1
+        # running averages of all processes
+        averages = torch.stack([meter.avg for meter in loss_meters.values()]).float()
+        dist.all_reduce(averages)
+        averages /= world_size
+        if rank == 0:
+            print("epoch %d, lr= %.7f, %.3fs/step (data %.3fs)"
+                  % (epoch_cnt, optimizer.param_groups[0]["lr"], batch_time.avg, data_time.avg))
+            print("\t".join("%s %.4f" % (key, value) for key, value in zip(loss_meters, averages.tolist())))
+    if rank == 0:
+        print('save the final model...')
+    save_checkpoint(ckpt_manager,
+                    os.path.join(config["snapshots"],
+                                 'RegionMM_' + format(train_params["batch_size"], "04d") +
+                                 '_S' + format(actual_step, "06d") + '.pth'),
+                    actual_step, epoch_cnt, generator, region_predictor, bg_predictor, optimizer,
+                    train_params["batch_size"], scaler, step=actual_step)
+    if rank == 0:
+        ckpt_manager.flush()
+    dist.barrier()
@@ -0,0 +1,169 @@
+# lazy access to the frames of a video for the LFAE datasets: frame count and random access for a folder of
+# frames, an image of concatenated frames or a video container, only the frames asked for are decoded
+import os
+import numbers
+from collections import OrderedDict
+
+import imageio
+import numpy as np
+from skimage import io
+from skimage.color import gray2rgb
+
+
+def to_rgb(frame):
+    # gray and RGBA frames as (H, W, 3)
+    if frame.ndim == 2:
+        return gray2rgb(frame)
+    if frame.shape[2] == 1:
+        return np.repeat(frame, 3, axis=2)
+    return frame[..., :3]
+
+
+class VideoReader(object):
+    """
+    Frame count and random access to the frames of one video, a frame is decoded when it is read
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def read(self, idx):
+        # frame idx as (H, W, 3) in its stored dtype
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FolderReader(VideoReader):
+    # folder with one image per frame, frames in sorted file name order
+    def __init__(self, path):
+        super(FolderReader, self).__init__(path)
+        self.frame_names = sorted(os.listdir(path))
+
+    def __len__(self):
+        return len(self.frame_names)
+
+    def read(self, idx):
+        return to_rgb(io.imread(os.path.join(self.path, self.frame_names[idx])))
+
+
+class StackedImageReader(VideoReader):
+    # one image of frames concatenated from left to right, frame_shape[0] columns each. PNG and JPG have no
+    # random access, the image is decoded once when opened and frames are views into it
+    def __init__(self, path, frame_shape):
+        super(StackedImageReader, self).__init__(path)
+        if frame_shape is None:
+            raise ValueError('Frame shape can not be None for stacked png format.')
+        self.frame_width = frame_shape if isinstance(frame_shape, numbers.Number) else frame_shape[0]
+        self.image = to_rgb(io.imread(path))
+
+    def __len__(self):
+        return self.image.shape[1] // self.frame_width
+
+    def read(self, idx):
+        return self.image[:, idx * self.frame_width:(idx + 1) * self.frame_width]
+
+
+class ContainerReader(VideoReader):
+    # '.gif', '.mp4' and '.mov' through an imageio reader kept open, frames are decoded by seeking to them
+    def __init__(self, path):
+        super(ContainerReader, self).__init__(path)
+        self.reader = imageio.get_reader(path)
+        num_frames = self.reader.get_length()
+        if num_frames == float('inf'):
+            # ffmpeg does not know the length of a stream before counting
+            num_frames = self.reader.count_frames()
+        self.num_frames = int(num_frames)
+
+    def __len__(self):
+        return self.num_frames
+
+    def read(self, idx):
+        return to_rgb(np.asarray(self.reader.get_data(int(idx))))
+
+    def close(self):
+        self.reader.close()
+
+
+def open_video(path, frame_shape=None):
+    """
+    Reader of a video which can be:
+      - an image of concatenated frames
+      - '.mp4', '.gif' and '.mov'
+      - folder with all frames
+    """
+    # numpy strings (np.random.choice of paths) make os.listdir return bytes
+    path = str(path)
+    if os.path.isdir(path):
+        return FolderReader(path)
+    if path.lower().endswith('.png') or path.lower().endswith('.jpg'):
+        return StackedImageReader(path, frame_shape)
+    if path.lower().endswith('.gif') or path.lower().endswith('.mp4') or path.lower().endswith('.mov'):
+        return ContainerReader(path)
+    raise Exception("Unknown file extensions  %s" % path)
+
+
+class FrameCache(object):
+    """
+    LRU of the open readers of the last num_videos videos and of the last num_frames converted frames, for the
+    training datasets that only read a few frames of a video at a time. convert_fn turns a decoded frame into
+    the frame the dataset returns (resize, float conversion), cached frames are read-only.
+    The cache belongs to the process using it: every DataLoader worker starts with an empty one
+    """
+
+    def __init__(self, convert_fn, frame_shape=None, num_videos=8, num_frames=64):
+        self.convert_fn = convert_fn
+        self.frame_shape = frame_shape
+        self.num_videos = num_videos
+        self.num_frames = num_frames
+        self.clear()
+
+    def clear(self):
+        self.pid = os.getpid()
+        self.readers = OrderedDict()
+        self.frames = OrderedDict()
+
+    def __getstate__(self):
+        # open readers are not sent to the workers
+        state = self.__dict__.copy()
+        state['readers'] = OrderedDict()
+        state['frames'] = OrderedDict()
+        return state
+
+    def reader(self, path):
+        path = str(path)
+        if self.pid != os.getpid():
+            # forked worker, the readers of the parent must not be shared
+            self.clear()
+        reader = self.readers.pop(path, None)
+        if reader is None:
+            reader = open_video(path, self.frame_shape)
+        self.readers[path] = reader
+        if len(self.readers) > self.num_videos:
+            self.readers.popitem(last=False)[1].close()
+        return reader
+
+    def video_length(self, path):
+        return len(self.reader(path))
+
+    def read(self, path, frame_idx):
+        """
+        Frames frame_idx of the video at path, as a list of converted frames
+        """
+        path = str(path)
+        frames = []
+        for idx in frame_idx:
+            key = (path, int(idx))
+            frame = self.frames.pop(key, None)
+            if frame is None:
+                frame = self.convert_fn(self.reader(path).read(int(idx)))
+                frame.setflags(write=False)
+            self.frames[key] = frame
+            frames.append(frame)
+        while len(self.frames) > self.num_frames:
+            self.frames.popitem(last=False)
+        return frames
@@ -0,0 +1,85 @@
+# cached listing of an MHAD frame directory (one folder of frames per video, see preprocess_MHAD.py): frame
+# names, frame count, action, subject, trial and train/test split of every video. Built once with one listdir
+# per video and reloaded as long as the modification time of data_dir is unchanged, so that building a
+# dataset or loading a clip needs no directory scan. Read by the MHAD datasets in DM/datasets_mhad.py and by
+# analyse_MHAD in preprocess_MHAD.py, e.g. to build it ahead of training
+#   python -m preprocessing.manifest_MHAD --data-dir datasets/UTD-MHAD/crop_image_128
+import argparse
+import os
+import json
+import hashlib
+import timeit
+
+from preprocessing.pack_MHAD import list_videos
+
+data_dir = "/kaggle/input/mhad-mini/crop_image_mini"
+MANIFEST_DIR = "log/manifest"
+TRAIN_ID = [1, 5, 2, 3]
+TEST_ID = [6, 8, 4, 7]
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Build the manifest of an MHAD frame directory")
+    parser.add_argument("--data-dir", type=str, default=data_dir)
+    parser.add_argument("--manifest-dir", type=str, default=MANIFEST_DIR)
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Rebuild even if data_dir is unchanged, e.g. after frames changed inside a video folder.")
+    return parser.parse_args()
+
+
+def manifest_path(data_dir, manifest_dir=MANIFEST_DIR):
+    # one manifest per data_dir, kept outside of it since data_dir may be read-only
+    data_dir = os.path.abspath(data_dir)
+    key = hashlib.md5(data_dir.encode()).hexdigest()[:8]
+    return os.path.join(manifest_dir, "%s_%s.json" % (os.path.basename(data_dir), key))
+
+
+def build_manifest(data_dir, mtime_ns):
+    videos = list_videos(data_dir)
+    for video in videos:
+        if video["subject"] in TRAIN_ID:
+            video["split"] = "train"
+        elif video["subject"] in TEST_ID:
+            video["split"] = "test"
+        else:
+            video["split"] = None
+    return {"data_dir": os.path.abspath(data_dir),
+            "mtime_ns": mtime_ns,
+            "videos": videos}
+
+
+def load_manifest(data_dir, manifest_dir=MANIFEST_DIR, rebuild=False):
+    """
+    Manifest of data_dir, rebuilt if a video was added or removed since it was saved (the mtime of data_dir
+    changed). Frames changed inside an existing video folder leave data_dir untouched, use rebuild=True
+    """
+    path = manifest_path(data_dir, manifest_dir)
+    # taken before listing, a change during the listing makes the next load rebuild
+    mtime_ns = os.stat(data_dir).st_mtime_ns
+    if not rebuild and os.path.isfile(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest["mtime_ns"] == mtime_ns:
+            return manifest
+    manifest = build_manifest(data_dir, mtime_ns)
+    try:
+        os.makedirs(manifest_dir, exist_ok=True)
+        # several processes may build it at once, each writes its own file and renames it
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print("manifest of %s not saved: %s" % (data_dir, e))
+    return manifest
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    start = timeit.default_timer()
+    manifest = load_manifest(args.data_dir, args.manifest_dir, rebuild=args.rebuild)
+    videos = manifest["videos"]
+    print("%d videos (%d train, %d test), %d frames, %.2fs -> %s"
+          % (len(videos), sum(x["split"] == "train" for x in videos), sum(x["split"] == "test" for x in videos),
+             sum(x["num_frames"] for x in videos), timeit.default_timer() - start,
+             manifest_path(args.data_dir, args.manifest_dir)))
@@ -0,0 +1,97 @@
+# pack the cropped MHAD frame directories (one folder of images per video, see preprocess_MHAD.py) into
+# a single uint8 (total frames, H, W, 3) memmap, frames.npy, in which the frames of every video are
+# contiguous, and index.json with offset, frame count, subject, action and trial of every video.
+# read back by MHAD_packed and friends in DM/datasets_mhad.py, e.g.
+#   python -m preprocessing.pack_MHAD --data-dir datasets/UTD-MHAD/crop_image_mini --pack-dir datasets/UTD-MHAD/packed128
+import argparse
+import os
+import json
+import timeit
+
+import imageio
+import numpy as np
+import cv2
+from misc import resize
+
+data_dir = "/kaggle/input/mhad-mini/crop_image_mini"
+PACK_DIR = "log/packed_mhad128"
+INPUT_SIZE = 128
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Pack MHAD frame directories into a uint8 memmap")
+    parser.add_argument("--data-dir", type=str, default=data_dir)
+    parser.add_argument("--pack-dir", type=str, default=PACK_DIR,
+                        help="Where to save frames.npy and index.json.")
+    parser.add_argument("--image-size", type=int, default=INPUT_SIZE,
+                        help="Frames are resized (and padded) to this size once here, 0 keeps the original frames.")
+    return parser.parse_args()
+
+
+def parse_video_name(video_name):
+    # a{action}_s{subject}_t{trial}
+    action, subject, trial = video_name.split("_")[:3]
+    return int(action[1:]), int(subject[1:]), int(trial[1:])
+
+
+def read_frame(frame_path, image_size):
+    """
+    One frame as uint8 (H, W, 3), resized the same way as the MHAD datasets if image_size is not 0
+    """
+    img = imageio.v2.imread(frame_path)[:, :, :3]
+    if image_size:
+        img = resize(img.astype(np.float32), image_size, interpolation=cv2.INTER_AREA)
+        img = np.clip(np.rint(img), 0, 255).astype(np.uint8)
+    return img
+
+
+def list_videos(data_dir):
+    """
+    Index entries of all videos in data_dir, in sorted order, without offsets
+    """
+    videos = []
+    for idx, video_name in enumerate(sorted(os.listdir(data_dir))):
+        action, subject, trial = parse_video_name(video_name)
+        frame_name_list = sorted(os.listdir(os.path.join(data_dir, video_name)))
+        videos.append({"name": video_name,
+                       "index": idx,
+                       "action": action,
+                       "subject": subject,
+                       "trial": trial,
+                       "num_frames": len(frame_name_list),
+                       "frames": frame_name_list})
+    return videos
+
+
+def pack_videos(data_dir, pack_dir, image_size):
+    os.makedirs(pack_dir, exist_ok=True)
+    start = timeit.default_timer()
+    videos = list_videos(data_dir)
+    offset = 0
+    for video in videos:
+        video["offset"] = offset
+        offset += video["num_frames"]
+    total_num_frames = offset
+    frame_shape = read_frame(os.path.join(data_dir, videos[0]["name"], videos[0]["frames"][0]), image_size).shape
+    print("num videos, num frames, frame shape:", len(videos), total_num_frames, frame_shape)
+
+    store = np.lib.format.open_memmap(os.path.join(pack_dir, "frames.npy"), mode="w+",
+                                      dtype=np.uint8, shape=(total_num_frames,) + frame_shape)
+    for video in videos:
+        for idx, frame_name in enumerate(video.pop("frames")):
+            store[video["offset"] + idx] = read_frame(os.path.join(data_dir, video["name"], frame_name), image_size)
+        print(video["name"], video["num_frames"], "%.1fs" % (timeit.default_timer() - start))
+    store.flush()
+
+    index = {"image_size": image_size,
+             "frame_shape": list(frame_shape),
+             "num_frames": total_num_frames,
+             "videos": videos}
+    with open(os.path.join(pack_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+    print("done, %.1fs, %.1f MB" % (timeit.default_timer() - start, store.nbytes / 2 ** 20))
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    pack_videos(args.data_dir, args.pack_dir, args.image_size)
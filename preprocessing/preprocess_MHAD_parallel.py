@@ -0,0 +1,195 @@
+# crop and resize the MHAD RGB videos in parallel, straight into the packed format read by MHAD_packed and
+# friends in DM/datasets_mhad.py (frames.npy and index.json, see pack_MHAD.py), without writing PNG frames.
+# Every trial is decoded frame by frame from its AVI by a worker of a process pool and saved as a uint8
+# (num frames, image_size, image_size, 3) shard; shards done are listed in a manifest so that an interrupted
+# run resumes where it stopped. The shards are then concatenated into frames.npy, e.g.
+#   python -m preprocessing.preprocess_MHAD_parallel --data-dir datasets/UTD-MHAD --pack-dir datasets/UTD-MHAD/packed128
+import argparse
+import os
+import json
+import timeit
+from multiprocessing import Pool
+from functools import partial
+
+import numpy as np
+import cv2
+from preprocessing.preprocess_MHAD import rgb_crop_box
+
+data_dir = "datasets/UTD-MHAD"
+PACK_DIR = "datasets/UTD-MHAD/packed128"
+INPUT_SIZE = 128
+NUM_WORKERS = 8
+STAGES = ("decode", "resize", "write")
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Parallel MHAD preprocessing into a packed frame store")
+    parser.add_argument("--data-dir", type=str, default=data_dir,
+                        help="UTD-MHAD root with the RGB and Depth folders.")
+    parser.add_argument("--pack-dir", type=str, default=PACK_DIR,
+                        help="Where to save frames.npy and index.json, the shards go to its shards folder.")
+    parser.add_argument("--image-size", type=int, default=INPUT_SIZE)
+    parser.add_argument("--num-workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--remove-shards", action="store_true",
+                        help="Remove the shards once packed, a later run then starts over.")
+    return parser.parse_args()
+
+
+def list_trials(data_dir):
+    """
+    (name, action, subject, trial, avi path) of every trial that has both an RGB video and a depth map,
+    the depth map is only checked for existence
+    """
+    trials = []
+    for action in range(1, 28):
+        for subject in range(1, 9):
+            for trial in range(1, 5):
+                avi_path = os.path.join(data_dir, "RGB", f'a{action}_s{subject}_t{trial}_color.avi')
+                depth_path = os.path.join(data_dir, "Depth", f'a{action}_s{subject}_t{trial}_depth.mat')
+                if os.path.isfile(avi_path) and os.path.isfile(depth_path):
+                    trials.append((f'a{action}_s{subject}_t{trial}', action, subject, trial, avi_path))
+    return trials
+
+
+def init_worker():
+    # one process per trial already, cv2 must not start its own threads in every worker
+    cv2.setNumThreads(1)
+
+
+def process_trial(trial, shard_dir, image_size):
+    """
+    Decode, crop and resize the frames of one trial one at a time and save them as a uint8 shard,
+    the same frames as save_crop_image in preprocess_MHAD.py. Returns the manifest entry of the trial
+    """
+    name, action, subject, trial_idx, avi_path = trial
+    y_min, y_max, x_min, x_max = rgb_crop_box()
+    times = dict.fromkeys(STAGES, 0.)
+    frame_list = []
+    cap = cv2.VideoCapture(avi_path)
+    while True:
+        start = timeit.default_timer()
+        ret, frame = cap.read()
+        times["decode"] += timeit.default_timer() - start
+        if not ret:
+            break
+        start = timeit.default_timer()
+        # only the cropped and resized frame is kept, BGR -> RGB on the small frame
+        frame = cv2.resize(frame[y_min:y_max, x_min:x_max], (image_size, image_size), interpolation=cv2.INTER_AREA)
+        frame_list.append(frame[:, :, ::-1])
+        times["resize"] += timeit.default_timer() - start
+    cap.release()
+
+    start = timeit.default_timer()
+    shard_path = os.path.join(shard_dir, name + ".npy")
+    # written under another name first, an interrupted write never looks like a finished shard
+    with open(shard_path + ".tmp", "wb") as f:
+        # a video that cannot be decoded gives an empty shard, left out when packing
+        np.save(f, np.array(frame_list, dtype=np.uint8).reshape((-1, image_size, image_size, 3)))
+    os.replace(shard_path + ".tmp", shard_path)
+    times["write"] += timeit.default_timer() - start
+    return {"name": name,
+            "action": action,
+            "subject": subject,
+            "trial": trial_idx,
+            "num_frames": len(frame_list),
+            "times": times}
+
+
+def read_manifest(shard_dir):
+    # manifest entries of the shards already written, by video name
+    manifest_path = os.path.join(shard_dir, "manifest.jsonl")
+    done = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line of an interrupted run
+                    continue
+                if os.path.isfile(os.path.join(shard_dir, entry["name"] + ".npy")):
+                    done[entry["name"]] = entry
+    return done
+
+
+def pack_shards(shard_dir, pack_dir, image_size, entries):
+    """
+    Concatenate the shards into frames.npy and write index.json, in the sorted video name order of pack_MHAD.py
+    """
+    videos = []
+    offset = 0
+    entries = [entry for entry in entries if entry["num_frames"] > 0]
+    for idx, entry in enumerate(sorted(entries, key=lambda x: x["name"])):
+        videos.append({"name": entry["name"],
+                       "index": idx,
+                       "action": entry["action"],
+                       "subject": entry["subject"],
+                       "trial": entry["trial"],
+                       "num_frames": entry["num_frames"],
+                       "offset": offset})
+        offset += entry["num_frames"]
+    frame_shape = (image_size, image_size, 3)
+    store = np.lib.format.open_memmap(os.path.join(pack_dir, "frames.npy"), mode="w+",
+                                      dtype=np.uint8, shape=(offset,) + frame_shape)
+    for video in videos:
+        shard = np.load(os.path.join(shard_dir, video["name"] + ".npy"), mmap_mode="r")
+        store[video["offset"]:video["offset"] + video["num_frames"]] = shard
+    store.flush()
+    index = {"image_size": image_size,
+             "frame_shape": list(frame_shape),
+             "num_frames": offset,
+             "videos": videos}
+    with open(os.path.join(pack_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+    return store.nbytes
+
+
+def preprocess(data_dir, pack_dir, image_size, num_workers, remove_shards=False):
+    start = timeit.default_timer()
+    shard_dir = os.path.join(pack_dir, "shards")
+    os.makedirs(shard_dir, exist_ok=True)
+    trials = list_trials(data_dir)
+    done = read_manifest(shard_dir)
+    todo = [trial for trial in trials if trial[0] not in done]
+    list_time = timeit.default_timer() - start
+    print("%d trials, %d already done, %d to process with %d workers"
+          % (len(trials), len(done), len(todo), num_workers))
+
+    stage_times = dict.fromkeys(STAGES, 0.)
+    num_frames = 0
+    with open(os.path.join(shard_dir, "manifest.jsonl"), "a") as manifest, \
+            Pool(num_workers, initializer=init_worker) as pool:
+        results = pool.imap_unordered(partial(process_trial, shard_dir=shard_dir, image_size=image_size), todo)
+        for idx, entry in enumerate(results):
+            # the shard is complete once its entry is in the manifest
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            done[entry["name"]] = entry
+            for stage in STAGES:
+                stage_times[stage] += entry["times"][stage]
+            num_frames += entry["num_frames"]
+            print("[%d/%d] %s %d frames, %.1fs" % (idx + 1, len(todo), entry["name"], entry["num_frames"],
+                                                   timeit.default_timer() - start))
+    process_time = timeit.default_timer() - start - list_time
+
+    pack_start = timeit.default_timer()
+    nbytes = pack_shards(shard_dir, pack_dir, image_size, [done[trial[0]] for trial in trials])
+    pack_time = timeit.default_timer() - pack_start
+    if remove_shards:
+        for name in done:
+            os.remove(os.path.join(shard_dir, name + ".npy"))
+        os.remove(os.path.join(shard_dir, "manifest.jsonl"))
+
+    # decode, resize and write are summed over the workers, the other stages are wall clock
+    print("stage      time (s)  ms/frame")
+    print("%-8s %10.1f" % ("list", list_time))
+    for stage in STAGES:
+        print("%-8s %10.1f %9.2f" % (stage, stage_times[stage], 1e3 * stage_times[stage] / max(num_frames, 1)))
+    print("%-8s %10.1f  (%d frames, %d workers)" % ("process", process_time, num_frames, num_workers))
+    print("%-8s %10.1f  (%.1f MB)" % ("pack", pack_time, nbytes / 2 ** 20))
+    print("total    %10.1f" % (timeit.default_timer() - start))
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    preprocess(args.data_dir, args.pack_dir, args.image_size, args.num_workers, args.remove_shards)